@@ -0,0 +1,127 @@
+"""
+Admission control for alignment requests.
+
+- A global limit on how many alignments run at once (one per core by default).
+- A token bucket per client: a client may send `burst` requests back to back, after which
+  it gets one more every `refill_sec` seconds.
+- Requests that arrive while every slot is busy wait in a queue that is served round-robin
+  across clients, so one client with many requests cannot starve the others. A request
+  that waits longer than `max_wait` seconds is rejected. A rejected request does not use up
+  its token.
+- The per-client table is bounded: the least recently seen clients are dropped first.
+
+Usage:
+    if not ADMISSION.acquire(ip):
+        return "Too many requests"
+    try:
+        ...
+    finally:
+        ADMISSION.release()
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class TokenBucket:
+    def __init__(self, burst, refill_sec):
+        self.capacity = float(burst)
+        self.rate = 1.0 / refill_sec
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1.0)
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent=None, *, burst=3, refill_sec=30, max_wait=30, max_queue=100, max_clients=10000):
+        self.max_concurrent = max(1, int(max_concurrent or os.cpu_count() or 1))
+        self.burst = burst
+        self.refill_sec = refill_sec
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.max_clients = max_clients
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        self._buckets = OrderedDict()  # client -> TokenBucket, least recently seen first
+        self._waiting = OrderedDict()  # client -> deque of Events, in round-robin order
+
+    def acquire(self, client):
+        """Wait for a slot. Returns False if the client is rate limited or no slot frees up in time."""
+        with self._lock:
+            bucket = self._bucket(client)
+            if not bucket.take():
+                return False
+            if self._active < self.max_concurrent and not self._waiting:
+                self._active += 1
+                return True
+            if self._queued >= self.max_queue:
+                bucket.refund()
+                return False
+            event = threading.Event()
+            self._waiting.setdefault(client, deque()).append(event)
+            self._queued += 1
+
+        event.wait(self.max_wait)
+
+        with self._lock:
+            if event.is_set():
+                # release() handed its slot straight to us
+                return True
+            waiters = self._waiting.get(client)
+            if waiters is not None and event in waiters:
+                waiters.remove(event)
+                if not waiters:
+                    del self._waiting[client]
+                self._queued -= 1
+            # Not served: give the token back, as when the queue is full
+            bucket.refund()
+            return False
+
+    def release(self):
+        with self._lock:
+            if not self._waiting:
+                self._active = max(0, self._active - 1)
+                return
+            # Hand the slot to the next client in round-robin order
+            client, waiters = next(iter(self._waiting.items()))
+            event = waiters.popleft()
+            if waiters:
+                self._waiting.move_to_end(client)
+            else:
+                del self._waiting[client]
+            self._queued -= 1
+            event.set()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "active": self._active,
+                "queued": self._queued,
+                "max_concurrent": self.max_concurrent,
+                "clients": len(self._buckets),
+            }
+
+    def _bucket(self, client):
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = TokenBucket(self.burst, self.refill_sec)
+            self._buckets[client] = bucket
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        return bucket
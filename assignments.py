@@ -0,0 +1,134 @@
+"""
+The assignments one grading service serves.
+
+An assignment is a folder under ASSIGNMENTS_ROOT ($ASSIGNMENTS_ROOT, default data/) with a
+reference/ subfolder in the layout reference.py reads (domain.pddl, p0N.pddl, plan.p0N.pddl),
+and is named after the folder: data/queens_example/reference is "queens_example". The tree is
+scanned again at most every DISCOVER_SEC seconds, so assignments added later are picked up
+without a restart.
+
+An assignment's reference bundle is loaded on its first request, not at startup, and stays in
+memory (and watched for changes) while the loaded bundles fit in ASSIGNMENT_MEMORY_MB
+($ASSIGNMENT_MEMORY_MB, default 512). Past that, the least recently used bundles are evicted,
+in this process and in the merge_pool workers' caches, and are loaded again when next used.
+A bundle's size is how much the process grew while loading it (see ReferenceBundle.memory_mb),
+so the budget is approximate, but it does cover the parsed and grounded tasks.
+
+Usage:
+    ASSIGNMENTS.folder("queens_example")     # its reference folder, None if there is no such assignment
+    bundle = ASSIGNMENTS.bundle("queens_example")   # loaded on first use
+"""
+import glob
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import merge_pool
+import metrics
+from reference import REFERENCES
+
+ASSIGNMENTS_ROOT = os.environ.get("ASSIGNMENTS_ROOT", "data")
+ASSIGNMENT_MEMORY_MB = float(os.environ.get("ASSIGNMENT_MEMORY_MB", "512"))
+DISCOVER_SEC = 30
+
+
+class AssignmentRegistry:
+    def __init__(self, root=None, memory_mb=None):
+        self.root = root or ASSIGNMENTS_ROOT
+        self.memory_mb = ASSIGNMENT_MEMORY_MB if memory_mb is None else memory_mb
+        self._lock = threading.Lock()
+        self._folders = {}
+        self._discovered_at = None
+        self._loaded = OrderedDict()    # name: memory_mb, least recently used first
+        self._loading = {}              # name: lock held while it loads
+        self.loads = 0
+        self.evictions = 0
+
+    def names(self):
+        self._discover()
+        with self._lock:
+            return sorted(self._folders)
+
+    def folder(self, name):
+        """The reference folder of assignment name, or None."""
+        self._discover()
+        with self._lock:
+            return self._folders.get(name)
+
+    def bundle(self, name):
+        """The loaded reference.ReferenceBundle of assignment name (None if there is no such assignment)."""
+        folder = self.folder(name)
+        if folder is None:
+            return None
+        with self._lock:
+            bundle = REFERENCES.get(folder) if name in self._loaded else None
+            if bundle is not None:
+                self._loaded.move_to_end(name)
+            else:
+                load_lock = self._loading.setdefault(name, threading.Lock())
+        metrics.CACHE_REQUESTS.inc(cache="assignment", result="miss" if bundle is None else "hit")
+        if bundle is not None:
+            return bundle
+
+        # One request loads it; others asking for the same assignment meanwhile wait for it
+        with load_lock:
+            with self._lock:
+                bundle = REFERENCES.get(folder) if name in self._loaded else None
+            if bundle is not None:
+                return bundle
+            bundle = REFERENCES.load(folder)
+            REFERENCES.start([folder])
+            with self._lock:
+                self._loaded[name] = bundle.memory_mb
+                self._loaded.move_to_end(name)
+                self.loads += 1
+                evict = []
+                # Never the one just loaded, even if it alone is over the budget
+                while sum(self._loaded.values()) > self.memory_mb and len(self._loaded) > 1:
+                    victim, _ = self._loaded.popitem(last=False)
+                    evict.append(victim)
+                    self.evictions += 1
+        for victim in evict:
+            self._evict(self._folders.get(victim) or os.path.join(self.root, victim, "reference"))
+        return bundle
+
+    def snapshot(self):
+        self._discover()
+        with self._lock:
+            return {
+                "root": self.root,
+                "memory_budget_mb": self.memory_mb,
+                "memory_mb": round(sum(self._loaded.values()), 2),
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "assignments": {name: {"loaded": name in self._loaded, "memory_mb": self._loaded.get(name)}
+                                for name in sorted(self._folders)},
+            }
+
+    def _discover(self):
+        with self._lock:
+            if self._discovered_at is not None and time.time() - self._discovered_at < DISCOVER_SEC:
+                return
+            self._discovered_at = time.time()
+        found = {}
+        for domain in glob.glob(os.path.join(self.root, "*", "reference", "domain.pddl")):
+            folder = os.path.dirname(domain)
+            found[os.path.basename(os.path.dirname(folder))] = folder
+        with self._lock:
+            self._folders = found
+
+    @staticmethod
+    def _evict(folder):
+        bundle = REFERENCES.evict(folder)
+        if bundle is None or not bundle.problems:
+            return
+        try:
+            merge_pool.forget_references([(bundle.path("domain.pddl"), bundle.problem_path(problem_id))
+                                          for problem_id in bundle.problems])
+        except (merge_pool.WorkerTimeout, merge_pool.WorkerCrashed):
+            # A replaced worker starts with an empty cache anyway
+            pass
+
+
+ASSIGNMENTS = AssignmentRegistry()
@@ -0,0 +1,336 @@
+"""
+End-to-end grading benchmark: per-stage latency and throughput at several concurrency levels.
+
+Replays submission corpora (<corpus>/reference and <corpus>/submissions/<student>/) through
+Grader, one stage after the other, and through server_test.run_grader, the whole pipeline
+with its stages in parallel. Every pXX.pddl in the reference folder that the student also
+submitted is one case. Reports p50/p95 latency per stage and cases per second for each
+concurrency level.
+
+Fast Downward is replaced by a deterministic stand-in: this file run with --fd-stub accepts
+the driver options planner.py uses, "translates" by checking the PDDL parses and copying it
+into the SAS file, and "searches" with search.py's breadth-first search under a node limit
+(STUB_NODE_LIMIT), so plans are real and every run does the same work. Plans are validated
+with VAL (val/bin/Validate) unless --validator native is given.
+
+Results can be saved as JSON and compared against a saved baseline; latencies or throughput
+worse than the baseline by more than --tolerance, and changed grading verdicts, are reported
+as regressions (exit status 1).
+
+Usage:
+    python3 bench_grade.py [--corpus DIR ...] [--concurrency 1,2,4] [--repeat N]
+                           [--validator val|native] [--save out.json] [--baseline base.json]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+DEFAULT_CORPORA = ["data/example_2", "data/queens_example"]
+STUB_NODE_LIMIT = int(os.environ.get("STUB_NODE_LIMIT", 50000))
+
+# Fast Downward driver options that take a value
+_FD_VALUE_OPTIONS = {"--alias", "--overall-time-limit", "--overall-memory-limit", "--sas-file", "--plan-file",
+                     "--search"}
+_SAS_HEADER = "begin_version\n3\nend_version\n"
+
+
+# -----------------------
+# Fast Downward stand-in
+# -----------------------
+def fd_stub(argv):
+    """Run as the planner command; returns the exit code Fast Downward would."""
+    opts, files = {}, []
+    it = iter(argv)
+    for arg in it:
+        if arg in _FD_VALUE_OPTIONS:
+            opts[arg] = next(it, None)
+        elif arg.startswith("--"):
+            opts[arg] = True
+        else:
+            files.append(arg)
+
+    import merge
+    import search
+    from validator import UnsupportedTask
+
+    if "--translate" in opts:
+        domain_text, problem_text = (Path(f).read_text(encoding="utf-8") for f in files[:2])
+        try:
+            merge.parse_pddl_text(domain_text, problem_text)
+        except Exception as e:
+            print(f"Error: could not parse the task: {e}")
+            return 31  # TRANSLATE_INPUT_ERROR
+        Path(opts.get("--sas-file") or "output.sas").write_text(
+            _SAS_HEADER + json.dumps({"domain": domain_text, "problem": problem_text}), encoding="utf-8")
+        print("Done! [stub translate]")
+        return 0
+
+    task = json.loads(Path(files[-1]).read_text(encoding="utf-8")[len(_SAS_HEADER):])
+    problem = merge.parse_pddl_text(task["domain"], task["problem"])
+    try:
+        res = search.search(problem, node_limit=STUB_NODE_LIMIT, time_limit=float("inf"), relaxed=False)
+    except UnsupportedTask as e:
+        print(f"Unsupported task: {e}")
+        return 34  # SEARCH_UNSUPPORTED
+    print(f"Expanded {res['expanded']} state(s).")
+    if res["status"] == "plan":
+        Path(opts.get("--plan-file") or "sas_plan").write_text(res["plan"], encoding="utf-8")
+        print("Solution found!")
+        return 0
+    if res["status"] == "exhausted":
+        print("Search stopped without finding a solution.")
+        return 12  # SEARCH_UNSOLVED_INCOMPLETE
+    print("Node limit reached.")
+    return 23  # SEARCH_OUT_OF_TIME
+
+
+# -----------------------
+# Cases
+# -----------------------
+def load_cases(corpora):
+    """[(corpus, student, problem_id, domain_text, problem_text)] for every problem both sides have."""
+    cases = []
+    for corpus in corpora:
+        reference = Path(corpus) / "reference"
+        for student in sorted(p for p in (Path(corpus) / "submissions").iterdir() if p.is_dir()):
+            if not (student / "domain.pddl").is_file():
+                continue
+            domain_text = (student / "domain.pddl").read_text(encoding="utf-8")
+            for ref_problem in sorted(reference.glob("p0*.pddl")):
+                problem = student / ref_problem.name
+                if problem.is_file():
+                    cases.append((corpus, student.name, ref_problem.stem[2:], domain_text,
+                                  problem.read_text(encoding="utf-8")))
+    return cases
+
+
+def _case_key(case):
+    corpus, student, problem_id = case[:3]
+    return f"{corpus}:{student}:p0{problem_id}"
+
+
+# -----------------------
+# Workloads
+# -----------------------
+def grade_stages(case, validator):
+    """The grading stages one after the other through Grader; returns ({stage: seconds}, verdict)."""
+    from grader import Grader
+    corpus, _, problem_id, domain_text, problem_text = case
+    grader = Grader(os.path.join(corpus, "reference"), validator=validator)
+    times = {}
+
+    def timed(stage, func, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            times[stage] = time.perf_counter() - t0
+
+    plan = timed("generate_plan", grader.generate_plan, domain_text, problem_text, timeout=30)
+    verdict = {"plan": plan["ok"], "plan_outcome": plan.get("outcome")}
+    if plan["ok"]:
+        res = timed("student_plan_on_reference", grader.validate_student_plan, plan["plan"], problem_id)
+        verdict["student_plan_on_reference"] = res["ok"]
+    res = timed("reference_plan_on_student", grader.validate_reference_plan, domain_text, problem_text, problem_id)
+    verdict["reference_plan_on_student"] = res["ok"]
+    align = timed("alignment", grader.check_alignment, domain_text, problem_text, problem_id)
+    verdict.update(alignment_ok=align["alignment_ok"], alignment_engine=align.get("engine"))
+    for stage, key in (("merge", "merge"), ("alignment_planning", "planner")):
+        usage = (align.get("resources") or {}).get(key)
+        if usage:
+            times[stage] = usage["wall_sec"]
+    return times, verdict
+
+
+def grade_pipeline(case):
+    """The whole pipeline through server_test.run_grader; returns ({"run_grader": seconds}, verdict)."""
+    import server_test
+    _, _, problem_id, domain_text, problem_text = case
+    t0 = time.perf_counter()
+    result = server_test.run_grader(domain=domain_text, problem=problem_text, problem_id=problem_id)
+    elapsed = time.perf_counter() - t0
+    verdict = {"ok": result["ok"], "plan": result["planning"].get("ok")}
+    if "alignment" in result:
+        verdict["alignment_ok"] = result["alignment"]["alignment_ok"]
+    return {"run_grader": elapsed}, verdict
+
+
+def run_level(cases, concurrency, mode, validator, repeat):
+    """Run every case repeat times on concurrency threads; returns the level's report and verdicts."""
+    import planner
+    import server_test
+    from reference import REFERENCES
+
+    # A fresh translation cache per level, so every level does the same translations
+    with tempfile.TemporaryDirectory(prefix="bench-sas-") as sas_dir:
+        planner.SAS_CACHE = planner.TranslationCache(sas_dir)
+        server_test.VALIDATOR = validator
+        samples = defaultdict(list)
+        verdicts = {}
+        wall = 0.0
+        # run_grader reads the reference folder from a module global, so one corpus at a time
+        for corpus in dict.fromkeys(c[0] for c in cases):
+            jobs = [c for c in cases if c[0] == corpus] * repeat
+            server_test.REFERENCE_LOC = os.path.join(corpus, "reference")
+            # Loaded and checked up front, as the server does at startup
+            REFERENCES.load(server_test.REFERENCE_LOC)
+            work = grade_pipeline if mode == "run_grader" else (lambda c: grade_stages(c, validator))
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as ex:
+                results = list(ex.map(work, jobs))
+            wall += time.perf_counter() - t0
+            for case, (times, verdict) in zip(jobs, results):
+                for stage, seconds in times.items():
+                    samples[stage].append(seconds)
+                verdicts[_case_key(case)] = verdict
+
+    n = len(cases) * repeat
+    return {
+        "cases": n,
+        "wall_sec": round(wall, 3),
+        "throughput_per_sec": round(n / wall, 3) if wall else None,
+        "stages": {stage: _summary(values) for stage, values in sorted(samples.items())},
+    }, verdicts
+
+
+def _summary(values):
+    ordered = sorted(values)
+    return {
+        "n": len(ordered),
+        "p50_sec": round(_percentile(ordered, 50), 4),
+        "p95_sec": round(_percentile(ordered, 95), 4),
+        "max_sec": round(ordered[-1], 4),
+    }
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+# -----------------------
+# Baseline comparison
+# -----------------------
+def compare(current, baseline, *, tolerance, min_delta):
+    """Regressions of current against baseline, as readable lines."""
+    problems = []
+    for level, modes in current["levels"].items():
+        for mode, report in modes.items():
+            base = baseline.get("levels", {}).get(level, {}).get(mode)
+            if base is None:
+                continue
+            where = f"concurrency {level}, {mode}"
+            if base["throughput_per_sec"] and report["throughput_per_sec"] < base["throughput_per_sec"] * (1 - tolerance):
+                problems.append(f"{where}: throughput {report['throughput_per_sec']}/s "
+                                f"(baseline {base['throughput_per_sec']}/s)")
+            for stage, stats in report["stages"].items():
+                old = base["stages"].get(stage)
+                if old is None:
+                    continue
+                for key in ("p50_sec", "p95_sec"):
+                    if stats[key] > old[key] * (1 + tolerance) and stats[key] - old[key] > min_delta:
+                        problems.append(f"{where}: {stage} {key[:3]} {stats[key]:.3f}s (baseline {old[key]:.3f}s)")
+    for key, verdict in current["verdicts"].items():
+        old = baseline.get("verdicts", {}).get(key)
+        if old is not None and old != verdict:
+            problems.append(f"verdict changed for {key}: {verdict} (baseline {old})")
+    return problems
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _print_report(report):
+    for level, modes in report["levels"].items():
+        for mode, r in modes.items():
+            print(f"\nconcurrency {level}, {mode}: {r['cases']} cases in {r['wall_sec']:.1f}s "
+                  f"({r['throughput_per_sec']} cases/s)")
+            print(f"  {'stage':<28}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+            for stage, s in r["stages"].items():
+                print(f"  {stage:<28}{s['n']:>5}{s['p50_sec'] * 1000:>10.1f}{s['p95_sec'] * 1000:>10.1f}"
+                      f"{s['max_sec'] * 1000:>10.1f}")
+
+
+def main():
+    if sys.argv[1:2] == ["--fd-stub"]:
+        sys.exit(fd_stub(sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(description="Benchmark the grading pipeline with a stand-in planner")
+    parser.add_argument("--corpus", action="append", help=f"corpus folder (default: {' '.join(DEFAULT_CORPORA)})")
+    parser.add_argument("--concurrency", default="1,2,4", help="comma-separated thread counts (default 1,2,4)")
+    parser.add_argument("--repeat", type=int, default=1, help="times each case is run per level")
+    parser.add_argument("--mode", choices=["grader", "run_grader", "both"], default="both")
+    parser.add_argument("--validator", choices=["val", "native"],
+                        default="val" if os.path.exists("val/bin/Validate") else "native")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved earlier with --save")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown as a fraction (default 0.25)")
+    parser.add_argument("--min-delta", type=float, default=0.02,
+                        help="latency changes below this many seconds are never regressions (default 0.02)")
+    args = parser.parse_args()
+
+    # Before anything reads it: planner.py takes the planner command from the environment
+    os.environ["FAST_DOWNWARD"] = f"{sys.executable} {os.path.abspath(__file__)} --fd-stub"
+    import merge_pool
+
+    cases = load_cases(args.corpus or DEFAULT_CORPORA)
+    if not cases:
+        sys.exit("No cases found")
+    levels = [int(c) for c in args.concurrency.split(",")]
+    modes = ["grader", "run_grader"] if args.mode == "both" else [args.mode]
+    print(f"{len(cases)} cases, concurrency {levels}, validator {args.validator}, stub node limit {STUB_NODE_LIMIT}",
+          file=sys.stderr)
+
+    # Warm up the merge workers so the first level does not pay for starting them
+    merge_pool.get_pool()
+    grade_stages(cases[0], args.validator)
+
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "validator": args.validator,
+            "stub_node_limit": STUB_NODE_LIMIT,
+            "repeat": args.repeat,
+            "corpora": args.corpus or DEFAULT_CORPORA,
+        },
+        "levels": {},
+        "verdicts": {},
+    }
+    for level in levels:
+        for mode in modes:
+            print(f"concurrency {level}, {mode}...", file=sys.stderr)
+            result, verdicts = run_level(cases, level, mode, args.validator, args.repeat)
+            report["levels"].setdefault(str(level), {})[mode] = result
+            report["verdicts"].update({f"{mode}:{k}": v for k, v in verdicts.items()})
+    _print_report(report)
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"\nSaved to {args.save}")
+    if args.baseline:
+        problems = compare(report, json.loads(Path(args.baseline).read_text(encoding="utf-8")),
+                           tolerance=args.tolerance, min_delta=args.min_delta)
+        print(f"\nCompared with {args.baseline}: " + (f"{len(problems)} regression(s)" if problems else "no regressions"))
+        for line in problems:
+            print(f"  {line}")
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
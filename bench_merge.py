@@ -0,0 +1,70 @@
+"""
+Benchmark for merge.py: counts tarski parses and measures wall time per merge.
+
+Usage:
+    python3 bench_merge.py [<reference_folder> <submission_folder>] [--repeat N]
+
+Defaults to data/reference against data/submission and merges every pXX.pddl found in
+both folders. Each tarski parse of a domain or problem (file or string) counts as one.
+"""
+import argparse
+import glob
+import os
+import statistics
+import tempfile
+import time
+
+from tarski.io import PDDLReader
+
+import merge
+
+PARSES = {"count": 0}
+
+
+def _counting(method):
+    def wrapper(self, *args, **kwargs):
+        PARSES["count"] += 1
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+PDDLReader.parse_file = _counting(PDDLReader.parse_file)
+PDDLReader.parse_string = _counting(PDDLReader.parse_string)
+
+
+def bench(reference, submission, repeat):
+    probs = sorted(os.path.basename(p) for p in glob.glob(os.path.join(reference, "p*.pddl")))
+    probs = [p for p in probs if os.path.isfile(os.path.join(submission, p))]
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="bench-merge-") as tmp:
+        out_domain = os.path.join(tmp, "domain.pddl")
+        out_problem = os.path.join(tmp, "problem.pddl")
+        for prob in probs:
+            times = []
+            parses = []
+            for _ in range(repeat):
+                PARSES["count"] = 0
+                t0 = time.perf_counter()
+                merge.main(os.path.join(reference, "domain.pddl"), os.path.join(reference, prob),
+                           os.path.join(submission, "domain.pddl"), os.path.join(submission, prob),
+                           out_domain, out_problem)
+                times.append(time.perf_counter() - t0)
+                parses.append(PARSES["count"])
+            rows.append((prob, parses[0], parses[-1], statistics.median(times), min(times)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark merge.py parse count and wall time")
+    parser.add_argument("reference", nargs="?", default="data/reference")
+    parser.add_argument("submission", nargs="?", default="data/submission")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'problem':<10}{'parses(first)':>15}{'parses(warm)':>14}{'median ms':>12}{'min ms':>10}")
+    for prob, first, warm, med, best in bench(args.reference, args.submission, args.repeat):
+        print(f"{prob:<10}{first:>15}{warm:>14}{med * 1000:>12.1f}{best * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
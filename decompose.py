@@ -0,0 +1,132 @@
+"""
+Alignment checked one fail action at a time.
+
+merge.py puts every fail_<act>1 and fail_<act>2 action into one merged task with the single
+goal (failed), so one planner run has to explore all of them together and can only answer
+for all of them at once: a run that times out says nothing about any action. With
+merge_pool.run_merge(decompose=N) the merge worker also splits the merged domain into one
+domain per N fail actions (merge.split_fail_actions()); solve() plans on those side by side,
+at most portfolio.CPUS at a time with the same time slicing as portfolio.py, and stops the
+others as soon as one finds a plan, which is a mis-alignment plan of the whole task.
+
+Every fail action then gets a status of its own: counterexample (its group found the plan),
+aligned (its group's search space was exhausted), timed_out, out_of_memory, cancelled (a
+counterexample was found first), skipped (never started) or error. fail_<act>1 applies
+where the reference allows <act> and the submission does not (direction "reference_only"),
+fail_<act>2 the other way round ("submission_only").
+
+Usage:
+    merge_res = merge_pool.run_merge(ref_domain, ref_problem, domain_text, problem_text, decompose=1)
+    res = decompose.solve(merge_res["search"]["subtasks"], merge_res["problem"], "plan.pddl", timeout=60)
+    res["outcome"], res["fail_actions"]["fail_move1"]["status"]
+"""
+import time
+from pathlib import Path
+
+import metrics
+import planner
+import portfolio
+import resources
+import supervise
+import workspace
+
+COUNTEREXAMPLE = {"plan", "plan_at_limit"}
+
+# planner.outcome() of a group's search: the status of each of its fail actions
+STATUS = {
+    "plan": "counterexample",
+    "plan_at_limit": "counterexample",
+    "unsolvable": "aligned",
+    "exhausted": "aligned",
+    "out_of_time": "timed_out",
+    "out_of_memory": "out_of_memory",
+    "cancelled": "cancelled",
+    "error": "error",
+}
+
+
+def direction(action_name):
+    """Which side allows a fail action's action: "reference_only" (fail_<act>1) or "submission_only" (fail_<act>2)."""
+    return {"1": "reference_only", "2": "submission_only"}.get(action_name[-1:])
+
+
+def solve(subtasks, problem_text, plan_path, *, timeout=60, config="lama-first", cpus=None, use_cache=True,
+          log_path=None, ws=None, cancel=None):
+    """
+    Plan on each of the merged subtasks ([{"actions", "domain"}], see merge.split_fail_actions)
+    with the problem_text they share, using the portfolio.CONFIGS configuration config, until
+    one finds a plan, which is written to plan_path.
+
+    Returns a dict with keys: ok (a plan was found), plan, outcome ("plan"; "exhausted" if
+    every group was exhausted; otherwise "out_of_time", "out_of_memory" or "error", whichever
+    came up first in that order), unsolvable, timed_out, stdout, stderr, fail_actions ({name:
+    {direction, status, duration_sec}}), counterexample (the fail actions of the group that
+    found the plan, else None) and resources (all runs, side by side). Every run is stopped
+    when the threading.Event cancel is set.
+    """
+    search_config = portfolio.CONFIGS[config]
+    out_plan = Path(plan_path)
+    subtasks = list(subtasks)
+    t0 = time.time()
+    with workspace.scope(ws) as ws:
+        slots = max(1, min(cpus or portfolio.CPUS, len(subtasks)))
+        memory_limit = portfolio.memory_share(planner.MEMORY_LIMIT, slots)
+
+        def run(i, budget, cancel):
+            started = time.time()
+            run_dir = Path(ws.mkdir(f"fail-{i}-"))
+            sas, plan = run_dir / "output.sas", run_dir / "plan.pddl"
+            tr = planner.translate(subtasks[i]["domain"], problem_text, sas, timeout=budget, use_cache=use_cache,
+                                   log_path=log_path, ws=ws, cancel=cancel)
+            if not tr["ok"]:
+                proc = tr["proc"]
+                return {"outcome": "cancelled" if proc and proc["cancelled"] else "error", "plan": None,
+                        "stdout": tr["stdout"], "stderr": tr["stderr"], "resources": tr["resources"],
+                        "duration_sec": time.time() - started}
+            remaining = max(1, int(budget - (time.time() - started)))
+            proc = planner.search(sas, plan, search_config, timeout=remaining, memory_limit=memory_limit,
+                                  log_path=log_path, cancel=cancel)
+            return {"outcome": portfolio.run_outcome(proc), "plan": plan,
+                    "stdout": tr["stdout"] + proc["stdout"], "stderr": tr["stderr"] + proc["stderr"],
+                    "resources": resources.combine(tr["resources"], proc["resources"]),
+                    "duration_sec": time.time() - started}
+
+        runs, winner = portfolio.race(range(len(subtasks)), run, slots=slots, deadline=t0 + timeout,
+                                      wins=lambda r: r["outcome"] in COUNTEREXAMPLE, cancel=cancel)
+        if winner is not None and runs[winner]["plan"].exists():
+            out_plan.write_text(runs[winner]["plan"].read_text(encoding="utf-8"), encoding="utf-8")
+
+    fail_actions = {}
+    for i, sub in enumerate(subtasks):
+        r = runs[i]
+        status = STATUS[r["outcome"]] if r else "skipped"
+        metrics.ALIGNMENT_SUBTASKS.inc(status=status)
+        for name in sub["actions"]:
+            fail_actions[name] = {"direction": direction(name), "status": status,
+                                  "duration_sec": round(r["duration_sec"], 3) if r else 0.0}
+
+    outcomes = [r["outcome"] for r in runs.values() if r]
+    if winner is not None:
+        result_outcome = "plan"
+    elif len(outcomes) == len(subtasks) and all(STATUS[o] == "aligned" for o in outcomes):
+        result_outcome = "exhausted"
+    else:
+        result_outcome = next((o for o in ("out_of_time", "out_of_memory", "error") if o in outcomes), "out_of_time")
+
+    summary = "".join(f"Fail actions {', '.join(sub['actions'])}: {runs[i]['outcome'] if runs[i] else 'skipped'}\n"
+                      for i, sub in enumerate(subtasks))
+    shown = runs[winner] if winner is not None else None
+    plan_text = out_plan.read_text(encoding="utf-8") if winner is not None and out_plan.exists() else ""
+    return {
+        "ok": bool(plan_text.strip()),
+        "plan": plan_text,
+        "outcome": result_outcome,
+        "unsolvable": result_outcome == "exhausted",
+        "timed_out": result_outcome == "out_of_time",
+        "stdout": supervise.cap_text(summary + (shown["stdout"] if shown else "")),
+        "stderr": supervise.cap_text(shown["stderr"] if shown else ""),
+        "fail_actions": fail_actions,
+        "counterexample": list(subtasks[winner]["actions"]) if winner is not None else None,
+        "resources": resources.concurrent([r["resources"] for r in runs.values() if r], time.time() - t0),
+    }
+
@@ -1,8 +1,19 @@
-
 import glob, os, sys, tabulate
+import argparse, collections, contextlib, json, shutil, subprocess, time, traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import optimum
+import planner
+import resources
+import scheduler
 
 USAGE = """
-    Usage: python3 grade.py [<student_id>|all]
+    Usage: python3 grade.py [<student_id>|all] [--jobs N] [--restart] [--assignment <name|folder>]
+
+    With --jobs (or 'all') grading runs in batch mode: nothing is asked interactively,
+    the (student, problem, stage) tasks are spread over N processes, and students whose
+    marking folder already has a manifest.json pick up where the last run stopped.
+    --restart throws away existing marking folders instead.
 """
 
 
@@ -14,16 +25,26 @@ PROBLEMS = ['p01', 'p02', 'p03']
 # Problems for just finding a plan
 PLAN_ONLY_PROBLEMS = ['p04']
 
-REFERENCE_LOC = 'data/example_2/reference'
-SUBMISSIONS_LOC = 'data/example_2/submissions'
-MARKING_LOC = 'data/example_2/marking'
+# Assignment folder holding reference/, submissions/ and marking/; see --assignment
+ASSIGNMENT_LOC = os.environ.get('GRADE_ASSIGNMENT', 'data/example_2')
 
+# The folders of one assignment. Every grading function takes one and run_task hands it to the
+# worker processes with each task, so nothing depends on module state a worker may not share.
+Assignment = collections.namedtuple('Assignment', ['reference', 'submissions', 'marking'])
 
-# Make sure all three directories exist
-for LOC in [REFERENCE_LOC, SUBMISSIONS_LOC, MARKING_LOC]:
-    if not os.path.isdir(LOC):
-        print(f'Error: {LOC} does not exist')
-        sys.exit(1)
+
+def use_assignment(loc=ASSIGNMENT_LOC):
+    """The Assignment in folder loc (or data/<loc>); exits if one of its folders is missing."""
+    if not os.path.isdir(loc) and os.path.isdir(os.path.join('data', loc)):
+        loc = os.path.join('data', loc)
+    asg = Assignment(f'{loc}/reference', f'{loc}/submissions', f'{loc}/marking')
+
+    # Make sure all three directories exist
+    for LOC in asg:
+        if not os.path.isdir(LOC):
+            print(f'Error: {LOC} does not exist')
+            sys.exit(1)
+    return asg
 
 
 
@@ -35,40 +56,141 @@ mark = {
 # character for a small red x
 # c = '\u274c'
 
-def check_alignment(student_id, prob):
-    os.system(f'python3 merge.py {REFERENCE_LOC}/domain.pddl {REFERENCE_LOC}/{prob} {SUBMISSIONS_LOC}/{student_id}/domain.pddl {SUBMISSIONS_LOC}/{student_id}/{prob} {MARKING_LOC}/{student_id}/domain.pddl {MARKING_LOC}/{student_id}/{prob} > {MARKING_LOC}/{student_id}/merge.log 2>&1')
-    os.system(f'./plan.sh {MARKING_LOC}/{student_id}/plan.{prob}.merged {MARKING_LOC}/{student_id}/domain.pddl {MARKING_LOC}/{student_id}/{prob} 60 > {MARKING_LOC}/{student_id}/planner.{prob}.merged.log 2>&1')
+def run(cmd, log_file):
+    """Run a command (no shell), sending stdout and stderr to log_file."""
+    with open(log_file, 'w') as log:
+        return subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT).returncode
+
+def run_planner(cmd, log_file):
+    """
+    run() for plan.sh/planoptimal.sh <plan> <domain> <problem> ...: waits for memory and a CPU
+    from scheduler.py, shared with every other grading process, and hands the script the memory
+    limit in PLANNER_MEMORY_LIMIT. The run's peak RSS sizes the next reservation for the same
+    script on the same domain/problem (only raises it if the run ran out of time or memory).
+    """
+    texts = []
+    for path in cmd[2:4]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                texts.append(f.read())
+        except FileNotFoundError:
+            texts.append('')
+    key = f'{os.path.basename(cmd[0])}:{planner.TranslationCache.make_key(*texts)}'
+    with scheduler.SCHEDULER.reserve(key, planner.MEMORY_LIMIT) as slot:
+        t0 = time.time()
+        with open(log_file, 'w') as log:
+            proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT,
+                                    env=dict(os.environ, PLANNER_MEMORY_LIMIT=slot.memory_limit))
+            # wait4() rather than wait(), for the peak RSS of the script and the planner it waited for
+            _, status, ru = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+        # Runs that hit the script's time or memory limit peaked lower than a full run would
+        slot.record(resources.from_rusage(ru, time.time() - t0, status),
+                    complete=planner.outcome(proc.returncode) not in ('out_of_time', 'out_of_memory'))
+    return proc.returncode
+
+def merge_submission(asg, student_id, prob, merged_domain, merged_problem, log_file):
+    """Run merge.py in this process (tarski is only imported once per worker) and log like the CLI would."""
+    import merge
+    with open(log_file, 'w') as log, contextlib.redirect_stdout(log):
+        try:
+            merge.main(f'{asg.reference}/domain.pddl', f'{asg.reference}/{prob}',
+                       f'{asg.submissions}/{student_id}/domain.pddl', f'{asg.submissions}/{student_id}/{prob}',
+                       merged_domain, merged_problem)
+            return True
+        except merge.MergeError as e:
+            print(f'Error: {e}')
+        except Exception:
+            traceback.print_exc(file=log)
+    return False
+
+def clear_outputs(plan_file, log_file):
+    """Remove a plan and empty the planner log left by an earlier run, so they cannot pass for this run's."""
+    if os.path.isfile(plan_file):
+        os.remove(plan_file)
+    open(log_file, 'w').close()
+
+def check_alignment(asg, student_id, prob):
+    # merged files are per problem so the problems of one student can be aligned in parallel
+    merged_domain = f'{asg.marking}/{student_id}/domain.{prob}'
+    merged_problem = f'{asg.marking}/{student_id}/{prob}'
+    clear_outputs(f'{asg.marking}/{student_id}/plan.{prob}.merged', f'{asg.marking}/{student_id}/planner.{prob}.merged.log')
+    if merge_submission(asg, student_id, prob, merged_domain, merged_problem, f'{asg.marking}/{student_id}/merge.{prob}.log'):
+        run_planner(['./plan.sh', f'{asg.marking}/{student_id}/plan.{prob}.merged', merged_domain, merged_problem, '60'],
+                    f'{asg.marking}/{student_id}/planner.{prob}.merged.log')
     # check file for failure message
-    with open(f'{MARKING_LOC}/{student_id}/planner.{prob}.merged.log', 'r') as f:
+    with open(f'{asg.marking}/{student_id}/planner.{prob}.merged.log', 'r') as f:
         mtext = f.read()
         align = 'Search stopped without finding a solution.' in mtext
-    if not (align or os.path.isfile(f'{MARKING_LOC}/{student_id}/plan.{prob}.merged')):
+    if not (align or os.path.isfile(f'{asg.marking}/{student_id}/plan.{prob}.merged')):
         print(f'Warning: Alignment failed for {student_id}/{prob}')
 
     plan = None
-    if os.path.isfile(f'{MARKING_LOC}/{student_id}/plan.{prob}.merged'):
-        with open(f'{MARKING_LOC}/{student_id}/plan.{prob}.merged', 'r') as f:
+    if os.path.isfile(f'{asg.marking}/{student_id}/plan.{prob}.merged'):
+        with open(f'{asg.marking}/{student_id}/plan.{prob}.merged', 'r') as f:
             plan = f.read()
     return (align, plan)
 
-def check_solve(student_id, prob, optimal=False):
+def check_solve(asg, student_id, prob, optimal=False):
     if optimal:
-        planner = 'planoptimal.sh'
+        script = 'planoptimal.sh'
     else:
-        planner = 'plan.sh'
-    os.system(f'./{planner} {MARKING_LOC}/{student_id}/plan.{prob} {SUBMISSIONS_LOC}/{student_id}/domain.pddl {SUBMISSIONS_LOC}/{student_id}/{prob} 60 > {MARKING_LOC}/{student_id}/planner.{prob}.log 2>&1')
-    return os.path.isfile(f'{MARKING_LOC}/{student_id}/plan.{prob}')
-
-def check_validate(student_id, prob):
-    os.system(f'./validate.sh {REFERENCE_LOC}/domain.pddl {REFERENCE_LOC}/{prob} {MARKING_LOC}/{student_id}/plan.{prob} > {MARKING_LOC}/{student_id}/validate1.{prob}.log 2>&1')
-    with open(f'{MARKING_LOC}/{student_id}/validate1.{prob}.log', 'r') as f:
+        script = 'plan.sh'
+    clear_outputs(f'{asg.marking}/{student_id}/plan.{prob}', f'{asg.marking}/{student_id}/planner.{prob}.log')
+    run_planner([f'./{script}', f'{asg.marking}/{student_id}/plan.{prob}', f'{asg.submissions}/{student_id}/domain.pddl', f'{asg.submissions}/{student_id}/{prob}', '60'],
+                f'{asg.marking}/{student_id}/planner.{prob}.log')
+    return os.path.isfile(f'{asg.marking}/{student_id}/plan.{prob}')
+
+def check_optimal(asg, student_id, prob):
+    """
+    planoptimal.sh bounded by the reference problem's optimal cost (see optimum.py), so it
+    either finds a plan costing at most that or proves there is none; unbounded if the
+    reference has no such problem or its optimum is unknown (grade_batch() warns about those).
+    """
+    reference_cost = optimum.reference_cost(asg.reference, prob)
+    plan_file = f'{asg.marking}/{student_id}/plan.{prob}'
+    log_file = f'{asg.marking}/{student_id}/planner.{prob}.log'
+    cmd = ['./planoptimal.sh', plan_file, f'{asg.submissions}/{student_id}/domain.pddl', f'{asg.submissions}/{student_id}/{prob}', '60']
+    if reference_cost is not None:
+        cmd.append(str(reference_cost))
+    # a plan left from an earlier run would pass for a bounded search that found none
+    clear_outputs(plan_file, log_file)
+    run_planner(cmd, log_file)
+
+    solved = os.path.isfile(plan_file)
+    cost = None
+    if solved:
+        with open(plan_file, 'r') as f:
+            cost = planner.plan_cost(f.read())
+    with open(log_file, 'r') as f:
+        exhausted = 'Search stopped without finding a solution.' in f.read()
+    return {
+        'solved': solved,
+        'cost': cost,
+        'reference_cost': reference_cost,
+        'deviation': optimum.deviation(cost, reference_cost),
+        # proven: every plan on the submission costs more than the reference optimum (if there is one)
+        'costlier': reference_cost is not None and not solved and exhausted,
+    }
+
+def check_validate1(asg, student_id, prob):
+    """Student plan on the reference domain/problem."""
+    run(['./validate.sh', f'{asg.reference}/domain.pddl', f'{asg.reference}/{prob}', f'{asg.marking}/{student_id}/plan.{prob}'],
+        f'{asg.marking}/{student_id}/validate1.{prob}.log')
+    with open(f'{asg.marking}/{student_id}/validate1.{prob}.log', 'r') as f:
         vtext = f.read()
-        valid1 = ('Plan executed successfully' in vtext) and ('Plan valid' in vtext)
-    os.system(f'./validate.sh {SUBMISSIONS_LOC}/{student_id}/domain.pddl {SUBMISSIONS_LOC}/{student_id}/{prob} {REFERENCE_LOC}/plan.{prob} > {MARKING_LOC}/{student_id}/validate2.{prob}.log 2>&1')
-    with open(f'{MARKING_LOC}/{student_id}/validate2.{prob}.log', 'r') as f:
+        return ('Plan executed successfully' in vtext) and ('Plan valid' in vtext)
+
+def check_validate2(asg, student_id, prob):
+    """Reference plan on the student domain/problem."""
+    run(['./validate.sh', f'{asg.submissions}/{student_id}/domain.pddl', f'{asg.submissions}/{student_id}/{prob}', f'{asg.reference}/plan.{prob}'],
+        f'{asg.marking}/{student_id}/validate2.{prob}.log')
+    with open(f'{asg.marking}/{student_id}/validate2.{prob}.log', 'r') as f:
         vtext = f.read()
-        valid2 = ('Plan executed successfully' in vtext) and ('Plan valid' in vtext)
-    return (valid1, valid2)
+        return ('Plan executed successfully' in vtext) and ('Plan valid' in vtext)
+
+def check_validate(asg, student_id, prob):
+    return (check_validate1(asg, student_id, prob), check_validate2(asg, student_id, prob))
 
 def format_results(results):
     headers = ['Problem', 'Solve', 'St-Validates', 'Ref-Validates', 'Aligns']
@@ -78,85 +200,218 @@ def format_results(results):
     return tabulate.tabulate(rows, headers=headers, tablefmt='pipe')
 
 
-def gradeall():
-    sdirs = glob.glob(f'{SUBMISSIONS_LOC}/*')
-    for sdir in sdirs:
-        student_id = sdir.split('/')[-1]
-        grade(student_id)
-
-def grade(student_id):
-
-    print(f"Grading {student_id}...")
-
-    # delete the old marking folder if user wants to re-grade
-    if os.path.exists(f'{MARKING_LOC}/{student_id}'):
-        remove = input(f'{student_id} already exists. Do you want to remove it? (y/n) ')
-        if remove == 'y':
-            os.system(f'rm -rf {MARKING_LOC}/{student_id}')
-        else:
-            print('Abort.')
-            return
-    os.mkdir(f'{MARKING_LOC}/{student_id}')
-
+# -----------------------
+# Batch grading
+# -----------------------
+# A task is (student_id, problem file, stage). Stages and what they need first:
+#   solve     -> plan.sh on the student files
+#   validate1 -> student plan on reference files (needs solve)
+#   validate2 -> reference plan on student files
+#   align     -> merge + plan.sh on the merged files
+#   optimal   -> planoptimal.sh on a PLAN_ONLY_PROBLEMS problem, bounded by the reference optimum
+STAGE_DEPS = {'validate1': 'solve'}
+
+def student_tasks(student_id):
+    tasks = []
+    for prob in PROBLEMS:
+        for stage in ['solve', 'validate1', 'validate2', 'align']:
+            tasks.append((student_id, f'{prob}.pddl', stage))
+    for prob in PLAN_ONLY_PROBLEMS:
+        tasks.append((student_id, f'{prob}.pddl', 'optimal'))
+    return tasks
+
+def run_task(asg, student_id, prob, stage, dep_value=None):
+    """Runs one task in a worker process; the return value is stored in the manifest."""
+    if stage == 'solve':
+        return check_solve(asg, student_id, prob)
+    if stage == 'optimal':
+        return check_optimal(asg, student_id, prob)
+    if stage == 'validate1':
+        # no plan to validate if the student's own problem wasn't solved
+        return check_validate1(asg, student_id, prob) if dep_value else None
+    if stage == 'validate2':
+        return check_validate2(asg, student_id, prob)
+    if stage == 'align':
+        return list(check_alignment(asg, student_id, prob))
+    raise ValueError(f'Unknown stage: {stage}')
+
+def task_key(prob, stage):
+    return f'{prob}/{stage}'
+
+def manifest_path(asg, student_id):
+    return f'{asg.marking}/{student_id}/manifest.json'
+
+def load_manifest(asg, student_id):
+    if os.path.isfile(manifest_path(asg, student_id)):
+        with open(manifest_path(asg, student_id), 'r') as f:
+            return json.load(f)
+    return {'student_id': student_id, 'tasks': {}, 'complete': False}
+
+def save_manifest(asg, student_id, manifest):
+    # write then rename, so an interrupted run never leaves a half-written manifest behind
+    tmp = manifest_path(asg, student_id) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, manifest_path(asg, student_id))
+
+def write_grade(asg, student_id, done):
     results = {p: {} for p in PROBLEMS}
-
-
-    # confirm they find plans for all
-    print('  finding plans...')
-    for prob in results:
-        results[prob]['solve'] = mark[check_solve(student_id, f'{prob}.pddl')]
-
-
-    print('  checking for optimal plans...')
-    only_plan_results = {p: {} for p in PLAN_ONLY_PROBLEMS}
-    for prob in only_plan_results:
-        only_plan_results[prob] = {'solve': mark[check_solve(student_id, f'{prob}.pddl', optimal=True)]}
-
-
-    # confirm their plans work on our domain
-    print('  validating plans...')
-    for prob in results:
-        if results[prob]['solve'] == mark[True]:
-            validates1, validates2 = check_validate(student_id, f'{prob}.pddl')
-            results[prob]['validates1'] = mark[validates1]
-            results[prob]['validates2'] = mark[validates2]
-        else:
-            _, validates2 = check_validate(student_id, f'{prob}.pddl')
-            results[prob]['validates1'] = '-'
-            results[prob]['validates2'] = mark[validates2]
-
-
-    # check the theory alignments
-    print('  checking theory alignments...')
     plan_text = ''
     for prob in results:
-        align, plan = check_alignment(student_id, f'{prob}.pddl')
+        pfile = f'{prob}.pddl'
+        results[prob]['solve'] = mark[done[task_key(pfile, 'solve')]]
+        validates1 = done[task_key(pfile, 'validate1')]
+        results[prob]['validates1'] = '-' if validates1 is None else mark[validates1]
+        results[prob]['validates2'] = mark[done[task_key(pfile, 'validate2')]]
+        align, plan = done[task_key(pfile, 'align')]
         if plan:
             plan_text += f"\nMis-alignment plan for {prob}:\n{plan}"
         results[prob]['aligns'] = mark[align]
 
-
     # format results
     res = format_results(results)
 
     optimal_results = ""
-    if only_plan_results:
-        for prob in only_plan_results:
-            optimal_results += f"\nOptimal plan for {prob}:\n{only_plan_results[prob]['solve']}"
-            if only_plan_results[prob]['solve'] == mark[True]:
-                with open(f'{MARKING_LOC}/{student_id}/plan.{prob}.pddl', 'r') as f:
-                    optimal_results += f"\n{f.read()}"
-
-    with open(f'{MARKING_LOC}/{student_id}/grade.txt', 'w', encoding='utf-8') as f:
+    for prob in PLAN_ONLY_PROBLEMS:
+        opt = done[task_key(f'{prob}.pddl', 'optimal')]
+        if not isinstance(opt, dict):
+            # manifests written before costs were recorded hold just whether it was solved
+            opt = {'solved': opt, 'cost': None, 'reference_cost': None, 'deviation': None, 'costlier': False}
+        solved = opt['solved']
+        optimal_results += f"\nOptimal plan for {prob}:\n{mark[solved]}"
+        if opt['deviation'] is not None:
+            optimal_results += f" cost {opt['cost']} (reference optimum {opt['reference_cost']}, deviation {opt['deviation']:+d})"
+        elif opt['costlier']:
+            optimal_results += f" no plan costing at most the reference optimum {opt['reference_cost']}"
+        elif opt['reference_cost'] is None:
+            optimal_results += " (reference optimum unknown, searched without a cost bound)"
+        if solved:
+            with open(f'{asg.marking}/{student_id}/plan.{prob}.pddl', 'r') as f:
+                optimal_results += f"\n{f.read()}"
+
+    with open(f'{asg.marking}/{student_id}/grade.txt', 'w', encoding='utf-8') as f:
         f.write(f'\n{res}\n\n{plan_text}\n\n{optimal_results}\n\n')
 
+def progress(done, total, started):
+    elapsed = time.time() - started
+    eta = elapsed / done * (total - done) if done else 0
+    fmt = lambda s: time.strftime('%H:%M:%S', time.gmtime(s))
+    sys.stderr.write(f'\r  [{done}/{total}] {100.0 * done / total:5.1f}%  elapsed {fmt(elapsed)}  eta {fmt(eta)} ')
+    sys.stderr.flush()
+
+def grade_batch(asg, student_ids, jobs=1, restart=False):
+    """
+    Grade several students at once without any prompts. Finished tasks are recorded in each
+    student's manifest.json, so running the same command again after an interruption only
+    runs what is left.
+    """
+    manifests = {}
+    pending = []
+    for student_id in student_ids:
+        marking_dir = f'{asg.marking}/{student_id}'
+        if restart and os.path.exists(marking_dir):
+            shutil.rmtree(marking_dir)
+        os.makedirs(marking_dir, exist_ok=True)
+        manifests[student_id] = load_manifest(asg, student_id)
+        if manifests[student_id]['complete']:
+            continue
+        done = manifests[student_id]['tasks']
+        pending += [t for t in student_tasks(student_id) if task_key(t[1], t[2]) not in done]
+
+    total = len(pending)
+    print(f'Grading {len(student_ids)} students: {total} tasks left, {jobs} jobs')
+    if not total:
+        return
+
+    started = time.time()
+    finished = 0
+    failed = []
+    unbounded = set()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        running = {}
+        while pending or running:
+            # start every task whose dependency has finished
+            for task in list(pending):
+                student_id, prob, stage = task
+                done = manifests[student_id]['tasks']
+                dep = STAGE_DEPS.get(stage)
+                if dep and task_key(prob, dep) not in done:
+                    if (student_id, prob, dep) in failed:
+                        # dependency failed: nothing to run this task on
+                        pending.remove(task)
+                        failed.append(task)
+                        finished += 1
+                    continue
+                pending.remove(task)
+                dep_value = done.get(task_key(prob, dep)) if dep else None
+                running[pool.submit(run_task, asg, student_id, prob, stage, dep_value)] = task
+
+            if not running:
+                break
+            completed, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in completed:
+                student_id, prob, stage = task = running.pop(fut)
+                try:
+                    manifests[student_id]['tasks'][task_key(prob, stage)] = fut.result()
+                except Exception as e:
+                    sys.stderr.write(f'\n  Warning: {student_id}/{prob} {stage} failed: {e}\n')
+                    failed.append(task)
+                    continue
+                finally:
+                    finished += 1
+                    progress(finished, total, started)
+
+                opt = manifests[student_id]['tasks'][task_key(prob, stage)]
+                if stage == 'optimal' and opt['reference_cost'] is None and prob not in unbounded:
+                    unbounded.add(prob)
+                    sys.stderr.write(f'\n  Warning: no optimal cost for {asg.reference}/{prob} (missing, unsolvable or'
+                                     f' timed out), {prob} is graded without a cost bound\n')
+                manifest = manifests[student_id]
+                if all(task_key(t[1], t[2]) in manifest['tasks'] for t in student_tasks(student_id)):
+                    write_grade(asg, student_id, manifest['tasks'])
+                    manifest['complete'] = True
+                save_manifest(asg, student_id, manifest)
+
+    sys.stderr.write('\n')
+    if failed:
+        print(f'{len(failed)} tasks failed; run the same command again to retry them:')
+        for student_id, prob, stage in failed:
+            print(f'  {student_id}/{prob} {stage}')
     print('Done!\n')
 
+
+def gradeall(asg, jobs=1, restart=False):
+    sdirs = glob.glob(f'{asg.submissions}/*')
+    grade_batch(asg, sorted(sdir.split('/')[-1] for sdir in sdirs), jobs=jobs, restart=restart)
+
+def grade(asg, student_id):
+
+    print(f"Grading {student_id}...")
+
+    # delete the old marking folder if user wants to re-grade
+    if os.path.exists(f'{asg.marking}/{student_id}'):
+        remove = input(f'{student_id} already exists. Do you want to remove it? (y/n) ')
+        if remove == 'y':
+            shutil.rmtree(f'{asg.marking}/{student_id}')
+        else:
+            print('Abort.')
+            return
+
+    grade_batch(asg, [student_id])
+
 if __name__ == '__main__':
-    import sys
-    if len(sys.argv) != 2:
-        print(USAGE)
-    elif sys.argv[1] == 'all':
-        gradeall()
+    parser = argparse.ArgumentParser(usage=USAGE)
+    parser.add_argument('student', help="student id, or 'all'")
+    parser.add_argument('--jobs', type=int, default=None, help='number of parallel grading processes (batch mode)')
+    parser.add_argument('--restart', action='store_true', help='discard existing marking folders instead of resuming')
+    parser.add_argument('--assignment', default=ASSIGNMENT_LOC,
+                        help='assignment folder, or its name under data/ (default: %(default)s)')
+    args = parser.parse_args()
+    asg = use_assignment(args.assignment)
+
+    if args.student == 'all':
+        gradeall(asg, jobs=args.jobs or 1, restart=args.restart)
+    elif args.jobs is not None or args.restart:
+        grade_batch(asg, [args.student], jobs=args.jobs or 1, restart=args.restart)
     else:
-        grade(sys.argv[1])
\ No newline at end of file
+        grade(asg, args.student)
@@ -1,9 +1,21 @@
 import sys, os
 import glob, tabulate
-import subprocess, tempfile
 import time
+import uuid
 from pathlib import Path
 
+import decompose
+import merge_pool
+import metrics
+import planner
+import portfolio
+import preflight
+import reference
+import resources
+import supervise
+import validator
+import workspace
+
 class Grader:
     USAGE = """
     Usage: python3 grade.py <base_folder> [<student_id>|all]
@@ -15,14 +27,39 @@ class Grader:
     # Problems for just finding a plan
     PLAN_ONLY_PROBLEMS = ['p04']
 
+    # Limits for the built-in breadth-first search on the merged task (search.py); past them
+    # the alignment check falls back to the external planner
+    ALIGNMENT_NODE_LIMIT = 300000
+    ALIGNMENT_SEARCH_SEC = 10
+
     MARK = {
         False: 'fail',
         True: 'pass'
     }
 
-    def __init__(self, reference_folder):
+    # Plan validation backends: VAL via validate.sh, or the in-process validator.py
+    VALIDATORS = ['val', 'native']
+
+    def __init__(self, reference_folder, validator='val', alignment_search=True, alignment_precheck=True,
+                 log_dir=None, plan_portfolio=None, alignment_portfolio=None, alignment_decompose=0,
+                 decompose_config="lama-first"):
         
         self.reference_folder = reference_folder
+        # Planner configurations raced by portfolio.py (e.g. ["lama-first", "hmax"]); with fewer
+        # than two, lama-first runs on its own as in plan.sh
+        self.plan_portfolio = list(plan_portfolio or [])
+        self.alignment_portfolio = list(alignment_portfolio or [])
+        # Fail actions per merged subtask when alignment is decomposed (decompose.py); 0 plans on
+        # the whole merged task. decompose_config is the configuration each subtask runs.
+        self.alignment_decompose = int(alignment_decompose or 0)
+        self.decompose_config = decompose_config
+        # Full VAL/planner output goes to files here; results only carry its capped tail
+        self.log_dir = log_dir
+        self.alignment_search = alignment_search
+        self.alignment_precheck = alignment_precheck
+        if validator not in self.VALIDATORS:
+            raise ValueError(f"Unknown validator {validator!r}, expected one of {self.VALIDATORS}")
+        self.validator = validator
 
 
         
@@ -70,7 +107,8 @@ class Grader:
     #         valid2 = ('Plan executed successfully' in vtext) and ('Plan valid' in vtext)
     #     return (valid1, valid2)
 
-    def validate_submission(self, domain_text, problem_text, plan_text, problem_id, timeout=60):
+    def validate_submission(self, domain_text, problem_text, plan_text, problem_id, timeout=60, validator=None, ws=None,
+                            cancel=None):
         """
         Run two validations:
         1) Student plan on reference domain/problem.
@@ -78,145 +116,217 @@ class Grader:
 
         Returns a dict with booleans and logs for both checks.
         """
-        # Resolve reference file paths
-        ref_domain = os.path.join(self.reference_folder, "domain.pddl")
-        ref_problem = os.path.join(self.reference_folder, f"p0{problem_id}.pddl")
-        ref_plan = os.path.join(self.reference_folder, f"plan.p0{problem_id}.pddl")
-
-        if not os.path.isfile(ref_domain):
-            raise FileNotFoundError(f"Reference domain not found: {ref_domain}")
-        if not os.path.isfile(ref_problem):
-            raise FileNotFoundError(f"Reference problem not found: {ref_problem}")
-        if not os.path.isfile(ref_plan):
-            raise FileNotFoundError(f"Reference plan not found: {ref_plan}")
-
-        with tempfile.TemporaryDirectory(prefix="pddl-validate-") as tmp:
-            tmpdir = Path(tmp)
-            # Write student texts
-            stu_domain = tmpdir / "student.domain.pddl"
-            stu_problem = tmpdir / "student.problem.pddl"
-            stu_plan = tmpdir / "student.plan.pddl"
-
-            stu_domain.write_text(domain_text or "", encoding="utf-8")
-            stu_problem.write_text(problem_text or "", encoding="utf-8")
-            stu_plan.write_text(plan_text or "", encoding="utf-8")
-
-            # 1) Student plan on reference files
-            proc1 = subprocess.run(
-                ["./validate.sh", ref_domain, ref_problem, str(stu_plan)],
-                capture_output=True, text=True, timeout=timeout
-            )
-            out1 = proc1.stdout
-            ok1 = "Plan executed successfully" in out1
-
-            # 2) Reference plan on student files
-            proc2 = subprocess.run(
-                ["./validate.sh", str(stu_domain), str(stu_problem), ref_plan],
-                capture_output=True, text=True, timeout=timeout
-            )
-            out2 = proc2.stdout
-            ok2 = "Plan executed successfully" in out2
-
+        with workspace.scope(ws) as ws:
             return {
-                "student_plan_on_reference": {
-                    "ok": ok1,
-                    "returncode": proc1.returncode,
-                    "stdout": proc1.stdout or "",
-                    "stderr": proc1.stderr or "",
-                },
-                "reference_plan_on_student": {
-                    "ok": ok2,
-                    "returncode": proc2.returncode,
-                    "stdout": proc2.stdout or "",
-                    "stderr": proc2.stderr or "",
-                },
+                "student_plan_on_reference": self.validate_student_plan(plan_text, problem_id, timeout=timeout, validator=validator, ws=ws,
+                                                                       cancel=cancel),
+                "reference_plan_on_student": self.validate_reference_plan(domain_text, problem_text, problem_id, timeout=timeout,
+                                                                         validator=validator, ws=ws, cancel=cancel),
             }
 
-    def generate_plan(self, domain_text: str, problem_text: str, *, timeout: int = 30, optimal: bool = False):
+    def validate_student_plan(self, plan_text, problem_id, timeout=60, validator=None, ws=None, cancel=None):
+        """
+        Validate the student's plan on the reference domain/problem.
+        Returns a dict with keys: ok, returncode, stdout, stderr, validator.
+        validator overrides the backend chosen in the constructor for this call. Files are
+        written to the workspace.Workspace ws shared by the request's stages (a fresh one if None).
+        VAL is stopped when the threading.Event cancel is set.
+        """
+        ref_domain = self._reference_file("domain", "domain.pddl")
+        ref_problem = self._reference_file("problem", f"p0{problem_id}.pddl")
+
+        if (validator or self.validator) == "native":
+            bundle = self._bundle()
+            task = bundle.tasks.get(str(problem_id)) if bundle is not None else None
+            res = self._validate_native(self._reference_text(ref_domain), self._reference_text(ref_problem),
+                                        plan_text, task=task)
+            if res is not None:
+                return res
+
+        with workspace.scope(ws) as ws:
+            return self._validate(ref_domain, ref_problem, ws.file(plan_text, ".plan"), timeout, cancel)
+
+    def validate_reference_plan(self, domain_text, problem_text, problem_id, timeout=60, validator=None, ws=None,
+                                cancel=None):
         """
-        Generate a plan using the provided domain/problem texts.
-        Writes inputs to a temp dir and runs plan.sh (or planoptimal.sh).
+        Validate the reference plan on the student's domain/problem.
+        Returns a dict with keys: ok, returncode, stdout, stderr, validator.
+        validator overrides the backend chosen in the constructor for this call. Files are
+        written to the workspace.Workspace ws shared by the request's stages (a fresh one if None).
+        VAL is stopped when the threading.Event cancel is set.
+        """
+        ref_plan = self._reference_file("plan", f"plan.p0{problem_id}.pddl")
+
+        if (validator or self.validator) == "native":
+            res = self._validate_native(domain_text or "", problem_text or "", self._reference_text(ref_plan))
+            if res is not None:
+                return res
+
+        with workspace.scope(ws) as ws:
+            return self._validate(ws.file(domain_text, ".pddl"), ws.file(problem_text, ".pddl"), ref_plan, timeout,
+                                  cancel)
 
-        Returns a dict with keys: ok, plan (if found), returncode, stdout, stderr.
+    def preflight(self, domain_text, problem_text, problem_id):
         """
-        planner = "./planoptimal.sh" if optimal else "./plan.sh"
-        with tempfile.TemporaryDirectory(prefix="pddl-plan-") as tmp:
-            tmpdir = Path(tmp)
-            dpath = tmpdir / "domain.pddl"
-            ppath = tmpdir / "problem.pddl"
-            out_plan = tmpdir / "plan.pddl"
-
-            dpath.write_text(domain_text or "", encoding="utf-8")
-            ppath.write_text(problem_text or "", encoding="utf-8")
-
-            if not domain_text or not domain_text.strip():
-                raise ValueError("domain_text is empty")
-            if not problem_text or not problem_text.strip():
-                raise ValueError("problem_text is empty")
-
-            proc = subprocess.run(
-                [planner, str(out_plan), str(dpath), str(ppath), str(timeout)],
-                capture_output=True, text=True, timeout=timeout + 5
+        Parse the submission in this process and compare its signature (names, constants,
+        types, actions and their parameters) with the reference problem's; see preflight.py.
+        Returns a dict with keys: ok, errors, warnings, duration_sec. When ok is False merge
+        would reject the submission, so there is no point in running the other stages.
+        """
+        bundle = self._bundle()
+        ref_sig = bundle.signatures.get(str(problem_id)) if bundle is not None else None
+        if ref_sig is None:
+            ref_sig = preflight.SIGNATURE_CACHE.get(
+                self._reference_text(self._reference_file("domain", "domain.pddl")),
+                self._reference_text(self._reference_file("problem", f"p0{problem_id}.pddl")))
+        return preflight.check(domain_text or "", problem_text or "", ref_sig)
+
+    def _validate(self, domain_path, problem_path, plan_path, timeout, cancel=None):
+        with metrics.INFLIGHT.track(kind="val"):
+            proc = supervise.run(
+                ["./validate.sh", domain_path, problem_path, plan_path],
+                # Not stopped at the verdict: the repair advice VAL prints after it is the feedback
+                timeout=timeout, watch=["Plan executed successfully"],
+                log_path=self._log_path("validate"), cancel=cancel,
             )
-            stdout = proc.stdout or ""
-            stderr = proc.stderr or ""
-            plan_text = out_plan.read_text(encoding="utf-8") if out_plan.exists() else ""
-            ok = out_plan.exists() and bool(plan_text.strip())
-            return {
-                "ok": ok,
-                "plan": plan_text,
-                "returncode": proc.returncode,
-                "stdout": stdout,
-                "stderr": stderr,
-            }
-
-    def check_alignment(self, student_domain_text: str, student_problem_text: str, problem_id: str, *, timeout: int = 60):
+        return {
+            "ok": "Plan executed successfully" in proc["seen"],
+            "returncode": proc["returncode"],
+            "stdout": proc["stdout"],
+            "stderr": proc["stderr"],
+            "validator": "val",
+            "timed_out": proc["timed_out"],
+            "resources": proc["resources"],
+        }
+
+    def _log_path(self, kind):
+        if not self.log_dir:
+            return None
+        os.makedirs(self.log_dir, exist_ok=True)
+        return os.path.join(self.log_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{kind}-{uuid.uuid4().hex[:8]}.log")
+
+    def _validate_native(self, domain_text, problem_text, plan_text, task=None):
+        """
+        validator.py's verdict, or None if the task is outside what it supports (use VAL then).
+        task is the already loaded validator.Task of domain/problem, if there is one.
+        """
+        try:
+            with resources.measure() as usage:
+                if task is not None:
+                    res = validator.validate_task(task, plan_text)
+                else:
+                    res = validator.validate(domain_text, problem_text, plan_text)
+        except validator.UnsupportedTask:
+            return None
+        res["validator"] = "native"
+        res["resources"] = usage
+        return res
+
+    def reference_files(self, problem_id):
+        """Paths of the reference files a grading run for problem_id depends on."""
+        return [
+            self._reference_file("domain", "domain.pddl"),
+            self._reference_file("problem", f"p0{problem_id}.pddl"),
+            self._reference_file("plan", f"plan.p0{problem_id}.pddl"),
+        ]
+
+    def _bundle(self):
+        """The reference.py bundle of the reference folder, if the server loaded one."""
+        return reference.REFERENCES.get(self.reference_folder)
+
+    def _reference_file(self, kind, name):
+        bundle = self._bundle()
+        if bundle is not None and name in bundle.files:
+            # Checked when the bundle was loaded; reference.py reloads it when the files change
+            return bundle.path(name)
+        path = os.path.join(self.reference_folder, name)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Reference {kind} not found: {path}")
+        return path
+
+    def _reference_text(self, path):
+        bundle = self._bundle()
+        if bundle is not None and os.path.dirname(path) == bundle.folder:
+            text = bundle.texts.get(os.path.basename(path))
+            if text is not None:
+                return text
+        return Path(path).read_text(encoding="utf-8")
+
+    def generate_plan(self, domain_text: str, problem_text: str, *, timeout: int = 30, optimal: bool = False,
+                      max_cost=None, ws=None, cancel=None):
         """
-        Merge reference and student domain/problem via merge.py, then plan on the merged
-        files. Logic mirrors server.py's check_alignment:
+        Generate a plan using the provided domain/problem texts with the lama-first (or
+        seq-opt-merge-and-shrink) configuration of plan.sh/planoptimal.sh, through planner.py
+        so that a task translated before is not translated again. Unless optimal, the
+        plan_portfolio configurations are raced instead (portfolio.py). With optimal and
+        max_cost (e.g. optimum.reference_cost()), only plans costing at most that are searched for.
+        The planner is stopped when the threading.Event cancel is set.
+
+        Returns a dict with keys: ok, plan (if found), returncode, outcome, stdout, stderr,
+        sas_cached, cost, resources (see planner.solve), and with a portfolio config and runs.
+        """
+        with workspace.scope(ws) as ws:
+            plan_path = Path(ws.mkdir("plan-")) / "plan.pddl"
+            return self._solve(domain_text, problem_text, plan_path, timeout=timeout, optimal=optimal,
+                               max_cost=max_cost, configs=self.plan_portfolio, ws=ws, cancel=cancel)
+
+    def _solve(self, domain_text, problem_text, plan_path, *, timeout, configs, optimal=False, max_cost=None,
+               log_path=None, ws=None, cancel=None):
+        if optimal or len(configs) < 2:
+            return planner.solve(domain_text, problem_text, plan_path, timeout=timeout, optimal=optimal,
+                                 max_cost=max_cost, log_path=log_path, ws=ws, cancel=cancel)
+        return portfolio.solve(domain_text, problem_text, plan_path, configs, timeout=timeout, log_path=log_path,
+                               ws=ws, cancel=cancel)
+
+    def check_alignment(self, student_domain_text: str, student_problem_text: str, problem_id: str, *, timeout: int = 60,
+                        ws=None, cancel=None):
+        """
+        Merge reference and student domain/problem via merge.py (run in a warm merge_pool
+        worker), then plan on the merged files. Logic mirrors server.py's check_alignment:
         - If merge log contains 'Error', treat as merge failure (non-fatal to server, but alignment_ok=False).
+        - With alignment_precheck, the merge worker first checks whether (failed) is reachable
+          at all when deletes are ignored; if not, the submission is aligned. Otherwise the
+          fail actions found unreachable are left out of the merged domain, and the surviving
+          ones are reported under "precheck".
+        - With alignment_search, the merge worker then runs a breadth-first search for (failed)
+          on the merged task: an exhausted search means aligned, a plan found is a shortest
+          mis-alignment plan. Only if it hits its node/time limit is the planner run.
         - Run planner and read its log:
             * If planner log contains 'Search stopped without finding a solution.', then alignment_ok=True.
             * If a plan file is produced, alignment_ok=False and return that plan.
             * If neither, alignment failed; include error details.
-        Returns a diagnostics dict similar in spirit to (align, plan, error).
+            * Timeouts and memory-outs are told apart by Fast Downward's exit code (planner_outcome).
+            * With alignment_portfolio, its configurations race and the first decisive one wins
+              (planner_config).
+            * With alignment_decompose, the planner instead runs on one merged task per that many
+              fail actions, side by side, until one finds a plan (engine "decomposed"); the
+              status of each fail action is reported under "fail_actions".
+        Returns a diagnostics dict similar in spirit to (align, plan, error), with the merge
+        worker's and planner's resource usage under "resources". The planner is stopped when
+        the threading.Event cancel is set; a merge (with its precheck and built-in search,
+        bounded by their own limits) already sent to a merge_pool worker cannot be stopped,
+        so cancel takes effect once it returns.
         """
         # Reference paths
-        ref_domain = os.path.join(self.reference_folder, "domain.pddl")
-        ref_problem = os.path.join(self.reference_folder, f"p0{problem_id}.pddl")
-        if not os.path.isfile(ref_domain):
-            raise FileNotFoundError(f"Reference domain not found: {ref_domain}")
-        if not os.path.isfile(ref_problem):
-            raise FileNotFoundError(f"Reference problem not found: {ref_problem}")
-
-        merge_py = os.path.join(os.path.dirname(__file__), "merge.py")
-        if not os.path.isfile(merge_py):
-            raise FileNotFoundError(f"merge.py not found at {merge_py}")
-
-        with tempfile.TemporaryDirectory(prefix="pddl-merge-") as tmp:
-            tmpdir = Path(tmp)
-            # Write student inputs
-            stu_domain = tmpdir / "student.domain.pddl"
-            stu_problem = tmpdir / "student.problem.pddl"
-            stu_domain.write_text(student_domain_text or "", encoding="utf-8")
-            stu_problem.write_text(student_problem_text or "", encoding="utf-8")
-
-            merged_domain = tmpdir / "merged.domain.pddl"
-            merged_problem = tmpdir / "merged.problem.pddl"
-            plan_out = tmpdir / "merged.plan"
-            plan_log = tmpdir / "plan.merged.log"
-            merge_log = tmpdir / "merge.merged.log"
-
-            # No persistent debug artifacts
-
-            # 1) Merge and write logs
+        ref_domain = self._reference_file("domain", "domain.pddl")
+        ref_problem = self._reference_file("problem", f"p0{problem_id}.pddl")
+
+        with workspace.scope(ws) as ws:
+            plan_out = Path(ws.mkdir("merge-")) / "merged.plan"
+
+            # 1) Merge in a warm worker process (see merge_pool.py)
             try:
-                merge_proc = subprocess.run(
-                    ["python3", merge_py, ref_domain, ref_problem, str(stu_domain), str(stu_problem), str(merged_domain), str(merged_problem)],
-                    capture_output=True, text=True, timeout=timeout
+                merge_res = merge_pool.run_merge(
+                    ref_domain,
+                    ref_problem,
+                    student_domain_text or "",
+                    student_problem_text or "",
+                    timeout=timeout,
+                    precheck=self.alignment_precheck,
+                    search_limits={"node_limit": self.ALIGNMENT_NODE_LIMIT, "time_limit": self.ALIGNMENT_SEARCH_SEC}
+                    if self.alignment_search else None,
+                    decompose=self.alignment_decompose,
                 )
-                (merge_log).write_text((merge_proc.stdout or "") + ("\n" + merge_proc.stderr if merge_proc.stderr else ""), encoding="utf-8")
-                pass
             except Exception as e:
                 return {
                     "alignment_ok": False,
@@ -226,53 +336,105 @@ class Grader:
                     "plan_log": "",
                     "timed_out": False,
                     "duration_sec": 0.0,
+                    "resources": {"merge": None, "planner": None},
                 }
 
-            # Check the merge file for an error message
-            mtext = (merge_log.read_text(encoding="utf-8") if merge_log.exists() else "")
-            if "Error" in mtext:
+            # Check the merge log for an error message
+            mtext = supervise.cap_text(merge_res["log"])
+            if not merge_res["ok"] or "Error" in mtext:
                 return {
                     "alignment_ok": False,
                     "mis_alignment_plan": "",
                     "error": "Merge failed",
                     "merge_log": mtext,
                     "plan_log": "",
-                    "timed_out": False,
+                    "timed_out": merge_res.get("timed_out", False),
                     "duration_sec": 0.0,
-                    "debug_dir": str(debug_dir),
+                    "resources": {"merge": merge_res.get("resources"), "planner": None},
                 }
 
-            # 2) Plan on merged
-            planner = "./plan.sh"
+            # 2) Answered by the relaxed reachability check or the built-in search?
+            found = merge_res.get("search") or {}
+            precheck = found.get("relaxed")
+            if found.get("status") == "unreachable":
+                return {
+                    "alignment_ok": True,
+                    "mis_alignment_plan": "",
+                    "error": None,
+                    "merge_log": mtext,
+                    "plan_log": (f"Relaxed reachability: (failed) is unreachable, "
+                                 f"0 of {precheck['fail_actions']} fail actions reachable\n"
+                                 "Search stopped without finding a solution.\n"),
+                    "timed_out": False,
+                    "duration_sec": found["duration_sec"],
+                    "engine": "relaxed",
+                    "precheck": precheck,
+                    "resources": {"merge": merge_res.get("resources"), "planner": None},
+                }
+            if found.get("status") in ("plan", "exhausted"):
+                align = found["status"] == "exhausted"
+                return {
+                    "alignment_ok": align,
+                    "mis_alignment_plan": found["plan"] or "",
+                    "error": None,
+                    "merge_log": mtext,
+                    "plan_log": (f"Breadth-first search: {found['ground_actions']} ground actions, "
+                                 f"{found['expanded']} expanded, {found['generated']} generated\n"
+                                 + ("Search stopped without finding a solution.\n" if align else "Solution found.\n")),
+                    "timed_out": False,
+                    "duration_sec": found["duration_sec"],
+                    "engine": "search",
+                    "precheck": precheck,
+                    "resources": {"merge": merge_res.get("resources"), "planner": None},
+                }
+
+            # 3) Plan on merged (lama-first, as plan.sh, or the alignment_portfolio configurations
+            #    raced: blind/h^max searches prove "no mis-alignment plan" much faster)
+            #    or, decomposed, on one merged task per group of fail actions
             t0 = time.time()
-            plan_proc = subprocess.run(
-                [planner, str(plan_out), str(merged_domain), str(merged_problem), f"{timeout}s"],
-                capture_output=True, text=True, timeout=timeout + 5
-            )
+            if "subtasks" in found:
+                plan_res = decompose.solve(found["subtasks"], merge_res["problem"], plan_out, timeout=timeout,
+                                           config=self.decompose_config, log_path=self._log_path("plan.merged"),
+                                           ws=ws, cancel=cancel)
+                engine, detail = "decomposed", {"fail_actions": self._fail_actions(plan_res, precheck),
+                                                "counterexample": plan_res["counterexample"]}
+            else:
+                plan_res = self._solve(merge_res["domain"], merge_res["problem"], plan_out, timeout=timeout,
+                                       configs=self.alignment_portfolio, log_path=self._log_path("plan.merged"), ws=ws,
+                                       cancel=cancel)
+                engine, detail = "planner", {"planner_config": plan_res.get("config")}
             dur = time.time() - t0
-            # Write plan log
-            (plan_log).write_text((plan_proc.stdout or "") + ("\n" + plan_proc.stderr if plan_proc.stderr else ""), encoding="utf-8")
-            # No persistent debug artifacts
+            plog = plan_res["stdout"] + ("\n" + plan_res["stderr"] if plan_res["stderr"] else "")
+            usage = {"merge": merge_res.get("resources"), "planner": plan_res["resources"]}
 
-            # Adding 3s just because the planner cuts short
-            if dur + 3 > timeout:
+            # Fast Downward's exit code says whether it ran out of time (or was killed at the
+            # supervisor's deadline); see planner.outcome()
+            if plan_res["outcome"] == "out_of_time":
                 return {
                     "alignment_ok": False,
                     "mis_alignment_plan": "",
-                    "error": "Alignment timed out. This may indicate everything is fine.",
+                    "error": f"Alignment timed out{self._open_fail_actions(detail)}. This may indicate everything is fine.",
                     "merge_log": mtext,
-                    "plan_log": plan_log.read_text(encoding="utf-8") if plan_log.exists() else "",
+                    "plan_log": plog,
                     "timed_out": True,
                     "duration_sec": dur,
+                    "engine": engine,
+                    "precheck": precheck,
+                    "planner_outcome": plan_res["outcome"],
+                    **detail,
+                    "resources": usage,
                 }
 
-            # Check planner output for failure message
-            plog = plan_log.read_text(encoding="utf-8") if plan_log.exists() else ""
-            align = 'Search stopped without finding a solution' in plog
+            # Did the planner report 'Search stopped without finding a solution.'? (seen anywhere
+            # in its output, not just in the tail kept in plog)
+            align = plan_res["unsolvable"]
 
             # If neither aligned nor plan file exists -> alignment step failed; attach error
             error_text = None
-            if not (align or plan_out.exists()):
+            if plan_res["outcome"] == "out_of_memory":
+                error_text = (f"Alignment planner ran out of memory "
+                              f"(limit {plan_res.get('memory_limit') or planner.MEMORY_LIMIT}).")
+            elif not (align or plan_out.exists()):
                 error_text = mtext
 
             mis_plan_text = plan_out.read_text(encoding="utf-8") if plan_out.exists() else ""
@@ -285,8 +447,28 @@ class Grader:
                 "plan_log": plog,
                 "timed_out": False,
                 "duration_sec": dur,
+                "engine": engine,
+                "precheck": precheck,
+                "planner_outcome": plan_res["outcome"],
+                **detail,
+                "resources": usage,
             }
 
+    @staticmethod
+    def _fail_actions(plan_res, precheck):
+        """decompose.solve()'s fail_actions plus the ones the precheck pruned ("unreachable")."""
+        report = {name: {"direction": decompose.direction(name), "status": "unreachable", "duration_sec": 0.0}
+                  for name in (precheck or {}).get("unreachable_fail_schemas", [])}
+        report.update(plan_res["fail_actions"])
+        return dict(sorted(report.items()))
+
+    @staticmethod
+    def _open_fail_actions(detail):
+        """' for <fail actions>' naming the ones a decomposed check could not settle, else ''."""
+        names = [name for name, r in detail.get("fail_actions", {}).items()
+                 if r["status"] in ("timed_out", "skipped")]
+        return f" for {', '.join(names)}" if names else ""
+
     # def gradeall(self):
     #     sdirs = glob.glob(f'{self.submissions_loc}/*')
     #     for sdir in sdirs:
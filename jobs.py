@@ -0,0 +1,124 @@
+"""
+Asynchronous grading jobs.
+
+A grading run can take well over a minute, so instead of holding an HTTP worker for the
+whole pipeline the server can hand the work to a JobQueue: submit() returns a job id
+right away, a fixed number of worker threads drain the queue, and wait() lets a client
+long-poll for the result. The queue has a depth limit; submit() raises QueueFull when it
+is reached so the server can answer with 429.
+"""
+import queue
+import threading
+import time
+import uuid
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, payload):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.status = "queued"  # queued -> running -> done | failed
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobQueue:
+    def __init__(self, handler, *, workers=2, max_depth=64, keep_finished_sec=3600):
+        """
+        handler(payload) does the actual work and returns a JSON-serializable result; an
+        exception marks the job as failed with str(exception) as its error.
+        """
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.keep_finished_sec = keep_finished_sec
+
+        self._queue = queue.Queue(maxsize=max(1, int(max_depth)))
+        self._jobs = {}
+        self._cond = threading.Condition()
+        self._threads = []
+        self._started = False
+
+    def submit(self, payload):
+        self._start()
+        job = Job(payload)
+        with self._cond:
+            self._evict_finished()
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._cond:
+                del self._jobs[job.id]
+            raise QueueFull(f"Grading queue is full ({self._queue.maxsize} jobs waiting)")
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id, timeout=0):
+        """Return the job once it has finished or after timeout seconds, whichever is first."""
+        deadline = time.time() + max(0, timeout)
+        with self._cond:
+            job = self._jobs.get(job_id)
+            while job is not None and job.status in ("queued", "running"):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return job
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _start(self):
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+            for i in range(self.workers):
+                t = threading.Thread(target=self._work, name=f"grading-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._cond:
+                job.status = "running"
+                job.started = time.time()
+            try:
+                result = self.handler(job.payload)
+                status, error = "done", None
+            except Exception as e:
+                result, status, error = None, "failed", str(e) or e.__class__.__name__
+            with self._cond:
+                job.result = result
+                job.error = error
+                job.status = status
+                job.finished = time.time()
+                self._cond.notify_all()
+            self._queue.task_done()
+
+    def _evict_finished(self):
+        cutoff = time.time() - self.keep_finished_sec
+        for job_id in [j.id for j in self._jobs.values() if j.finished is not None and j.finished < cutoff]:
+            del self._jobs[job_id]
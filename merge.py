@@ -4,263 +4,451 @@ from tarski.syntax.formulas import neg, is_neg
 import tarski.fstrips as fs
 from tarski.io import fstrips as iofs, PDDLReader
 
-import sys, os, tempfile, glob
+import sys, os, re, copy, hashlib
+from collections import OrderedDict
 
 USAGE = """
     Usage: python3 merge.py <domain1> <problem1> <domain2> <problem2> <out-domain> <out-problem>
 """
 
+
+class MergeError(Exception):
+    """Raised when the two domains cannot be merged (different constants, types or actions)."""
+    pass
+
+
 def confirm_same(dom1, dom2, checking):
     dom1 = set(dom1)
     dom2 = set(dom2)
     if dom1 != dom2:
-        print(f"The {checking} are different for each domain")
+        message = f"The {checking} are different for each domain"
         if dom1 - dom2:
-            print("  In domain 1 but not 2: ", dom1 - dom2)
+            message += f"\n  In domain 1 but not 2:  {dom1 - dom2}"
         if dom2 - dom1:
-            print("  In domain 2 but not 1: ", dom2 - dom1)
-        sys.exit(1)
+            message += f"\n  In domain 2 but not 1:  {dom2 - dom1}"
+        raise MergeError(message)
 
 def main(domain1_name, problem1_name, domain2_name, problem2_name, merged_domain, merged_problem):
-    # Create a temporary directory for all temporary files
-    temp_dir = tempfile.mkdtemp()
-    
-    try:
-        # ======================== Algorithm ========================
-        #
-        # 1. Parse each domain with tarski to get the fluent names.
-        # 2. Forget tarski for a sec, and create new domain/problem files for each of them. Just do
-        #  a string replace for every fluent name to prepend domain1_ or domain2_). If you make sure
-        #  you do this with (<fluent_name> and not just <fluent name>, then I can't think of any reason
-        #  it would fail. An example in python: new_pddl_str = old_pddl_str.replace('(on', '(domain1_on')
-        # 3. Parse both domains again -- fluents should all be set and already renamed.
-        # 4. Compute the new (fail_<act>) actions.
-        # 5. If possible, augment one of them by adding everything from the other. Objects/types/action
-        #  names should be the same, so you're just adding to the list of predicates, action preconditions,
-        #  action effects, initial state, and goal state.
-        # 6. If this doesn't work, you'd need to create a new domain/problem from scratch.
-        # 7. Add the (failed) fluent and the (fail_<act>) actions.
-        # 8. Write the newly merged domain/problem files.
-        # 9. Modify the goal to just achieve (failed) and write that problem file too.
-        #
-        # Note: We will add all of the domain, problem changes to parse1
-        # example of terminal line python3 merge.py domain.pddl problem.pddl domain2.pddl problem2.pddl dom3.pddl prob3.pddl
-
-
-        # step 1: Parse each domain with tarski to get the fluent names
-        domain1_fluent_names = return_fluent_names(domain1_name, problem1_name, domain2_name, problem2_name)
-        domain2_fluent_names = return_fluent_names(domain2_name, problem2_name, domain2_name, problem2_name)
-
-        # step 2: Create new .pddl files using string replacements -> use fluent names from above to identify them
-        # 2a: prepend to domain files
-        prepend_names(domain1_name, domain1_fluent_names, 1, "domain", temp_dir)
-        prepend_names(domain2_name, domain2_fluent_names, 2, "domain", temp_dir)
-
-        # 2b: prepend to problem files
-        prepend_names(problem1_name, domain1_fluent_names, 1, "problem", temp_dir)
-        prepend_names(problem2_name, domain2_fluent_names, 2, "problem", temp_dir)
-
-        # step 3: Parse the new files using tarski
-        parse1 = parse_pddl(os.path.join(temp_dir, 'updated_domain1.pddl'), os.path.join(temp_dir, 'updated_problem1.pddl'))
-        parse2 = parse_pddl(os.path.join(temp_dir, 'updated_domain2.pddl'), os.path.join(temp_dir, 'updated_problem2.pddl'))
-        
-        # Clean up temporary files
-        for pattern in ['updated_domain*.pddl', 'updated_problem*.pddl']:
-            for file in glob.glob(os.path.join(temp_dir, pattern)):
-                os.remove(file)
-
-        # raise error if the name of the domains are not the same
-        assert parse1.domain_name == parse2.domain_name, "Names of the domains are differnt"
-        assert parse1.name == parse2.name, "Names of the problems are differnt"
-
-        # step 4: Compute the new (fail_<act>) actions
-        lang1 = parse1.language
-        lang2 = parse2.language
-
-        # check if the constants are the same for each domain
-        dom1_constants = set([c.name for c in lang1.constants()])
-        dom2_constants = set([c.name for c in lang2.constants()])
-        confirm_same(dom1_constants, dom2_constants, "constants")
-
-        # raise error if the types are not the same
-        dom1_types = set([ty.name for ty in lang1.sorts])
-        dom2_types = set([ty.name for ty in lang2.sorts])
-        confirm_same(dom1_types, dom2_types, "types")
-
-        # step 5a: merge the second domain to the first domain
-        # get the predicates for domain 2
-        domain2_predicates = lang2.predicates
-
-        for elem in domain2_predicates:
-            curr_name = str(elem.name)
-            if "=" not in curr_name:
-                merged_predicate = lang1.predicate(*(elem.signature))
-
-        # add the fail predicate
-        failed = lang1.predicate('failed')
-
-        # get the list of actions in each domain
-        domain1_actions = list(parse1.actions)
-        domain2_actions = list(parse2.actions)
-
-        # raise error if the number of actions are different in each domain
-        confirm_same(domain1_actions, domain2_actions, "actions")
-
-        # # for each set of domain actions get the required parameters, preconditions, effects - map domain2 to domain 1, merge preconditions
-        # #this is to make fail_turnon1, fail_turnoff1
-        for action in domain1_actions:
-            name = 'fail_' + action + '1'
-            action_domain2 = parse1.get_action(action)
-
-            # get fail action parameters
-            domain_parameters = action_domain2.parameters
-
-            # get preconditions of both domains
-            domain1_precond = action_domain2.precondition
-            domain2_precond = parse2.get_action(action).precondition
-
-            #this creates the merged preconds for fail actions for domain1
-            merged_precs = []
-            if is_neg(domain2_precond): #check if precond is already negated, if yes, get subformulas to have positive version
-                if isinstance(domain2_precond, CompoundFormula):
-                    merged_precs.extend(domain2_precond.subformulas)
-            else: #otherwise negate it
-                merged_precs.append(neg(domain2_precond))
-            merged_precs.append(domain1_precond)
-            final_prec = land(*merged_precs) # This makes land(*[A,B,C]) actually be land(A,B,C)
-
-            # add the effect 'failed' and (and) it
-            # def action(self, name, parameters, precondition, effects, cost=None)
-            pd = parse1.action(name, domain_parameters,
-                        precondition=final_prec,
-                        effects=[fs.AddEffect(failed())])
-
-
-        # # # for each set of domain actions get the required parameters, preconditions, effects - map domain1 to domain2, merge preconditions
-        # # #this is to make fail_turnon2, fail_turnoff2
-        for action in domain2_actions:
-            name = 'fail_' + action + '2'
-
-            action_domain2 = parse2.get_action(action)
-
-            # get fail action parameters
-            domain_parameters = action_domain2.parameters
+    # ======================== Algorithm ========================
+    #
+    # 1. Scan each domain's (:predicates ...) block to get the fluent names (no tarski needed).
+    # 2. Forget tarski for a sec, and rename the fluents in the domain/problem text in memory,
+    #  prepending domain1_ or domain2_ to every (<fluent_name> token. This is a single regex pass
+    #  that only matches whole names, e.g. '(on ?x)' -> '(domain1_on ?x)' but '(on-table ?x)' is
+    #  left for the on-table fluent.
+    # 3. Parse each renamed domain/problem pair with tarski -- this is the only parse of each input.
+    # 4. Compute the new (fail_<act>) actions.
+    # 5. If possible, augment one of them by adding everything from the other. Objects/types/action
+    #  names should be the same, so you're just adding to the list of predicates, action preconditions,
+    #  action effects, initial state, and goal state.
+    # 6. If this doesn't work, you'd need to create a new domain/problem from scratch.
+    # 7. Add the (failed) fluent and the (fail_<act>) actions.
+    # 8. Write the newly merged domain/problem files.
+    # 9. Modify the goal to just achieve (failed) and write that problem file too.
+    #
+    # Note: We will add all of the domain, problem changes to parse1
+    # example of terminal line python3 merge.py domain.pddl problem.pddl domain2.pddl problem2.pddl dom3.pddl prob3.pddl
+    #
+    # Steps 1-3 for domain 1 (the reference) are served from REFERENCE_CACHE when the files
+    # have not changed since the last merge.
+
+    # steps 1-3 for the reference side
+    parse1 = REFERENCE_CACHE.get(domain1_name, problem1_name).problem_copy()
+
+    # steps 1-3 for the submission side
+    parse2 = parse_renamed(_read(domain2_name), _read(problem2_name), 2)
+
+    domain_text, problem_text = merge_parsed(parse1, parse2)
+
+    with open(merged_domain, "w") as f:
+        f.write(domain_text)
+    with open(merged_problem, "w") as f:
+        f.write(problem_text)
+
+
+def merge_parsed(parse1, parse2):
+    """
+    Steps 4-9 of the algorithm in main(): merge the renamed parse2 into parse1 and return
+    the (merged_domain_text, merged_problem_text). parse1 is modified in place.
+    """
+    # raise error if the name of the domains are not the same
+    assert parse1.domain_name == parse2.domain_name, "Names of the domains are differnt"
+    assert parse1.name == parse2.name, "Names of the problems are differnt"
+
+    # step 4: Compute the new (fail_<act>) actions
+    lang1 = parse1.language
+    lang2 = parse2.language
+
+    # check if the constants are the same for each domain
+    dom1_constants = set([c.name for c in lang1.constants()])
+    dom2_constants = set([c.name for c in lang2.constants()])
+    confirm_same(dom1_constants, dom2_constants, "constants")
+
+    # raise error if the types are not the same
+    dom1_types = set([ty.name for ty in lang1.sorts])
+    dom2_types = set([ty.name for ty in lang2.sorts])
+    confirm_same(dom1_types, dom2_types, "types")
+
+    # step 5a: merge the second domain to the first domain
+    # get the predicates for domain 2
+    domain2_predicates = lang2.predicates
+
+    for elem in domain2_predicates:
+        curr_name = str(elem.name)
+        if "=" not in curr_name:
+            merged_predicate = lang1.predicate(*(elem.signature))
+
+    # add the fail predicate
+    failed = lang1.predicate('failed')
+
+    # get the list of actions in each domain
+    domain1_actions = list(parse1.actions)
+    domain2_actions = list(parse2.actions)
+
+    # raise error if the number of actions are different in each domain
+    confirm_same(domain1_actions, domain2_actions, "actions")
+
+    # # for each set of domain actions get the required parameters, preconditions, effects - map domain2 to domain 1, merge preconditions
+    # #this is to make fail_turnon1, fail_turnoff1
+    for action in domain1_actions:
+        name = 'fail_' + action + '1'
+        action_domain2 = parse1.get_action(action)
 
-            # get preconditions of both domains
-            domain1_precond = parse1.get_action(action).precondition
-            domain2_precond = action_domain2.precondition
-
-            #this creates the merged preconds for fail actions for domain2
-            merged_precs = []
-            if is_neg(domain1_precond):
-                if isinstance(domain1_precond, CompoundFormula):
-                    merged_precs.extend(domain1_precond.subformulas)
-            else:
-                merged_precs.append(neg(domain1_precond))
-            merged_precs.append(domain2_precond)
-
-            final_prec = land(*merged_precs) # This makes land(*[A,B,C]) actually be land(A,B,C)
-
-            # make effect 'failed'
-            pd = parse1.action(name, domain_parameters,
-                        precondition=final_prec,
-                        effects=[fs.AddEffect(failed())])
+        # get fail action parameters
+        domain_parameters = action_domain2.parameters
 
-        # # merge the non fail actions from domain2 onto domain1
-        for action in domain2_actions:
-            name = action
+        # get preconditions of both domains
+        domain1_precond = action_domain2.precondition
+        domain2_precond = parse2.get_action(action).precondition
 
-            # get the actions from domain2
-            action_domain2 = parse2.get_action(action)
-            action_domain1 = parse1.get_action(action)
+        #this creates the merged preconds for fail actions for domain1
+        merged_precs = []
+        if is_neg(domain2_precond): #check if precond is already negated, if yes, get subformulas to have positive version
+            if isinstance(domain2_precond, CompoundFormula):
+                merged_precs.extend(domain2_precond.subformulas)
+        else: #otherwise negate it
+            merged_precs.append(neg(domain2_precond))
+        merged_precs.append(domain1_precond)
+        final_prec = land(*merged_precs) # This makes land(*[A,B,C]) actually be land(A,B,C)
 
-            # get fail action parameters
-            domain_parameters = action_domain2.parameters
+        # add the effect 'failed' and (and) it
+        # def action(self, name, parameters, precondition, effects, cost=None)
+        pd = parse1.action(name, domain_parameters,
+                    precondition=final_prec,
+                    effects=[fs.AddEffect(failed())])
 
-            # get preconditions of both domains
-            domain1_precond = action_domain1.precondition
-            domain2_precond = action_domain2.precondition
 
-            # merge the preconditions
-            merged_precs = []
-            merged_precs.append(domain1_precond)
-            merged_precs.append(domain2_precond)
-            final_prec = land(*merged_precs)
+    # # # for each set of domain actions get the required parameters, preconditions, effects - map domain1 to domain2, merge preconditions
+    # # #this is to make fail_turnon2, fail_turnoff2
+    for action in domain2_actions:
+        name = 'fail_' + action + '2'
 
-            # get the effects of both domains and merge
-            domain1_effects = action_domain1.effects
-            domain2_effects = action_domain2.effects
+        action_domain2 = parse2.get_action(action)
 
-            for effect in domain2_effects:
-                domain1_effects.append(effect)
+        # get fail action parameters
+        domain_parameters = action_domain2.parameters
 
-            # merge action
-            action_domain1.parameters = domain_parameters
-            action_domain1.precondition = final_prec
-            action_domain1.effects = domain1_effects
+        # get preconditions of both domains
+        domain1_precond = parse1.get_action(action).precondition
+        domain2_precond = action_domain2.precondition
 
-        # merge the init
-        # get domain1 and domain2 inital states and add them to the merged_initial states
+        #this creates the merged preconds for fail actions for domain2
+        merged_precs = []
+        if is_neg(domain1_precond):
+            if isinstance(domain1_precond, CompoundFormula):
+                merged_precs.extend(domain1_precond.subformulas)
+        else:
+            merged_precs.append(neg(domain1_precond))
+        merged_precs.append(domain2_precond)
 
-        for atom in parse2.init.as_atoms():
-            pred = lang1.get_predicate(atom.predicate.name)
-            args = [lang1.get(o.symbol) for o in atom.subterms]
-            parse1.init.add(pred(*args))
+        final_prec = land(*merged_precs) # This makes land(*[A,B,C]) actually be land(A,B,C)
 
+        # make effect 'failed'
+        pd = parse1.action(name, domain_parameters,
+                    precondition=final_prec,
+                    effects=[fs.AddEffect(failed())])
 
-        # merge final
-        parse1.goal = (failed())
+    # # merge the non fail actions from domain2 onto domain1
+    for action in domain2_actions:
+        name = action
 
-        writer = iofs.FstripsWriter(parse1)
-        writer.write(merged_domain, merged_problem)
+        # get the actions from domain2
+        action_domain2 = parse2.get_action(action)
+        action_domain1 = parse1.get_action(action)
 
-        # fix requirements to add in negative precondition requirement
-        with open(merged_domain, "r") as file_read:
-            file_content = file_read.read()
+        # get fail action parameters
+        domain_parameters = action_domain2.parameters
 
-        file_content = file_content.replace("(:requirements ", "(:requirements :negative-preconditions ")
+        # get preconditions of both domains
+        domain1_precond = action_domain1.precondition
+        domain2_precond = action_domain2.precondition
 
-        with open(merged_domain, "w") as updated_domain:
-            updated_domain.write(file_content)
+        # merge the preconditions
+        merged_precs = []
+        merged_precs.append(domain1_precond)
+        merged_precs.append(domain2_precond)
+        final_prec = land(*merged_precs)
 
-    finally:
-        # Clean up the temporary directory
-        for pattern in ['updated_domain*.pddl', 'updated_problem*.pddl']:
-            for file in glob.glob(os.path.join(temp_dir, pattern)):
-                os.remove(file)
-        os.rmdir(temp_dir)
+        # get the effects of both domains and merge
+        domain1_effects = action_domain1.effects
+        domain2_effects = action_domain2.effects
 
+        for effect in domain2_effects:
+            domain1_effects.append(effect)
 
-def return_fluent_names(dname, pname, domain2_name, problem2_name):
-    temp_parse = parse_pddl(dname, pname)
-    temp_lang = temp_parse.language
-    listPredicates = temp_lang.predicates
+        # merge action
+        action_domain1.parameters = domain_parameters
+        action_domain1.precondition = final_prec
+        action_domain1.effects = domain1_effects
 
-    domain1_fluent_names = []
+    # merge the init
+    # get domain1 and domain2 inital states and add them to the merged_initial states
+
+    for atom in parse2.init.as_atoms():
+        pred = lang1.get_predicate(atom.predicate.name)
+        args = [lang1.get(o.symbol) for o in atom.subterms]
+        parse1.init.add(pred(*args))
+
+
+    # merge final
+    parse1.goal = (failed())
+
+    return write_pddl(parse1)
 
-    for elem in listPredicates:
-        curr_name = str(elem.name)
-        if "=" not in curr_name:
-            domain1_fluent_names.append(curr_name)
 
-    temp_parse = parse_pddl(domain2_name, problem2_name)
-    temp_lang = temp_parse.language
-    listPredicates = temp_lang.predicates
+def write_pddl(problem):
+    """Step 8: the (domain_text, problem_text) of a merged problem."""
+    writer = iofs.FstripsWriter(problem)
+    domain_text = writer.print_domain()
+    problem_text = writer.print_instance()
+
+    # fix requirements to add in negative precondition requirement
+    domain_text = domain_text.replace("(:requirements ", "(:requirements :negative-preconditions ")
 
-    return domain1_fluent_names
+    return domain_text, problem_text
 
 
-def prepend_names(file_name, fluent_names, number, type, temp_dir):
-    with open(file_name, "r") as file_read:
-        file_content = file_read.read()
+def split_fail_actions(problem, group_size=1):
+    """
+    A merged problem's domain split up by fail action: one domain per group_size fail_
+    actions (in name order, so fail_<act>1 and fail_<act>2 end up side by side), with all
+    the regular actions but only that group's fail actions. (failed) is reachable in the
+    merged task exactly when it is in one of these. The problem text is the same for all.
+
+    Returns [{"actions": [fail action names], "domain": domain_text}, ...].
+    """
+    actions = problem.actions
+    fail = sorted(name for name in actions if name.startswith("fail_"))
+    regular = [(name, action) for name, action in actions.items() if not name.startswith("fail_")]
+    group_size = max(1, int(group_size))
+    subtasks = []
+    try:
+        for i in range(0, len(fail), group_size):
+            group = fail[i:i + group_size]
+            problem.actions = OrderedDict(regular + [(name, actions[name]) for name in group])
+            subtasks.append({"actions": group, "domain": write_pddl(problem)[0]})
+    finally:
+        problem.actions = actions
+    return subtasks
+
+
+def parse_renamed(domain_text, problem_text, number):
+    """Steps 1-3 for a single domain/problem pair: prepend domain<number>_ to the fluents and parse once."""
+    fluent_names = return_fluent_names(domain_text)
+    return parse_pddl_text(prepend_names(domain_text, fluent_names, number),
+                           prepend_names(problem_text, fluent_names, number))
+
+
+class ReferenceEntry:
+    """A parsed, domain1_-renamed reference pair together with the identity of its files."""
+
+    def __init__(self, files, problem, fluent_names, renamed_domain, renamed_problem):
+        self.files = files  # {path: (mtime_ns, size, sha256)}
+        self.problem = problem
+        self.fluent_names = fluent_names
+        self.renamed_domain = renamed_domain
+        self.renamed_problem = renamed_problem
+
+    def problem_copy(self):
+        """
+        A private copy of the parsed problem that merge_parsed() can modify. tarski refuses to
+        deepcopy languages and sorts through copy.deepcopy, so both are copied by hand and
+        seeded into the memo before copying the rest of the problem.
+        """
+        lang = self.problem.language
+        new_lang = object.__new__(type(lang))
+        memo = {id(lang): new_lang}
+        sorts = []
+        for sort in lang.sorts:
+            new_sort = copy.copy(sort)
+            new_sort.language = new_lang
+            memo[id(sort)] = new_sort
+            sorts.append((sort, new_sort))
+        for k, v in lang.__dict__.items():
+            setattr(new_lang, k, copy.deepcopy(v, memo))
+        for sort, new_sort in sorts:
+            new_sort._domain = copy.deepcopy(sort._domain, memo)
+        return copy.deepcopy(self.problem, memo)
+
+
+class ReferenceCache:
+    """
+    Cache of parsed reference domain/problem pairs. The reference folder only changes when
+    course staff edit it, so each pair is parsed and renamed once and reused until one of
+    its files changes. A changed mtime/size triggers a re-hash; the entry is only rebuilt
+    if the content hash differs.
+    """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, domain_name, problem_name):
+        key = (os.path.abspath(domain_name), os.path.abspath(problem_name))
+        entry = self.entries.get(key)
+        if entry is not None and self._still_valid(entry):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        entry = self._load(*key)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+
+    def discard(self, domain_name, problem_name):
+        self.entries.pop((os.path.abspath(domain_name), os.path.abspath(problem_name)), None)
+
+    def _still_valid(self, entry):
+        for path, (mtime_ns, size, digest) in list(entry.files.items()):
+            st = os.stat(path)
+            if (st.st_mtime_ns, st.st_size) == (mtime_ns, size):
+                continue
+            if _file_digest(path) != digest:
+                return False
+            # touched but unchanged: remember the new stat so we don't hash it again
+            entry.files[path] = (st.st_mtime_ns, st.st_size, digest)
+        return True
+
+    def _load(self, domain_name, problem_name):
+        files = {}
+        for path in (domain_name, problem_name):
+            st = os.stat(path)
+            files[path] = (st.st_mtime_ns, st.st_size, _file_digest(path))
+
+        fluent_names = return_fluent_names(_read(domain_name))
+        renamed_domain = prepend_names(_read(domain_name), fluent_names, 1)
+        renamed_problem = prepend_names(_read(problem_name), fluent_names, 1)
+        problem = parse_pddl_text(renamed_domain, renamed_problem)
+
+        return ReferenceEntry(files, problem, fluent_names, renamed_domain, renamed_problem)
+
+
+def _file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# Process-wide cache; long-lived merge_pool workers keep it warm between requests
+REFERENCE_CACHE = ReferenceCache()
+
+
+def merge_pddl(domain1_text, problem1_text, domain2_text, problem2_text):
+    """
+    Callable version of main() that works on PDDL text instead of file names.
+
+    Returns a (merged_domain_text, merged_problem_text) tuple. Raises MergeError if the
+    domains cannot be merged, and tarski's parsing errors if an input is not valid PDDL.
+    """
+    parse1 = parse_renamed(domain1_text or "", problem1_text or "", 1)
+    parse2 = parse_renamed(domain2_text or "", problem2_text or "", 2)
+    return merge_parsed(parse1, parse2)
+
+
+def merge_reference(domain1_name, problem1_name, domain2_text, problem2_text):
+    """
+    Like merge_pddl(), but the first pair is a reference domain/problem given by file name,
+    so its parse comes from REFERENCE_CACHE. Only the submission side is parsed per call.
+    """
+    _, domain_text, problem_text = merge_reference_problem(domain1_name, problem1_name, domain2_text, problem2_text)
+    return domain_text, problem_text
+
+
+def merge_reference_problem(domain1_name, problem1_name, domain2_text, problem2_text):
+    """merge_reference(), also returning the merged tarski problem: (problem, domain_text, problem_text)."""
+    parse1 = REFERENCE_CACHE.get(domain1_name, problem1_name).problem_copy()
+    parse2 = parse_renamed(domain2_text or "", problem2_text or "", 2)
+    domain_text, problem_text = merge_parsed(parse1, parse2)
+    return parse1, domain_text, problem_text
+
+
+# Parentheses, comments and everything in between, in order
+_TOKENS = re.compile(r";[^\n]*|\(|\)|[^\s();]+")
+
+
+def return_fluent_names(domain_text):
+    """
+    Names of the predicates declared in the (:predicates ...) block of a domain, in
+    declaration order and lower-cased the way tarski stores them.
+    """
+    tokens = [t for t in _TOKENS.findall(domain_text) if not t.startswith(";")]
+    fluent_names = []
+    for i in range(len(tokens) - 1):
+        if tokens[i] == "(" and tokens[i + 1].lower() == ":predicates":
+            depth = 1
+            j = i + 2
+            while j < len(tokens) and depth > 0:
+                if tokens[j] == "(":
+                    depth += 1
+                    if depth == 2 and j + 1 < len(tokens) and tokens[j + 1] not in "()":
+                        name = tokens[j + 1].lower()
+                        if name not in fluent_names:
+                            fluent_names.append(name)
+                elif tokens[j] == ")":
+                    depth -= 1
+                j += 1
+            break
+    return fluent_names
+
+
+# The token that follows an opening parenthesis
+_HEAD = re.compile(r"\s*([^\s();]+)")
+
+
+def prepend_names(text, fluent_names, number):
+    """
+    Prepend domain<number>_ to every predicate token in a single pass over the text. The
+    text is split at '(' and only a head token that is exactly a fluent name (any case,
+    whitespace allowed after the parenthesis) is renamed, so (on never touches (on-table.
+    """
+    fluent_names = set(fluent_names)
+    prefix = "domain" + str(number) + "_"
+    parts = text.split("(")
+    for i in range(1, len(parts)):
+        head = _HEAD.match(parts[i])
+        if head and head.group(1).lower() in fluent_names:
+            start = head.start(1)
+            parts[i] = parts[i][:start] + prefix + parts[i][start:]
+    return "(".join(parts)
+
+
+def parse_pddl_text(domain_text, problem_text):
+    reader = PDDLReader(raise_on_error=True)
+    reader.parse_domain_string(domain_text)
+    return reader.parse_instance_string(problem_text)
 
-    for pred in fluent_names:
-        tmp_name = "(" + pred
-        rpl_name = "(domain" + str(number) + "_" + pred
-        file_content = file_content.replace(tmp_name, rpl_name)
 
-    with open(os.path.join(temp_dir, "updated_" + type + str(number) +".pddl"), "w") as updated_domain:
-        updated_domain.write(file_content)
+def _read(file_name):
+    with open(file_name, "r") as f:
+        return f.read()
 
 
 def parse_pddl(dname, pname):
@@ -282,6 +470,10 @@ if __name__ == "__main__":
     merged_domain = sys.argv[5]
     merged_problem = sys.argv[6]
 
-    main(domain1_name, problem1_name, domain2_name, problem2_name, merged_domain, merged_problem)
+    try:
+        main(domain1_name, problem1_name, domain2_name, problem2_name, merged_domain, merged_problem)
+    except MergeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
 
 
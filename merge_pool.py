@@ -0,0 +1,287 @@
+"""
+Pool of pre-warmed worker processes that run merge.py in-process.
+
+Starting `python3 merge.py` for every alignment check pays for interpreter startup and
+the tarski/antlr import before any merging happens. Each worker here imports merge (and
+therefore tarski) once and then serves merge requests over a pipe. A worker that crashes
+or runs past its timeout is killed and replaced, so one bad submission cannot take the
+pool down.
+
+Usage:
+    from merge_pool import run_merge
+    result = run_merge(ref_domain_path, ref_problem_path, stu_domain_text, stu_problem_text, timeout=60)
+    if result["ok"]:
+        merged_domain, merged_problem = result["domain"], result["problem"]
+"""
+import contextlib
+import io
+import multiprocessing as mp
+import os
+import queue
+import resource
+import threading
+import time
+import traceback
+
+import resources
+
+
+# Number of merge workers; override with the MERGE_WORKERS environment variable
+DEFAULT_WORKERS = int(os.environ.get("MERGE_WORKERS", min(4, os.cpu_count() or 1)))
+
+
+class WorkerCrashed(Exception):
+    pass
+
+
+class WorkerTimeout(Exception):
+    pass
+
+
+def _worker_main(conn):
+    # Warm up: this is the expensive import we only want to pay once per worker
+    import merge  # noqa: F401
+    import search  # noqa: F401
+
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if msg is None:
+            break
+        func, args, kwargs = msg
+        log = io.StringIO()
+        t0, ru0 = time.time(), resource.getrusage(resource.RUSAGE_SELF)
+        try:
+            with contextlib.redirect_stdout(log):
+                value = func(*args, **kwargs)
+            reply = (True, value, log.getvalue())
+        except Exception:
+            reply = (False, traceback.format_exc(), log.getvalue())
+        conn.send(reply + (_usage_since(t0, ru0),))
+
+
+def _usage_since(t0, ru0):
+    """Worker CPU time used since ru0; max_rss_mb is the worker's peak so far."""
+    usage = resources.from_rusage(resource.getrusage(resource.RUSAGE_SELF), time.time() - t0)
+    usage["user_sec"] = round(usage["user_sec"] - ru0.ru_utime, 3)
+    usage["sys_sec"] = round(usage["sys_sec"] - ru0.ru_stime, 3)
+    return usage
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+
+
+class WorkerPool:
+    """
+    A fixed number of long-lived worker processes. call() blocks until a worker is free,
+    runs the function there and returns (ok, value, log, usage), where value is the
+    traceback text when ok is False and usage is the call's resources.py usage dict.
+    """
+
+    def __init__(self, size=DEFAULT_WORKERS):
+        self.size = max(1, int(size))
+        # spawn keeps workers independent of whatever threads the server has running
+        self._ctx = mp.get_context("spawn")
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        # One broadcast at a time: two holding part of the workers each would wait for the other forever
+        self._broadcast_lock = threading.Lock()
+        self._closed = False
+        for _ in range(self.size):
+            self._idle.put(_Worker(self._ctx))
+
+    def call(self, func, *args, timeout=60, **kwargs):
+        if self._closed:
+            raise RuntimeError("WorkerPool is closed")
+        return self._call(self._idle.get(), func, args, kwargs, timeout, release=self._idle.put)
+
+    def broadcast(self, func, *args, timeout=60, **kwargs):
+        """
+        call() on every worker once, e.g. to warm a per-process cache; returns the list of
+        results. Each worker finishes what it is doing first, and the ones done are held back
+        until all are, so calls made meanwhile wait. Broadcasts from several threads run one
+        after the other.
+        """
+        with self._broadcast_lock:
+            if self._closed:
+                raise RuntimeError("WorkerPool is closed")
+            done = []
+            results = []
+            try:
+                for _ in range(self.size):
+                    results.append(self._call(self._idle.get(), func, args, kwargs, timeout, release=done.append))
+            finally:
+                for worker in done:
+                    self._idle.put(worker)
+            return results
+
+    def _call(self, worker, func, args, kwargs, timeout, release):
+        healthy = False
+        try:
+            if not worker.process.is_alive():
+                worker.kill()
+                worker = _Worker(self._ctx)
+            try:
+                worker.conn.send((func, args, kwargs))
+                if not worker.conn.poll(timeout):
+                    raise WorkerTimeout(f"worker did not finish within {timeout}s")
+                result = worker.conn.recv()
+            except (EOFError, OSError, BrokenPipeError) as e:
+                raise WorkerCrashed(f"worker exited unexpectedly (exitcode={worker.process.exitcode})") from e
+            healthy = True
+            return result
+        finally:
+            if not healthy:
+                # Replace the crashed/stuck worker so the pool keeps its size
+                worker.kill()
+                worker = _Worker(self._ctx)
+            release(worker)
+
+    def close(self):
+        # Like a broadcast, close() takes every worker, so it waits for the one running
+        with self._broadcast_lock:
+            with self._lock:
+                self._closed = True
+            for _ in range(self.size):
+                worker = self._idle.get()
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+                worker.kill()
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide merge pool, starting it on first use."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = WorkerPool(DEFAULT_WORKERS)
+        return _POOL
+
+
+def _merge_task(ref_domain_path, ref_problem_path, domain_text, problem_text, precheck=False, search_limits=None,
+                decompose=0):
+    import merge
+    if not precheck and search_limits is None and not decompose:
+        return merge.merge_reference(ref_domain_path, ref_problem_path, domain_text, problem_text)
+
+    import search
+    from validator import UnsupportedTask
+    problem, merged_domain, merged_problem = merge.merge_reference_problem(
+        ref_domain_path, ref_problem_path, domain_text, problem_text)
+    result = {"status": "skipped", "plan": None}
+    if precheck or search_limits is not None:
+        try:
+            result = search.search(problem, relaxed=precheck, bfs=search_limits is not None, **(search_limits or {}))
+        except UnsupportedTask as e:
+            result = {"status": "unsupported", "reason": str(e), "plan": None}
+    if result["status"] not in ("skipped", "limit", "unsupported"):
+        return merged_domain, merged_problem, result
+
+    # Hand the planner a merged domain without the fail actions that can never apply
+    pruned = result.get("relaxed", {}).get("unreachable_fail_schemas")
+    if pruned:
+        for name in pruned:
+            del problem.actions[name]
+        merged_domain, merged_problem = merge.write_pddl(problem)
+    if decompose:
+        result["subtasks"] = merge.split_fail_actions(problem, decompose)
+    return merged_domain, merged_problem, result
+
+
+def _warm_references(pairs):
+    import merge
+    failed = {}
+    for ref_domain_path, ref_problem_path in pairs:
+        try:
+            merge.REFERENCE_CACHE.get(ref_domain_path, ref_problem_path)
+        except Exception as e:
+            failed[ref_problem_path] = f"{type(e).__name__}: {e}"
+    return failed
+
+
+def warm_references(pairs, *, timeout=60):
+    """
+    Load the (reference domain path, reference problem path) pairs into merge.REFERENCE_CACHE
+    in every worker, so the first merge against them skips parsing. Returns {problem path:
+    error} for the pairs merge could not load.
+    """
+    pairs = [(os.path.abspath(d), os.path.abspath(p)) for d, p in pairs]
+    failed = {}
+    for ok, value, log, usage in get_pool().broadcast(_warm_references, pairs, timeout=timeout):
+        if not ok:
+            raise WorkerCrashed(value.strip().split("\n")[-1])
+        failed.update(value)
+    return failed
+
+
+def _forget_references(pairs):
+    import merge
+    for ref_domain_path, ref_problem_path in pairs:
+        merge.REFERENCE_CACHE.discard(ref_domain_path, ref_problem_path)
+
+
+def forget_references(pairs, *, timeout=60):
+    """Drop the (reference domain path, reference problem path) pairs from every worker's merge.REFERENCE_CACHE."""
+    pairs = [(os.path.abspath(d), os.path.abspath(p)) for d, p in pairs]
+    get_pool().broadcast(_forget_references, pairs, timeout=timeout)
+
+
+def run_merge(ref_domain_path, ref_problem_path, domain_text, problem_text, *, timeout=60, precheck=False,
+              search_limits=None, decompose=0):
+    """
+    Merge a reference domain/problem (given by path, so each worker can keep its parse in
+    merge.REFERENCE_CACHE) with a submitted domain/problem (given as text) in a warm worker.
+
+    Returns a dict with keys: ok, domain, problem, log, error, timed_out, resources. The log holds whatever
+    merge printed plus the traceback on failure, so it can be checked for 'Error'
+    the same way the merge.py log file used to be.
+
+    With precheck and/or search_limits (node_limit, time_limit) the worker also runs
+    search.search() on the merged task, while it still has it parsed, and the dict gets its
+    result under "search": precheck is the relaxed reachability pass, search_limits the
+    breadth-first search. If neither settles the question, the returned merged domain no
+    longer has the fail actions the precheck found unreachable.
+
+    With decompose (a group size), a "search" result that leaves the question open also has
+    "subtasks": the merged domain split into one domain per that many fail actions
+    (merge.split_fail_actions()), for decompose.py to plan on side by side.
+    """
+    try:
+        ok, value, log, usage = get_pool().call(
+            _merge_task, os.path.abspath(ref_domain_path), os.path.abspath(ref_problem_path),
+            domain_text, problem_text, precheck, search_limits, decompose, timeout=timeout
+        )
+    except (WorkerTimeout, WorkerCrashed) as e:
+        return {"ok": False, "domain": "", "problem": "", "log": f"Error: {e}", "error": str(e),
+                "timed_out": isinstance(e, WorkerTimeout), "resources": None}
+
+    if not ok:
+        return {"ok": False, "domain": "", "problem": "", "log": log + value, "error": value.strip().split("\n")[-1],
+                "timed_out": False, "resources": usage}
+    result = {"ok": True, "domain": value[0], "problem": value[1], "log": log, "error": None, "timed_out": False,
+              "resources": usage}
+    if precheck or search_limits is not None or decompose:
+        result["search"] = value[2]
+    return result
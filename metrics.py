@@ -0,0 +1,265 @@
+"""
+Counters, gauges and histograms for the grading service, rendered in the Prometheus text
+format on /metrics.
+
+Updates only take a lock and touch a dict, so they are cheap enough for every request and
+every planner run. Metrics live in the process that records them; when the service runs as
+several processes (e.g. gunicorn workers), set $METRICS_DIR to a directory they share: each
+process then writes its values there every METRICS_FLUSH_SEC seconds, and render() adds up
+the files of all processes (gauges only for processes that are still running).
+
+Usage:
+    REQUESTS.inc(endpoint="/grade", status="200")
+    STAGE_SECONDS.observe(1.7, stage="generate_plan")
+    with INFLIGHT.track(kind="planner"):
+        run_planner()
+    text = metrics.render()
+"""
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_DIR = os.environ.get("METRICS_DIR") or None
+METRICS_FLUSH_SEC = float(os.environ.get("METRICS_FLUSH_SEC", "5"))
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[k]) for k in self.labels)
+
+    def samples(self):
+        """[(label values, value)] for counters and gauges; histograms override this."""
+        with self._lock:
+            return list(self._values.items())
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that goes up and down. With func, it is read from func() at render time instead."""
+    type = "gauge"
+
+    def __init__(self, name, help, labels=(), func=None):
+        super().__init__(name, help, labels)
+        self.func = func
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self):
+        if self.func is not None:
+            return [((), self.func())]
+        return super().samples()
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = next((i for i, b in enumerate(self.buckets) if value <= b), len(self.buckets))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # per-bucket (not cumulative) counts, the +Inf bucket last, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            return [(key, list(counts)) for key, counts in self._values.items()]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+        self._flusher = None
+
+    def register(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"Metric {metric.name} registered twice")
+            self._metrics.append(metric)
+            if METRICS_DIR and self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self._flusher.start()
+
+    def collect(self):
+        """{name: {label values as a list: value}} of this process, as written to METRICS_DIR."""
+        with self._lock:
+            metrics = list(self._metrics)
+        return {m.name: [[list(key), value] for key, value in m.samples()] for m in metrics}
+
+    def flush(self):
+        """Write this process's values to METRICS_DIR (atomically)."""
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=METRICS_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.collect(), f)
+        os.replace(tmp, os.path.join(METRICS_DIR, f"{os.getpid()}.json"))
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_SEC)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def render(self):
+        if METRICS_DIR:
+            self.flush()
+            values = self._merged()
+        else:
+            values = {name: {tuple(k): v for k, v in samples} for name, samples in self.collect().items()}
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.type}")
+            for key, value in sorted(values.get(m.name, {}).items()):
+                labels = dict(zip(m.labels, key))
+                if m.type == "histogram":
+                    cumulative = 0
+                    for bound, count in zip(list(m.buckets) + [math.inf], value[:-1]):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else _number(bound)
+                        lines.append(f"{m.name}_bucket{_labels({**labels, 'le': le})} {cumulative}")
+                    lines.append(f"{m.name}_sum{_labels(labels)} {_number(value[-1])}")
+                    lines.append(f"{m.name}_count{_labels(labels)} {cumulative}")
+                else:
+                    lines.append(f"{m.name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _merged(self):
+        with self._lock:
+            gauges = {m.name for m in self._metrics if m.type == "gauge"}
+        merged = {}
+        for name in os.listdir(METRICS_DIR):
+            if not name.endswith(".json"):
+                continue
+            try:
+                pid = int(name[:-5])
+                with open(os.path.join(METRICS_DIR, name), encoding="utf-8") as f:
+                    data = json.load(f)
+            except (ValueError, OSError):
+                continue
+            alive = _alive(pid)
+            for metric, samples in data.items():
+                if metric in gauges and not alive:
+                    continue
+                into = merged.setdefault(metric, {})
+                for key, value in samples:
+                    key = tuple(key)
+                    if isinstance(value, list):
+                        old = into.get(key)
+                        into[key] = value if old is None else [a + b for a, b in zip(old, value)]
+                    else:
+                        into[key] = into.get(key, 0) + value
+        return merged
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return "{" + body + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+REGISTRY = Registry()
+
+
+def render():
+    return REGISTRY.render()
+
+
+# -----------------------
+# Grading service metrics
+# -----------------------
+REQUESTS = Counter("grader_http_requests_total", "HTTP requests by endpoint and status code.",
+                   ["endpoint", "method", "status"])
+REQUEST_SECONDS = Histogram("grader_http_request_seconds", "HTTP request latency by endpoint.", ["endpoint"])
+STAGE_SECONDS = Histogram("grader_stage_seconds", "Latency of grading stages.", ["stage"])
+TIMEOUTS = Counter("grader_timeouts_total", "Grading stages that hit a time limit.", ["stage"])
+CACHE_REQUESTS = Counter("grader_cache_requests_total", "Result/translation cache lookups.", ["cache", "result"])
+SCHEDULER_WAIT_SECONDS = Histogram("grader_scheduler_wait_seconds",
+                                   "Time planner runs waited for memory and a CPU (scheduler.py).")
+INFLIGHT = Gauge("grader_inflight_processes", "Planner/VAL processes currently running.", ["kind"])
+PREFLIGHT_REJECTIONS = Counter("grader_preflight_rejections_total",
+                               "Submissions turned away by the pre-flight check, by its first failed check.", ["check"])
+PORTFOLIO_WINS = Counter("grader_portfolio_wins_total",
+                         "Planner portfolio races by the configuration that answered first (\"none\" if none did).",
+                         ["config"])
+ALIGNMENT_SUBTASKS = Counter("grader_alignment_subtasks_total",
+                             "Per-fail-action alignment subtasks by how they ended (counterexample, aligned, timed_out, ...).",
+                             ["status"])
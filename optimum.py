@@ -0,0 +1,119 @@
+"""
+Optimal plan costs of reference problems, computed once and kept next to the reference files.
+
+planoptimal.sh on a PLAN_ONLY_PROBLEMS problem used to search without any bound, which makes
+the optimal search on student domains the slowest step of batch grading. The reference
+problem's optimal cost is known after one optimal run on the reference itself, so
+reference_cost() computes it the first time it is asked for and stores it in the reference
+folder's CACHE_FILE, keyed on the normalized reference domain/problem text (see
+planner.TranslationCache.make_key), so an edited reference is planned on again. The grading
+runs are then bounded by it (planoptimal.sh's fifth argument, planner.solve(max_cost=...)):
+the search finds a plan costing at most that, or proves there is none, without exploring
+beyond the known optimum. A problem missing from the reference folder has no known optimum,
+and its grading runs stay unbounded.
+
+Several grading processes asking at once wait on a lock file instead of all planning; a
+reference run that did not finish is remembered too, and only tried again with more time.
+
+Usage:
+    cost = optimum.reference_cost("data/example_2/reference", "p04.pddl")   # None if unknown
+"""
+import fcntl
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import planner
+import workspace
+
+CACHE_FILE = "optimal_costs.json"
+OPTIMUM_TIMEOUT = int(os.environ.get("REFERENCE_OPTIMUM_TIMEOUT", "600"))
+
+
+def reference_cost(reference_folder, problem_file, *, timeout=None, log_path=None):
+    """
+    The optimal plan cost of reference problem problem_file (e.g. "p04.pddl") on the
+    reference domain.pddl, from the cache or by planning on it now. None if the reference is
+    missing, unsolvable, or the optimal planner did not finish within timeout seconds.
+    """
+    timeout = timeout or OPTIMUM_TIMEOUT
+    try:
+        domain_text = Path(reference_folder, "domain.pddl").read_text(encoding="utf-8")
+        problem_text = Path(reference_folder, problem_file).read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    key = planner.TranslationCache.make_key(domain_text, problem_text)
+    path = os.path.join(reference_folder, CACHE_FILE)
+
+    with _locked(path + ".lock"):
+        entries = _load(path)
+        entry = entries.get(problem_file)
+        if entry is not None and entry["key"] == key and (entry["cost"] is not None or entry["timeout"] >= timeout):
+            return entry["cost"]
+
+        t0 = time.time()
+        with workspace.Workspace() as ws:
+            res = planner.solve(domain_text, problem_text, Path(ws.mkdir("optimum-")) / "plan.pddl",
+                                timeout=timeout, optimal=True, log_path=log_path, ws=ws)
+        entries[problem_file] = {
+            "key": key,
+            # Only a finished optimal search proves the cost optimal
+            "cost": res["cost"] if res["outcome"] == "plan" else None,
+            "outcome": res["outcome"],
+            "timeout": timeout,
+            "duration_sec": round(time.time() - t0, 3),
+            "computed_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        try:
+            _store(path, entries)
+        except OSError as e:
+            print(f"Warning: could not store {path}: {e}", file=sys.stderr)
+        return entries[problem_file]["cost"]
+
+
+def deviation(cost, reference_cost):
+    """How much more a plan costs than the reference optimum (negative: cheaper), None if either is unknown."""
+    if cost is None or reference_cost is None:
+        return None
+    return cost - reference_cost
+
+
+@contextmanager
+def _locked(lock_path):
+    try:
+        f = open(lock_path, "a")
+    except OSError:
+        # Read-only reference folder: plan without the lock (and without storing the result)
+        yield
+        return
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _load(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _store(path, entries):
+    # write then rename, so a reader never sees a half-written file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
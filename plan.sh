@@ -1,5 +1,7 @@
 #!/bin/bash
 
 # Set the limits so not too much time is spent on finding solutions
-echo ./fast-downward.sif --alias lama-first --overall-memory-limit 8G --overall-time-limit $4 --plan-file $1 $2 $3
-./fast-downward.sif --alias lama-first --overall-memory-limit 8G --overall-time-limit $4 --plan-file $1 $2 $3
+# (grade.py sets PLANNER_MEMORY_LIMIT once scheduler.py has let the run in)
+MEMORY_LIMIT=${PLANNER_MEMORY_LIMIT:-8G}
+echo ./fast-downward.sif --alias lama-first --overall-memory-limit $MEMORY_LIMIT --overall-time-limit $4 --plan-file $1 $2 $3
+./fast-downward.sif --alias lama-first --overall-memory-limit $MEMORY_LIMIT --overall-time-limit $4 --plan-file $1 $2 $3
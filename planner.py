@@ -0,0 +1,352 @@
+"""
+Fast Downward driver with a cache of translated tasks.
+
+plan.sh/planoptimal.sh run the whole Fast Downward pipeline on every call, so a task that
+was already planned on (a resubmission, or the same reference problem under the same
+merged domain) is translated to SAS+ all over again. solve() instead runs the translator
+on its own and keeps its output.sas in SAS_CACHE, keyed on a hash of the normalized domain
+and problem text; on a hit only the search component runs, on the cached file.
+
+The planner command is taken from $FAST_DOWNWARD (default ./fast-downward.sif), so a local
+stand-in script that accepts the same driver options can be used for testing. It runs under
+supervise.py: output is kept size-capped, and the search is stopped as soon as Fast Downward
+reports the task unsolvable.
+
+Usage:
+    res = planner.solve(domain_text, problem_text, "plan.pddl", timeout=30)
+    res["ok"], res["plan"], res["outcome"], res["resources"], res["sas_cached"]
+"""
+import hashlib
+import json
+import os
+import re
+import shlex
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import metrics
+import resources
+import scheduler
+import supervise
+import workspace
+
+FAST_DOWNWARD = shlex.split(os.environ.get("FAST_DOWNWARD", "./fast-downward.sif"))
+MEMORY_LIMIT = os.environ.get("PLANNER_MEMORY_LIMIT", "8G")
+
+# Same configurations as plan.sh and planoptimal.sh
+ALIASES = {
+    False: "lama-first",
+    True: "seq-opt-merge-and-shrink",
+}
+
+# The search of Fast Downward's seq-opt-merge-and-shrink alias (driver/aliases.py), spelled out
+# so that a cost bound can be added to it; planoptimal.sh does the same
+OPTIMAL_SEARCH = ("merge_and_shrink(shrink_strategy=shrink_bisimulation(greedy=false),"
+                  "merge_strategy=merge_sccs(order_of_sccs=topological,merge_selector="
+                  "score_based_filtering(scoring_functions=[goal_relevance,dfp,total_order])),"
+                  "label_reduction=exact(before_shrinking=true,before_merging=false),"
+                  "max_states=50k,threshold_before_merge=1)")
+
+# Line Fast Downward prints once it has proven there is no plan
+UNSOLVABLE = "Search stopped without finding a solution"
+
+# Fast Downward driver exit codes (driver/returncodes.py) by what they mean for a grading run
+OUTCOMES = {
+    0: "plan",
+    1: "plan_at_limit", 2: "plan_at_limit", 3: "plan_at_limit",  # plan found, then out of memory/time
+    10: "unsolvable", 11: "unsolvable",  # proven unsolvable by the translator/search
+    12: "exhausted",  # search space exhausted without a plan
+    20: "out_of_memory", 22: "out_of_memory", 24: "out_of_memory",  # 24: out of memory and time
+    21: "out_of_time", 23: "out_of_time",
+}
+
+
+def outcome(returncode, *, timed_out=False, unsolvable=False):
+    """
+    What a planner run came to: plan, plan_at_limit, unsolvable, exhausted, out_of_memory,
+    out_of_time or error (critical/input errors 30-37, crashes, unknown codes).
+    """
+    if returncode in OUTCOMES:
+        return OUTCOMES[returncode]
+    if unsolvable:
+        # Stopped as soon as the search gave up, before the driver set its exit code
+        return "exhausted"
+    if timed_out:
+        return "out_of_time"
+    return "error"
+
+
+SAS_CACHE_DIR = os.environ.get("SAS_CACHE_DIR", ".cache/sas")
+SAS_CACHE_MAX_BYTES = int(os.environ.get("SAS_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+SAS_CACHE_MAX_ENTRIES = int(os.environ.get("SAS_CACHE_MAX_ENTRIES", 512))
+
+
+def config():
+    """Everything about the planner setup that can change a planning result."""
+    return {"command": FAST_DOWNWARD, "memory_limit": MEMORY_LIMIT, "aliases": ALIASES[False] + "/" + ALIASES[True]}
+
+
+# -----------------------
+# Cache of translator output
+# -----------------------
+_TOKENS = re.compile(r";[^\n]*|\(|\)|[^\s();]+")
+
+
+def normalize_pddl(text):
+    """PDDL text with comments dropped, whitespace collapsed and case folded (as the translator reads it)."""
+    return " ".join(t for t in _TOKENS.findall(text.lower()) if not t.startswith(";"))
+
+
+class TranslationCache:
+    """
+    Directory of output.sas files named by task hash. Bounded by entry count and total size;
+    the least recently used files (by mtime, bumped on every hit) are evicted first. Files
+    are written atomically, so several grading processes can share one directory.
+    """
+
+    def __init__(self, path, *, max_bytes=SAS_CACHE_MAX_BYTES, max_entries=SAS_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(domain_text, problem_text):
+        h = hashlib.sha256()
+        h.update(normalize_pddl(domain_text).encode("utf-8"))
+        h.update(b"\0")
+        h.update(normalize_pddl(problem_text).encode("utf-8"))
+        return h.hexdigest()
+
+    def fetch(self, key, dest):
+        """Copy the cached task for key to dest. Returns False on a miss."""
+        src = os.path.join(self.path, f"{key}.sas")
+        try:
+            shutil.copyfile(src, dest)
+            os.utime(src)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, sas_path):
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(sas_path, tmp)
+            os.replace(tmp, os.path.join(self.path, f"{key}.sas"))
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._evict()
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def snapshot(self):
+        entries = self._entries()
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+            }
+
+    def _entries(self):
+        entries = []
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if not name.endswith(".sas"):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_entries or total > self.max_bytes):
+            _, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+SAS_CACHE = TranslationCache(SAS_CACHE_DIR)
+
+
+# -----------------------
+# Planning
+# -----------------------
+def solve(domain_text, problem_text, plan_path, *, timeout=30, optimal=False, max_cost=None, use_cache=True,
+          log_path=None, ws=None, cancel=None):
+    """
+    Plan on the given domain/problem text and write the plan to plan_path. Input and
+    intermediate files go into the workspace.Workspace ws (a fresh one if None), where text
+    written there before by another stage is reused.
+
+    timeout is the overall limit in seconds, translation included. The full planner output is
+    appended to log_path if given; stdout/stderr in the result only keep its tail. Returns a
+    dict with keys: ok, plan, returncode, outcome (see outcome()), stdout, stderr, unsolvable,
+    timed_out, sas_cached, cost (plan_cost() of the plan, None without one) and resources
+    (translator and search runs combined; see resources.py).
+
+    With optimal and max_cost, the optimal search only looks for plans costing at most
+    max_cost: it either finds an optimal plan within that cost or stops as soon as it has
+    proven there is none (outcome "exhausted"). The planner is stopped when the threading.Event
+    cancel is set.
+    """
+    if not domain_text or not domain_text.strip():
+        raise ValueError("domain_text is empty")
+    if not problem_text or not problem_text.strip():
+        raise ValueError("problem_text is empty")
+
+    out_plan = Path(plan_path)
+    with workspace.scope(ws) as ws:
+        sas = Path(ws.mkdir("fd-")) / "output.sas"
+        t0 = time.time()
+        tr = translate(domain_text, problem_text, sas, timeout=timeout, use_cache=use_cache, log_path=log_path, ws=ws,
+                       cancel=cancel)
+        if not tr["ok"]:
+            # A task the translator rejects fails the same way under the full pipeline
+            return _result(out_plan, tr["proc"], tr["stdout"], tr["stderr"], False, tr["resources"])
+
+        remaining = max(1, int(timeout - (time.time() - t0)))
+        proc = search(sas, out_plan, solve_config(optimal, max_cost), timeout=remaining, log_path=log_path,
+                      cancel=cancel)
+        return _result(out_plan, proc, supervise.cap_text(tr["stdout"] + proc["stdout"]),
+                       supervise.cap_text(tr["stderr"] + proc["stderr"]), tr["cached"],
+                       resources.combine(tr["resources"], proc["resources"]))
+
+
+def solve_config(optimal=False, max_cost=None):
+    """The search() configuration of plan.sh, or of planoptimal.sh with an optional cost bound."""
+    if optimal and max_cost is not None:
+        # Fast Downward's bound is exclusive
+        return [], ["--search", f"astar({OPTIMAL_SEARCH},bound={int(max_cost) + 1})"]
+    return ["--alias", ALIASES[optimal]], []
+
+
+_COST = re.compile(r"^;\s*cost\s*=\s*(\d+)", re.MULTILINE)
+
+
+def plan_cost(plan_text):
+    """The cost Fast Downward writes at the end of a plan file ("; cost = 12 (unit cost)"), else its length."""
+    m = _COST.search(plan_text or "")
+    if m is not None:
+        return int(m.group(1))
+    steps = [line for line in (plan_text or "").splitlines() if line.strip() and not line.strip().startswith(";")]
+    return len(steps) if steps else None
+
+
+def translate(domain_text, problem_text, sas, *, timeout, use_cache=True, log_path=None, ws=None, cancel=None):
+    """
+    Write the translated task to the path sas, from SAS_CACHE if it is there. Returns a dict
+    with keys: ok, cached, proc (the translator run, None on a cache hit), stdout, stderr,
+    resources. The translator is stopped when the threading.Event cancel is set.
+    """
+    key = TranslationCache.make_key(domain_text, problem_text)
+    if use_cache and SAS_CACHE.fetch(key, sas):
+        return {"ok": True, "cached": True, "proc": None, "stderr": "", "resources": None,
+                "stdout": f"Reusing translated task {key[:12]} from {SAS_CACHE.path}\n"}
+
+    with workspace.scope(ws) as ws:
+        dpath = ws.file(domain_text, ".pddl")
+        ppath = ws.file(problem_text, ".pddl")
+        proc = _run(["--translate", "--overall-time-limit", f"{timeout}s", "--sas-file", str(sas),
+                     dpath, ppath], timeout, log_path, cancel=cancel)
+    ok = proc["returncode"] == 0 and os.path.exists(sas)
+    if ok and use_cache:
+        SAS_CACHE.store(key, sas)
+    return {"ok": ok, "cached": False, "proc": proc, "stdout": proc["stdout"], "stderr": proc["stderr"],
+            "resources": proc["resources"]}
+
+
+def search(sas, plan_path, config, *, timeout, memory_limit=None, log_path=None, cancel=None):
+    """
+    Run one search configuration, a pair of (driver options, e.g. ["--alias", "lama-first"];
+    search options, e.g. ["--search", "astar(blind())"]), on a translated task. Stopped as soon
+    as Fast Downward reports the task unsolvable, or when cancel is set. Returns the
+    supervise.run() result, plus the memory_limit the run got.
+
+    memory_limit (default MEMORY_LIMIT) is the most the run may use; scheduler.py decides how
+    much of it the run actually gets, from past runs of the same task and configuration.
+    """
+    driver_args, search_args = config
+    h = hashlib.sha256(json.dumps(config).encode("utf-8"))
+    with open(sas, "rb") as f:
+        h.update(f.read())
+    return _run(["--overall-time-limit", f"{timeout}s", "--plan-file", str(plan_path)] + list(driver_args)
+                + [str(sas)] + list(search_args), timeout, log_path, stop_on=[UNSOLVABLE], cancel=cancel,
+                key=f"search:{h.hexdigest()}", memory_limit=memory_limit)
+
+
+def _run(args, timeout, log_path=None, stop_on=(), cancel=None, key=None, memory_limit=None):
+    if key is None:
+        # Not pooled (the translator): starts right away, with the driver's own memory limit
+        proc = _supervise(FAST_DOWNWARD + args, timeout, log_path, stop_on, cancel)
+        proc["memory_limit"] = None
+        return proc
+    # Queue for memory and a CPU shared with every other planner run on the machine
+    with scheduler.SCHEDULER.reserve(key, memory_limit or MEMORY_LIMIT, cancel=cancel) as slot:
+        if slot is None:
+            return {"returncode": None, "stdout": "", "stderr": "", "seen": [], "stopped_on": None,
+                    "timed_out": False, "cancelled": True, "duration_sec": 0.0, "log_path": log_path,
+                    "resources": None, "memory_limit": None}
+        proc = _supervise(FAST_DOWNWARD + ["--overall-memory-limit", slot.memory_limit] + args,
+                          timeout, log_path, stop_on, cancel)
+        # A run cut short peaked lower than a full run would
+        cut_short = (proc["cancelled"] or proc["timed_out"] or proc["stopped_on"] is not None
+                     or outcome(proc["returncode"]) in ("out_of_time", "out_of_memory"))
+        slot.record(proc["resources"], complete=not cut_short)
+    proc["memory_limit"] = slot.memory_limit
+    return proc
+
+
+def _supervise(cmd, timeout, log_path, stop_on, cancel):
+    if log_path:
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(" ".join(cmd) + "\n")
+    with metrics.INFLIGHT.track(kind="planner"):
+        proc = supervise.run(cmd, timeout=timeout + 5, stop_on=stop_on, log_path=log_path, cancel=cancel)
+    proc["stdout"] = " ".join(cmd) + "\n" + proc["stdout"]
+    return proc
+
+
+def _result(out_plan, proc, stdout, stderr, cached, usage):
+    plan_text = out_plan.read_text(encoding="utf-8") if out_plan.exists() else ""
+    unsolvable = UNSOLVABLE in proc["seen"]
+    return {
+        "ok": out_plan.exists() and bool(plan_text.strip()),
+        "plan": plan_text,
+        "returncode": proc["returncode"],
+        "outcome": outcome(proc["returncode"], timed_out=proc["timed_out"], unsolvable=unsolvable),
+        "stdout": stdout,
+        "stderr": stderr,
+        "unsolvable": unsolvable,
+        "timed_out": proc["timed_out"],
+        "sas_cached": cached,
+        "memory_limit": proc.get("memory_limit"),
+        "cost": plan_cost(plan_text) if plan_text.strip() else None,
+        "resources": usage,
+    }
@@ -1,5 +1,15 @@
 #!/bin/bash
 
 # Set the limits so not too much time is spent on finding solutions
-echo ./fast-downward.sif --alias seq-opt-merge-and-shrink --overall-memory-limit 8G --overall-time-limit $4 --plan-file $1 $2 $3
-./fast-downward.sif --alias seq-opt-merge-and-shrink --overall-memory-limit 8G --overall-time-limit $4 --plan-file $1 $2 $3
+# (grade.py sets PLANNER_MEMORY_LIMIT once scheduler.py has let the run in)
+MEMORY_LIMIT=${PLANNER_MEMORY_LIMIT:-8G}
+if [ -n "$5" ]; then
+# Only look for plans costing at most $5: the search of the seq-opt-merge-and-shrink alias,
+# spelled out as in planner.py, with Fast Downward's (exclusive) cost bound
+SEARCH="astar(merge_and_shrink(shrink_strategy=shrink_bisimulation(greedy=false),merge_strategy=merge_sccs(order_of_sccs=topological,merge_selector=score_based_filtering(scoring_functions=[goal_relevance,dfp,total_order])),label_reduction=exact(before_shrinking=true,before_merging=false),max_states=50k,threshold_before_merge=1),bound=$(($5 + 1)))"
+echo ./fast-downward.sif --overall-memory-limit $MEMORY_LIMIT --overall-time-limit $4 --plan-file $1 $2 $3 --search "$SEARCH"
+./fast-downward.sif --overall-memory-limit $MEMORY_LIMIT --overall-time-limit $4 --plan-file $1 $2 $3 --search "$SEARCH"
+exit
+fi
+echo ./fast-downward.sif --alias seq-opt-merge-and-shrink --overall-memory-limit $MEMORY_LIMIT --overall-time-limit $4 --plan-file $1 $2 $3
+./fast-downward.sif --alias seq-opt-merge-and-shrink --overall-memory-limit $MEMORY_LIMIT --overall-time-limit $4 --plan-file $1 $2 $3
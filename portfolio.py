@@ -0,0 +1,197 @@
+"""
+Race several Fast Downward search configurations on one task: the first decisive answer wins.
+
+lama-first (what plan.sh runs) finds plans fast but is poor at proving there are none: on a
+merged alignment task without a mis-alignment plan it tends to run into the time limit,
+which the grader can only report as "may indicate everything is fine". A blind or h^max A*
+search exhausts such a search space much sooner. solve() translates the task once (through
+planner.SAS_CACHE) and starts the configurations side by side, at most CPUS at a time. The
+first one to find a plan or to exhaust the search space wins and the others are killed,
+together with their process groups (see supervise.py).
+
+The runs sharing the CPUs share the memory limit too. A configuration that has to wait for
+a CPU gets an equal share of the time left, so with one CPU the configurations run one after
+the other in time slices, the way Fast Downward's own portfolios do.
+
+Usage:
+    res = portfolio.solve(domain_text, problem_text, "plan.pddl", ["lama-first", "hmax", "blind"], timeout=60)
+    res["config"], res["outcome"], res["runs"]["hmax"]["outcome"]
+"""
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import metrics
+import planner
+import resources
+import scheduler
+import supervise
+import workspace
+
+# name: (driver options, search options), see planner.search()
+CONFIGS = {
+    "lama-first": (["--alias", "lama-first"], []),
+    "seq-opt-merge-and-shrink": (["--alias", "seq-opt-merge-and-shrink"], []),
+    "blind": ([], ["--search", "astar(blind())"]),
+    "hmax": ([], ["--search", "astar(hmax())"]),
+    "lmcut": ([], ["--search", "astar(lmcut())"]),
+}
+
+# Planner runs one race keeps going at once
+CPUS = int(os.environ.get("PORTFOLIO_CPUS", os.cpu_count() or 1))
+
+# Outcomes (planner.outcome) that settle the question, so the other runs can stop
+DECISIVE = {"plan", "plan_at_limit", "unsolvable", "exhausted"}
+
+
+def parse_configs(text):
+    """Configuration names from a comma-separated list such as "lama-first,hmax" ([] for "")."""
+    names = [name.strip() for name in (text or "").split(",") if name.strip()]
+    unknown = [name for name in names if name not in CONFIGS]
+    if unknown:
+        raise ValueError(f"Unknown planner configuration(s) {unknown}, expected some of {sorted(CONFIGS)}")
+    return names
+
+
+def solve(domain_text, problem_text, plan_path, configs, *, timeout=30, cpus=None, use_cache=True, log_path=None,
+          ws=None, cancel=None):
+    """
+    planner.solve() with the configurations raced against each other. Returns a dict with
+    planner.solve()'s keys, for the run that won (or, if none did, the one that ran out of
+    time or memory), plus config (the winner's name, None if none won) and runs ({name:
+    {outcome, duration_sec, resources}}; outcome "cancelled" for the runs killed because
+    another one won, "skipped" for those that never started). resources covers all runs.
+    Every run is stopped when the threading.Event cancel is set.
+    """
+    configs = list(configs)
+    parse_configs(",".join(configs))
+    out_plan = Path(plan_path)
+    t0 = time.time()
+    with workspace.scope(ws) as ws:
+        sas = Path(ws.mkdir("fd-")) / "output.sas"
+        tr = planner.translate(domain_text, problem_text, sas, timeout=timeout, use_cache=use_cache,
+                               log_path=log_path, ws=ws, cancel=cancel)
+        if not tr["ok"]:
+            res = planner._result(out_plan, tr["proc"], tr["stdout"], tr["stderr"], False, tr["resources"])
+            res.update(config=None, runs={})
+            return res
+
+        run_dir = Path(ws.mkdir("portfolio-"))
+        slots = max(1, min(cpus or CPUS, len(configs)))
+        memory_limit = memory_share(planner.MEMORY_LIMIT, slots)
+
+        def run(name, budget, cancel):
+            plan = run_dir / f"{name}.plan"
+            proc = planner.search(sas, plan, CONFIGS[name], timeout=budget, memory_limit=memory_limit,
+                                  log_path=log_path, cancel=cancel)
+            return proc, plan, run_outcome(proc)
+
+        runs, winner = race(configs, run, slots=slots, deadline=t0 + timeout, wins=lambda r: r[2] in DECISIVE,
+                            cancel=cancel)
+
+        chosen = winner or _fallback(runs)
+        if chosen is not None:
+            proc, plan, _ = runs[chosen]
+            if plan.exists():
+                shutil.copyfile(plan, out_plan)
+        else:
+            proc = {"returncode": None, "seen": [], "timed_out": True, "stdout": "", "stderr": ""}
+        metrics.PORTFOLIO_WINS.inc(config=winner or "none")
+
+        summary = "".join(f"Portfolio: {name} {r[2] if r else 'skipped'}"
+                          f"{' (won)' if name == winner else ''}\n" for name, r in runs.items())
+        usage = resources.concurrent([r[0]["resources"] for r in runs.values() if r], time.time() - t0)
+        res = planner._result(out_plan, proc, supervise.cap_text(tr["stdout"] + summary + proc["stdout"]),
+                              supervise.cap_text(tr["stderr"] + proc["stderr"]), tr["cached"],
+                              resources.combine(tr["resources"], usage))
+        res["config"] = winner
+        res["runs"] = {
+            name: {"outcome": r[2], "duration_sec": round(r[0]["duration_sec"], 3), "resources": r[0]["resources"]}
+            if r else {"outcome": "skipped", "duration_sec": 0.0, "resources": None}
+            for name, r in runs.items()
+        }
+        return res
+
+
+def run_outcome(proc):
+    """planner.outcome() of a planner.search() run, or "cancelled" if race() stopped it."""
+    if proc["cancelled"]:
+        return "cancelled"
+    return planner.outcome(proc["returncode"], timed_out=proc["timed_out"], unsolvable=planner.UNSOLVABLE in proc["seen"])
+
+
+def race(items, run, *, slots, deadline, wins, cancel=None):
+    """
+    Call run(item, budget_sec, cancel) for each item, on up to slots threads, until deadline.
+    An item that has to wait for a thread splits the time left with the ones still waiting.
+    The first result for which wins(result) is true sets the threading.Event cancel, which
+    run is expected to pass on to supervise.run(); items not started by then are skipped.
+    The caller's own cancel event, if given, stops the race the same way.
+    Returns ({item: result, or None if skipped}, the winning item or None).
+    """
+    items = list(items)
+    won = threading.Event()
+    cancel = won if cancel is None else _Either(won, cancel)
+    lock = threading.Lock()
+    state = {"waiting": len(items), "winner": None}
+
+    def one(item):
+        with lock:
+            waiting = state["waiting"]
+            state["waiting"] -= 1
+        left = deadline - time.time()
+        if cancel.is_set() or left <= 0:
+            return None
+        # Started late because it waited for a thread: split what is left with the ones still waiting
+        budget = left if waiting <= slots else left * slots / waiting
+        result = run(item, max(1, int(budget)), cancel)
+        with lock:
+            if wins(result) and state["winner"] is None:
+                state["winner"] = item
+                won.set()
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, slots)) as ex:
+        results = dict(zip(items, ex.map(one, items)))
+    return results, state["winner"]
+
+
+class _Either:
+    """Set as soon as either of two threading.Events is (is_set() and wait(), as supervise.py and scheduler.py use them)."""
+
+    def __init__(self, first, second):
+        self._events = (first, second)
+
+    def is_set(self):
+        return any(e.is_set() for e in self._events)
+
+    def wait(self, timeout=None):
+        # No Event can wait on another, so poll both
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.is_set():
+            left = supervise.CANCEL_POLL_SEC if deadline is None else min(supervise.CANCEL_POLL_SEC,
+                                                                         deadline - time.time())
+            if left <= 0:
+                break
+            self._events[0].wait(left)
+        return self.is_set()
+
+
+def _fallback(runs):
+    """The run to report when none was decisive: one that ran out of time, else of memory, else the first."""
+    for wanted in ("out_of_time", "out_of_memory", None):
+        for name, r in runs.items():
+            if r is not None and (wanted is None or r[2] == wanted):
+                return name
+    return None
+
+
+def memory_share(limit, n):
+    """A memory limit such as "8G" divided by n, in Fast Downward's notation ("2730M")."""
+    mb = scheduler.to_mb(limit)
+    if mb is None or n <= 1:
+        return limit
+    return f"{max(1, int(mb // n))}M"
@@ -0,0 +1,131 @@
+"""
+Pre-flight check of a submission against the reference, before any planner or VAL runs.
+
+merge.py can only merge a submission that declares the same domain and problem names,
+constants, types and actions as the reference, with each action taking the same parameters
+(the merged actions keep the reference's preconditions, which refer to the parameters by
+name). When they differ, merge used to fail only after plan generation and both VAL runs
+had been paid for. check() parses the submission with tarski in this process and compares
+its signature with the reference's, which is computed once per reference text and cached
+(or taken from the reference.py bundle), so such a submission is turned away in
+milliseconds, with a structured list of what differs.
+
+Predicates are left out of the comparison: a submission models its own fluents, and merge
+renames the two sets apart. tarski's parse already rejects a predicate used with the wrong
+number of arguments. Constants whose types differ, and types with a different parent, do
+not stop a merge and are only reported as warnings.
+
+Usage:
+    res = preflight.check(domain_text, problem_text, reference_signature)
+    if not res["ok"]:
+        res["errors"]   # [{"check": "actions", "message": ..., "missing": [...], "extra": [...]}, ...]
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from tarski.syntax.builtins import is_builtin_predicate
+
+import merge
+
+
+def signature(problem):
+    """The parts of a parsed tarski problem that merge needs to match, as plain data."""
+    lang = problem.language
+    return {
+        "domain_name": problem.domain_name,
+        "problem_name": problem.name,
+        "constants": {c.name: c.sort.name for c in lang.constants()},
+        "sorts": {s.name: (lang.immediate_parent[s].name if lang.immediate_parent.get(s) else None)
+                  for s in lang.sorts},
+        "predicates": {str(p.name): p.arity for p in lang.predicates if not is_builtin_predicate(p)},
+        "actions": {name: [[v.symbol, v.sort.name] for v in action.parameters]
+                    for name, action in problem.actions.items()},
+    }
+
+
+class SignatureCache:
+    """Small LRU of reference signatures by content hash, for references without a loaded bundle."""
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._signatures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, domain_text, problem_text):
+        key = hashlib.sha256(f"{domain_text}\0{problem_text}".encode("utf-8")).hexdigest()
+        with self._lock:
+            sig = self._signatures.get(key)
+            if sig is not None:
+                self._signatures.move_to_end(key)
+                return sig
+        sig = signature(merge.parse_pddl_text(domain_text, problem_text))
+        with self._lock:
+            self._signatures[key] = sig
+            while len(self._signatures) > self.maxsize:
+                self._signatures.popitem(last=False)
+        return sig
+
+
+SIGNATURE_CACHE = SignatureCache()
+
+
+def check(domain_text, problem_text, reference):
+    """
+    Parse the submitted domain/problem and diff its signature against the reference
+    signature. Returns a dict with keys: ok, errors, warnings, duration_sec. ok is False if
+    the submission does not parse or merge could not merge it.
+    """
+    t0 = time.time()
+    errors, warnings = [], []
+    try:
+        submitted = signature(merge.parse_pddl_text(domain_text, problem_text))
+    except Exception as e:
+        errors.append({"check": "parse", "message": f"Could not parse the submitted domain/problem: {e}"})
+    else:
+        errors, warnings = diff(reference, submitted)
+    return {"ok": not errors, "errors": errors, "warnings": warnings, "duration_sec": round(time.time() - t0, 4)}
+
+
+def diff(reference, submitted):
+    """(errors, warnings): how the submitted signature differs from the reference one."""
+    errors, warnings = [], []
+    for key, what in (("domain_name", "domain"), ("problem_name", "problem")):
+        if reference[key] != submitted[key]:
+            errors.append({"check": key, "message": f"The {what} is named {submitted[key]!r}, expected {reference[key]!r}",
+                           "expected": reference[key], "found": submitted[key]})
+
+    for key, what in (("constants", "objects/constants"), ("sorts", "types"), ("actions", "actions")):
+        missing = sorted(set(reference[key]) - set(submitted[key]))
+        extra = sorted(set(submitted[key]) - set(reference[key]))
+        if missing or extra:
+            message = f"The {what} differ from the reference"
+            if missing:
+                message += f"; missing: {', '.join(missing)}"
+            if extra:
+                message += f"; not in the reference: {', '.join(extra)}"
+            errors.append({"check": key, "message": message, "missing": missing, "extra": extra})
+
+    for name in sorted(set(reference["actions"]) & set(submitted["actions"])):
+        expected, found = reference["actions"][name], submitted["actions"][name]
+        if expected != found:
+            errors.append({"check": "parameters", "action": name,
+                           "message": f"Action {name} takes {_params(found)}, expected {_params(expected)}",
+                           "expected": expected, "found": found})
+
+    for name in sorted(set(reference["constants"]) & set(submitted["constants"])):
+        if reference["constants"][name] != submitted["constants"][name]:
+            warnings.append({"check": "constant_types", "constant": name,
+                             "message": f"{name} is a {submitted['constants'][name]}, "
+                                        f"a {reference['constants'][name]} in the reference"})
+    for name in sorted(set(reference["sorts"]) & set(submitted["sorts"])):
+        if reference["sorts"][name] != submitted["sorts"][name]:
+            warnings.append({"check": "type_parents", "type": name,
+                             "message": f"Type {name} is a subtype of {submitted['sorts'][name]}, "
+                                        f"of {reference['sorts'][name]} in the reference"})
+    return errors, warnings
+
+
+def _params(params):
+    return "(" + " ".join(f"{var} - {sort}" for var, sort in params) + ")" if params else "no parameters"
@@ -0,0 +1,305 @@
+"""
+Reference bundles: the files of a reference folder, parsed, checked and kept in memory.
+
+A reference folder holds domain.pddl and, for each problem N, p0N.pddl and its reference plan
+plan.p0N.pddl. Loading a ReferenceBundle reads them all once and checks that every problem
+parses and that its reference plan solves it (validator.py, or VAL for tasks outside its
+subset). It keeps the texts, the domain's fluent names, each problem's validator.Task (so
+student plans are validated on the reference without parsing it again) and its signature for
+preflight.py, and warms the merge_pool workers, whose merge.REFERENCE_CACHE then already holds
+the parsed references.
+A problem that fails a check is left out and its reason is listed under the bundle's errors,
+so a broken reference shows up at startup instead of in the first student's result.
+
+REFERENCES.start() loads bundles in a background thread when the server starts and then
+polls their files every RELOAD_POLL_SEC seconds ($REFERENCE_RELOAD_SEC; 0 turns polling off).
+A file that is added, removed or edited makes it load the folder again, next to the bundle in
+use, which is only replaced once the new one is loaded. ready() is true once every bundle is
+loaded without errors.
+
+Usage:
+    REFERENCES.start(["data/reference"])
+    bundle = REFERENCES.get("data/reference")        # None until loaded
+    if bundle is not None and "1" in bundle.tasks:
+        validator.validate_task(bundle.tasks["1"], plan_text)
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+
+import merge
+import merge_pool
+import preflight
+import resources
+import supervise
+import validator
+
+DOMAIN_FILE = "domain.pddl"
+PROBLEM_FILE = re.compile(r"^p0(\d+)\.pddl$")
+PLAN_FILE = re.compile(r"^plan\.p0(\d+)\.pddl$")
+
+RELOAD_POLL_SEC = float(os.environ.get("REFERENCE_RELOAD_SEC", "5"))
+VALIDATE_TIMEOUT = 60
+WARM_TIMEOUT = 120
+
+
+class BrokenReference(Exception):
+    pass
+
+
+def _is_reference_file(name):
+    return name == DOMAIN_FILE or bool(PROBLEM_FILE.match(name) or PLAN_FILE.match(name))
+
+
+class ReferenceBundle:
+    def __init__(self, folder):
+        self.folder = os.path.abspath(folder)
+        self.files = {}         # name: (mtime_ns, size, sha256) when read
+        self.texts = {}         # name: text
+        self.problem_ids = []   # ids of all problems found, e.g. ["1", "2", "3"]
+        self.problems = []      # ids of the problems that passed the checks
+        self.tasks = {}         # problem id: validator.Task (not for tasks outside its subset)
+        self.signatures = {}    # problem id: preflight.signature of the reference
+        self.fluent_names = []
+        self.errors = {}        # problem id, or "domain"/"merge_workers": reason
+        self.loaded_at = None
+        self.load_sec = None
+        self.memory_mb = None   # growth of the process's RSS while loading (resources.current_rss_mb)
+
+    @classmethod
+    def load(cls, folder, *, warm_workers=True):
+        """A bundle of folder's current files; never raises, problems found end up in errors."""
+        bundle = cls(folder)
+        t0, rss0 = time.time(), resources.current_rss_mb()
+        try:
+            bundle._load(warm_workers)
+        except Exception as e:
+            bundle.errors["bundle"] = f"{type(e).__name__}: {e}"
+        bundle.loaded_at = time.time()
+        bundle.load_sec = round(bundle.loaded_at - t0, 3)
+        # Other threads allocate meanwhile too, so this is an estimate; never less than the texts
+        rss1 = resources.current_rss_mb()
+        grown = rss1 - rss0 if rss0 is not None and rss1 is not None else 0
+        bundle.memory_mb = round(max(grown, sum(len(t) for t in bundle.texts.values()) / 2**20), 2)
+        return bundle
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def problem_path(self, problem_id):
+        return self.path(f"p0{problem_id}.pddl")
+
+    def changed(self):
+        """
+        Whether a reference file was added, removed or edited since the bundle was loaded.
+        Files whose stat changed are re-hashed, so touching one does not count.
+        """
+        try:
+            names = {name for name in os.listdir(self.folder) if _is_reference_file(name)}
+        except FileNotFoundError:
+            return bool(self.files)
+        if names != set(self.files):
+            return True
+        for name, (mtime_ns, size, digest) in list(self.files.items()):
+            try:
+                st = os.stat(self.path(name))
+                if (st.st_mtime_ns, st.st_size) == (mtime_ns, size):
+                    continue
+                with open(self.path(name), "rb") as f:
+                    if hashlib.sha256(f.read()).hexdigest() != digest:
+                        return True
+            except FileNotFoundError:
+                return True
+            self.files[name] = (st.st_mtime_ns, st.st_size, digest)
+        return False
+
+    def snapshot(self):
+        return {
+            "status": "error" if self.errors else "ready",
+            "problems": list(self.problems),
+            "memory_mb": self.memory_mb,
+            "errors": dict(self.errors),
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded_at)),
+            "load_sec": self.load_sec,
+        }
+
+    def _load(self, warm_workers):
+        try:
+            names = sorted(name for name in os.listdir(self.folder) if _is_reference_file(name))
+        except FileNotFoundError:
+            self.errors["domain"] = f"Reference folder not found: {self.folder}"
+            return
+        for name in names:
+            self._read(name)
+        if DOMAIN_FILE not in self.texts:
+            self.errors["domain"] = f"Reference domain not found: {self.path(DOMAIN_FILE)}"
+            return
+        try:
+            self.fluent_names = merge.return_fluent_names(self.texts[DOMAIN_FILE])
+        except Exception as e:
+            self.errors["domain"] = f"could not parse {DOMAIN_FILE}: {e}"
+            return
+
+        for name in names:
+            m = PROBLEM_FILE.match(name)
+            if m is None:
+                continue
+            problem_id = str(int(m.group(1)))
+            self.problem_ids.append(problem_id)
+            try:
+                self._check(problem_id, name, f"plan.{name}")
+            except BrokenReference as e:
+                self.errors[problem_id] = str(e)
+            else:
+                self.problems.append(problem_id)
+
+        if warm_workers and self.problems:
+            self._warm_workers()
+
+    def _read(self, name):
+        path = self.path(name)
+        st = os.stat(path)
+        with open(path, "rb") as f:
+            data = f.read()
+        self.files[name] = (st.st_mtime_ns, st.st_size, hashlib.sha256(data).hexdigest())
+        self.texts[name] = data.decode("utf-8")
+
+    def _check(self, problem_id, problem_name, plan_name):
+        if plan_name not in self.texts:
+            raise BrokenReference(f"Reference plan not found: {self.path(plan_name)}")
+        domain_text, problem_text = self.texts[DOMAIN_FILE], self.texts[problem_name]
+        try:
+            task = validator.load_task(domain_text, problem_text)
+        except validator.UnsupportedTask:
+            task = None
+
+        if task is None:
+            # Outside validator.py's subset, or not parseable at all: tell which, then ask VAL
+            try:
+                parsed = merge.parse_pddl_text(domain_text, problem_text)
+            except Exception as e:
+                raise BrokenReference(f"could not parse {problem_name}: {e}") from e
+            self._check_with_val(problem_name, plan_name)
+            self.signatures[problem_id] = preflight.signature(parsed)
+            return
+
+        res = validator.validate_task(task, self.texts[plan_name])
+        if not res["valid"]:
+            where = f"step {res['failed_step']}: " if res["failed_step"] else ""
+            raise BrokenReference(f"{plan_name} does not solve {problem_name}: {where}{res['reason']}")
+        self.tasks[problem_id] = task
+        self.signatures[problem_id] = preflight.signature(task.problem)
+
+    def _check_with_val(self, problem_name, plan_name):
+        try:
+            proc = supervise.run(
+                ["./validate.sh", self.path(DOMAIN_FILE), self.path(problem_name), self.path(plan_name)],
+                timeout=VALIDATE_TIMEOUT, watch=["Plan valid"],
+            )
+        except OSError as e:
+            raise BrokenReference(f"could not run VAL on {plan_name}: {e}") from e
+        if "Plan valid" not in proc["seen"]:
+            tail = (proc["stdout"].strip().splitlines() or ["no output"])[-1]
+            raise BrokenReference(f"VAL rejects {plan_name} on {problem_name}: {tail}")
+
+    def _warm_workers(self):
+        pairs = {self.problem_path(problem_id): problem_id for problem_id in self.problems}
+        try:
+            failed = merge_pool.warm_references([(self.path(DOMAIN_FILE), path) for path in pairs],
+                                                timeout=WARM_TIMEOUT)
+        except (merge_pool.WorkerTimeout, merge_pool.WorkerCrashed) as e:
+            self.errors["merge_workers"] = str(e)
+            return
+        for path, reason in failed.items():
+            problem_id = pairs[path]
+            self.problems.remove(problem_id)
+            self.tasks.pop(problem_id, None)
+            self.signatures.pop(problem_id, None)
+            self.errors[problem_id] = f"merge could not load {os.path.basename(path)}: {reason}"
+
+
+class ReferenceRegistry:
+    """The loaded bundles by folder, and the thread that loads and reloads them. Thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bundles = {}
+        self._pending = set()
+        self._watched = set()
+        self._reloads = {}
+        self._wake = threading.Event()
+        self._thread = None
+
+    def get(self, folder):
+        """The loaded bundle of folder, or None."""
+        with self._lock:
+            return self._bundles.get(os.path.abspath(folder))
+
+    def load(self, folder, *, warm_workers=True):
+        """Load folder now, in the calling thread, and use the new bundle from then on."""
+        bundle = ReferenceBundle.load(folder, warm_workers=warm_workers)
+        with self._lock:
+            if bundle.folder in self._bundles:
+                self._reloads[bundle.folder] = self._reloads.get(bundle.folder, 0) + 1
+            self._bundles[bundle.folder] = bundle
+            self._pending.discard(bundle.folder)
+        return bundle
+
+    def evict(self, folder):
+        """Forget folder's bundle and stop watching it; returns the bundle (None if it was not loaded)."""
+        folder = os.path.abspath(folder)
+        with self._lock:
+            self._pending.discard(folder)
+            self._watched.discard(folder)
+            self._reloads.pop(folder, None)
+            return self._bundles.pop(folder, None)
+
+    def start(self, folders, *, poll_sec=None):
+        """Load folders in the background, then reload them whenever their files change."""
+        folders = {os.path.abspath(f) for f in folders}
+        with self._lock:
+            self._pending.update(f for f in folders if f not in self._bundles)
+            self._watched.update(folders)
+            if self._thread is None:
+                poll_sec = RELOAD_POLL_SEC if poll_sec is None else poll_sec
+                self._thread = threading.Thread(target=self._run, args=(poll_sec,), daemon=True,
+                                                name="reference-loader")
+                self._thread.start()
+        self._wake.set()
+
+    def status(self, folders=None):
+        """"loading", "ready" or "error" for the given folders (all started ones if None)."""
+        with self._lock:
+            folders = self._watched | set(self._bundles) if folders is None else {os.path.abspath(f) for f in folders}
+            if any(f in self._pending or f not in self._bundles for f in folders):
+                return "loading"
+            return "error" if any(self._bundles[f].errors for f in folders) else "ready"
+
+    def ready(self, folders=None):
+        return self.status(folders) == "ready"
+
+    def snapshot(self):
+        with self._lock:
+            snap = {f: {"status": "loading"} for f in self._pending}
+            for folder, bundle in self._bundles.items():
+                snap[folder] = dict(bundle.snapshot(), reloads=self._reloads.get(folder, 0))
+            return snap
+
+    def _run(self, poll_sec):
+        while True:
+            self._wake.clear()
+            with self._lock:
+                pending = sorted(self._pending)
+                watched = [b for f, b in self._bundles.items() if f in self._watched and f not in self._pending]
+            for folder in pending:
+                self.load(folder)
+            if poll_sec > 0:
+                for bundle in watched:
+                    if bundle.changed():
+                        self.load(bundle.folder)
+            self._wake.wait(poll_sec if poll_sec > 0 else None)
+
+
+REFERENCES = ReferenceRegistry()
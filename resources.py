@@ -0,0 +1,276 @@
+"""
+Resource accounting for grading runs.
+
+A usage dict describes one run (or several, combined):
+
+    {"wall_sec": 2.1, "user_sec": 1.7, "sys_sec": 0.2, "max_rss_mb": 412.5,
+     "exit_code": 0, "signal": None}
+
+For external processes the numbers come from wait4() (see supervise.py), so CPU time and
+peak RSS include whatever children the process waited for itself; for work done in this
+process (the native validator) measure() takes them from getrusage() of the calling
+thread. ResourceStats aggregates usage per grading stage, for sizing worker counts and
+memory limits from real runs; PeakHistory keeps the peak RSS of recent runs of the same task
+on disk, for scheduler.py to size each run's memory limit.
+
+Usage:
+    with resources.measure() as usage:
+        do_work()
+    RESOURCE_STATS.record("validate", usage, outcome="valid")
+    RESOURCE_STATS.snapshot()
+"""
+import fcntl
+import json
+import os
+import resource
+import tempfile
+import signal
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+_RUSAGE_THREAD = getattr(resource, "RUSAGE_THREAD", resource.RUSAGE_SELF)
+
+
+def from_rusage(ru, wall_sec, status=None):
+    """Usage dict from a struct_rusage and, for a process, its wait status."""
+    usage = {
+        "wall_sec": round(wall_sec, 3),
+        "user_sec": round(ru.ru_utime, 3),
+        "sys_sec": round(ru.ru_stime, 3),
+        "max_rss_mb": round(ru.ru_maxrss * _RSS_UNIT / 2**20, 1),
+        "exit_code": None,
+        "signal": None,
+    }
+    if status is not None:
+        if os.WIFSIGNALED(status):
+            usage["signal"] = _signal_name(os.WTERMSIG(status))
+        elif os.WIFEXITED(status):
+            usage["exit_code"] = os.WEXITSTATUS(status)
+    return usage
+
+
+def combine(*usages):
+    """One usage dict for runs made one after the other: times add up, RSS is the peak, the exit is the last one's."""
+    usages = [u for u in usages if u]
+    if not usages:
+        return None
+    return {
+        "wall_sec": round(sum(u["wall_sec"] for u in usages), 3),
+        "user_sec": round(sum(u["user_sec"] for u in usages), 3),
+        "sys_sec": round(sum(u["sys_sec"] for u in usages), 3),
+        "max_rss_mb": max((u["max_rss_mb"] for u in usages if u["max_rss_mb"] is not None), default=None),
+        "exit_code": usages[-1]["exit_code"],
+        "signal": usages[-1]["signal"],
+    }
+
+
+def concurrent(usages, wall_sec):
+    """
+    One usage dict for runs made side by side over wall_sec: times add up, and so do the peak
+    RSS values (an upper bound of the joint peak); the exit is the first run's.
+    """
+    usages = [u for u in usages if u]
+    if not usages:
+        return None
+    rss = [u["max_rss_mb"] for u in usages if u["max_rss_mb"] is not None]
+    return {
+        "wall_sec": round(wall_sec, 3),
+        "user_sec": round(sum(u["user_sec"] for u in usages), 3),
+        "sys_sec": round(sum(u["sys_sec"] for u in usages), 3),
+        "max_rss_mb": round(sum(rss), 1) if rss else None,
+        "exit_code": usages[0]["exit_code"],
+        "signal": usages[0]["signal"],
+    }
+
+
+class measure:
+    """
+    Context manager measuring in-process work on the calling thread. The dict it yields is
+    filled in on exit. max_rss_mb is the peak of the whole process so far, so it is an upper
+    bound rather than the work's own footprint.
+    """
+
+    def __enter__(self):
+        self.usage = {}
+        self._t0 = time.time()
+        self._ru0 = resource.getrusage(_RUSAGE_THREAD)
+        return self.usage
+
+    def __exit__(self, *exc):
+        ru = resource.getrusage(_RUSAGE_THREAD)
+        self.usage.update({
+            "wall_sec": round(time.time() - self._t0, 3),
+            "user_sec": round(ru.ru_utime - self._ru0.ru_utime, 3),
+            "sys_sec": round(ru.ru_stime - self._ru0.ru_stime, 3),
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT / 2**20, 1),
+            "exit_code": None,
+            "signal": None,
+        })
+        return False
+
+
+def current_rss_mb():
+    """This process's resident set size right now (not its peak), or None where /proc is missing."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+
+
+def total_memory_mb():
+    """The machine's physical memory, or None where sysconf cannot tell."""
+    try:
+        return round(os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except (OSError, ValueError):
+        return None
+
+
+class ResourceStats:
+    """
+    Per-stage totals, maxima and recent percentiles of recorded usage, plus a count of
+    outcomes (e.g. Fast Downward's "out_of_memory"). Thread-safe.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, stage, usage, outcome=None):
+        if not usage:
+            return
+        with self._lock:
+            s = self._stages.get(stage)
+            if s is None:
+                s = self._stages[stage] = {
+                    "count": 0, "wall_sec": 0.0, "cpu_sec": 0.0, "max_wall_sec": 0.0, "max_rss_mb": 0.0,
+                    "recent_wall": deque(maxlen=self.window), "recent_rss": deque(maxlen=self.window),
+                    "outcomes": Counter(),
+                }
+            cpu = usage["user_sec"] + usage["sys_sec"]
+            s["count"] += 1
+            s["wall_sec"] += usage["wall_sec"]
+            s["cpu_sec"] += cpu
+            s["max_wall_sec"] = max(s["max_wall_sec"], usage["wall_sec"])
+            s["recent_wall"].append(usage["wall_sec"])
+            if usage["max_rss_mb"] is not None:
+                s["max_rss_mb"] = max(s["max_rss_mb"], usage["max_rss_mb"])
+                s["recent_rss"].append(usage["max_rss_mb"])
+            if outcome is not None:
+                s["outcomes"][outcome] += 1
+            elif usage["signal"]:
+                s["outcomes"][f"signal:{usage['signal']}"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                stage: {
+                    "count": s["count"],
+                    "wall_sec": round(s["wall_sec"], 3),
+                    "cpu_sec": round(s["cpu_sec"], 3),
+                    # CPU seconds per wall second: roughly how many cores one run keeps busy
+                    "cpu_per_wall": round(s["cpu_sec"] / s["wall_sec"], 2) if s["wall_sec"] else None,
+                    "wall_p50_sec": _percentile(s["recent_wall"], 50),
+                    "wall_p95_sec": _percentile(s["recent_wall"], 95),
+                    "max_wall_sec": s["max_wall_sec"],
+                    "rss_p95_mb": _percentile(s["recent_rss"], 95),
+                    "max_rss_mb": s["max_rss_mb"],
+                    "outcomes": dict(s["outcomes"]),
+                }
+                for stage, s in self._stages.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+def _signal_name(signum):
+    try:
+        return signal.Signals(signum).name
+    except ValueError:
+        return str(signum)
+
+
+RESOURCE_STATS = ResourceStats()
+
+
+class PeakHistory:
+    """
+    Peak RSS (MB) of the last keep runs per key, in a JSON file that several processes share
+    (flock()ed while read and written). At most max_keys keys are kept, the least recently
+    recorded ones are dropped first.
+    """
+
+    def __init__(self, path, *, keep=5, max_keys=5000):
+        self.path = path
+        self.keep = keep
+        self.max_keys = max_keys
+
+    def record(self, key, max_rss_mb, *, raise_only=False):
+        """
+        Add a run's peak for key. With raise_only (a run cut short, whose peak may be below what
+        a full run needs) it is only added if it is above every recent peak, so it can raise the
+        estimate but never set or lower it.
+        """
+        if key is None or max_rss_mb is None:
+            return
+        with self._locked():
+            peaks = self._load()
+            if raise_only and max_rss_mb <= max(peaks.get(key) or [float("inf")]):
+                return
+            entry = peaks.pop(key, [])
+            peaks[key] = (entry + [max_rss_mb])[-self.keep:]
+            # dicts keep insertion order, so the first keys are the least recently recorded
+            for stale in list(peaks)[:max(0, len(peaks) - self.max_keys)]:
+                del peaks[stale]
+            self._store(peaks)
+
+    def peak(self, key):
+        """The largest recent peak RSS recorded for key, None if there is none."""
+        if key is None:
+            return None
+        with self._locked():
+            recent = self._load().get(key)
+        return max(recent) if recent else None
+
+    def clear(self):
+        with self._locked():
+            self._store({})
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _store(self, peaks):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(peaks, f)
+        os.replace(tmp, self.path)
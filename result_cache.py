@@ -0,0 +1,142 @@
+"""
+Content-addressed cache of grading results.
+
+Students resubmit byte-identical domain/problem text many times while debugging. The
+result of run_grader only depends on that text, the problem id, the reference files for
+that problem and the planner configuration, so it is stored under a hash of exactly those.
+
+Two tiers: a small in-memory LRU in front of an on-disk SQLite table that is bounded by
+total size (least recently used rows are evicted first). When the reference files for a
+problem change, their fingerprint changes, so old entries stop matching and are purged
+the next time that problem is looked up.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    def __init__(self, path, *, memory_entries=256, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._fingerprints = {}  # path -> (mtime_ns, size, sha256)
+        self._scopes = {}  # scope -> last fingerprint seen
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidated": 0}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY, scope TEXT, ref_fp TEXT, value TEXT, size INTEGER, last_access REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_scope ON results (scope)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_access ON results (last_access)")
+        self._db.commit()
+
+    # -----------------------
+    # Keys
+    # -----------------------
+    def fingerprint(self, files):
+        """Hash of the content of the given reference files (re-hashed only when their stat changes)."""
+        h = hashlib.sha256()
+        for path in sorted(files):
+            st = os.stat(path)
+            known = self._fingerprints.get(path)
+            if known is None or known[:2] != (st.st_mtime_ns, st.st_size):
+                with open(path, "rb") as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()
+                known = (st.st_mtime_ns, st.st_size, digest)
+                self._fingerprints[path] = known
+            h.update(f"{os.path.abspath(path)}\0{known[2]}\0".encode("utf-8"))
+        return h.hexdigest()
+
+    @staticmethod
+    def make_key(domain, problem, problem_id, ref_fp, config):
+        payload = json.dumps([domain, problem, str(problem_id), ref_fp, config], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # -----------------------
+    # Lookup / store
+    # -----------------------
+    def get(self, key, scope, ref_fp):
+        with self._lock:
+            self._check_scope(scope, ref_fp)
+
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return json.loads(value)
+
+            row = self._db.execute("SELECT value FROM results WHERE key = ? AND ref_fp = ?", (key, ref_fp)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self._db.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self._remember(key, row[0])
+            self.stats["disk_hits"] += 1
+            return json.loads(row[0])
+
+    def put(self, key, scope, ref_fp, result):
+        value = json.dumps(result)
+        with self._lock:
+            self._check_scope(scope, ref_fp)
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, scope, ref_fp, value, size, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, scope, ref_fp, value, len(value), time.time()),
+            )
+            self._evict()
+            self._db.commit()
+            self._remember(key, value)
+            self.stats["stores"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+            row = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+            stats["disk_entries"], stats["disk_bytes"] = row
+            lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+            stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+            return stats
+
+    # -----------------------
+    # Internals (call with the lock held)
+    # -----------------------
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _check_scope(self, scope, ref_fp):
+        # A new fingerprint for a scope means its reference files changed: drop the stale rows
+        if self._scopes.get(scope) == ref_fp:
+            return
+        cur = self._db.execute("DELETE FROM results WHERE scope = ? AND ref_fp != ?", (scope, ref_fp))
+        if cur.rowcount:
+            self.stats["invalidated"] += cur.rowcount
+            self._memory.clear()
+        self._db.commit()
+        self._scopes[scope] = ref_fp
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        while total > self.max_bytes:
+            row = self._db.execute("SELECT key, size FROM results ORDER BY last_access LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._db.execute("DELETE FROM results WHERE key = ?", (row[0],))
+            self._memory.pop(row[0], None)
+            total -= row[1]
+            self.stats["evictions"] += 1
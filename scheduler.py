@@ -0,0 +1,208 @@
+"""
+Memory and CPU budgets for planner runs, shared by every grading process on the machine.
+
+plan.sh and planoptimal.sh let Fast Downward use 8G each (--overall-memory-limit), whatever
+else is running. With several gradings in parallel (grade.py --jobs, server workers, portfolio
+and decomposed alignment runs) those limits add up past the machine's memory, and the OOM
+killer ends random planners. Every planner run therefore first reserves memory and a CPU from
+one pool, SCHEDULER_MEMORY_MB ($SCHEDULER_MEMORY_MB, default 90% of physical memory) and
+SCHEDULER_CPUS ($SCHEDULER_CPUS, default all), and waits in line while its reservation does
+not fit. Reservations are kept in a ledger file in SCHEDULER_DIR ($SCHEDULER_DIR, default
+.cache/scheduler), flock()ed while read and written, so separate processes share the pool;
+the entries of processes that are gone are dropped. A run is let in when it fits next to the
+running ones and everything that has waited longer, so a large run is not starved by small
+ones, but small ones still use what the large one leaves over.
+
+A run's reservation is sized from the peak RSS of past runs of the same task and
+configuration (its key; see resources.PeakHistory): HEADROOM times the largest recent peak,
+at least MIN_MEMORY_MB and at most the limit the caller asks for (planner.MEMORY_LIMIT, 8G).
+A task whose runs peaked at 300 MB then takes 450 MB of the pool instead of 8 GB, and many
+more of them run side by side. Runs without history reserve DEFAULT_MEMORY_MB
+($SCHEDULER_DEFAULT_MEMORY_MB, default the pool's memory per CPU), so first runs never hold
+more memory than their CPU's share. The reservation only decides when a run is let in: Fast
+Downward still gets the full limit the caller asked for as its --overall-memory-limit (the
+scripts read $PLANNER_MEMORY_LIMIT), so an estimate that was too low never fails a grading
+run, and the run's peak raises the next estimate. Only runs that ended on their own set the
+estimate: the peak of a run that was cancelled, stopped early, timed out or ran out of memory
+can raise it, never set it, as a full run may well need more.
+
+Only searches take part; the translator runs outside the pool, with the driver's defaults.
+
+Time spent waiting in line is not taken from the run's time limit. SCHEDULER=0 turns the
+pool off: every run gets the limit it asks for, as before.
+
+Usage:
+    with SCHEDULER.reserve(key, "8G", cancel=cancel) as slot:     # blocks until it fits
+        if slot is not None:                                      # None: cancelled while waiting
+            run(["--overall-memory-limit", slot.memory_limit, ...])
+            slot.record(usage, complete=not cut_short)
+"""
+import fcntl
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+import metrics
+import resources
+
+ENABLED = os.environ.get("SCHEDULER", "1") != "0"
+SCHEDULER_DIR = os.environ.get("SCHEDULER_DIR", ".cache/scheduler")
+SCHEDULER_MEMORY_MB = float(os.environ.get("SCHEDULER_MEMORY_MB", 0)) or round(
+    0.9 * (resources.total_memory_mb() or 8192))
+SCHEDULER_CPUS = int(os.environ.get("SCHEDULER_CPUS", os.cpu_count() or 1))
+DEFAULT_MEMORY_MB = float(os.environ.get("SCHEDULER_DEFAULT_MEMORY_MB", 0))
+
+HEADROOM = 1.5
+MIN_MEMORY_MB = 256
+POLL_SEC = 0.2
+
+
+def to_mb(limit):
+    """A memory limit in Fast Downward's notation ("8G", "2730M", "512K", bytes) in MB; None if unreadable."""
+    m = re.fullmatch(r"(\d+)([KMG]?)", str(limit).strip().upper())
+    if m is None:
+        return None
+    return int(m.group(1)) * {"K": 1 / 1024, "M": 1, "G": 1024, "": 1 / 2**20}[m.group(2)]
+
+
+class Slot:
+    """A granted reservation of memory_mb; memory_limit is what to pass as --overall-memory-limit."""
+
+    def __init__(self, scheduler, key, memory_mb, memory_limit, waited_sec):
+        self._scheduler = scheduler
+        self.key = key
+        self.memory_mb = memory_mb
+        self.memory_limit = memory_limit
+        self.waited_sec = waited_sec
+
+    def record(self, usage, *, complete=True):
+        """
+        Remember the run's peak RSS (a resources.py usage dict) for sizing the next run of its
+        key. complete=False for a run that did not end on its own: its peak only counts if it
+        is above what was recorded before.
+        """
+        if usage and self._scheduler.enabled:
+            self._scheduler.peaks.record(self.key, usage["max_rss_mb"], raise_only=not complete)
+
+
+class Scheduler:
+    def __init__(self, path=None, *, memory_mb=None, cpus=None, default_mb=None, enabled=None):
+        self.path = path or SCHEDULER_DIR
+        self.memory_mb = memory_mb or SCHEDULER_MEMORY_MB
+        self.cpus = cpus or SCHEDULER_CPUS
+        self.default_mb = default_mb or DEFAULT_MEMORY_MB or self.memory_mb / self.cpus
+        self.enabled = ENABLED if enabled is None else enabled
+        self.peaks = resources.PeakHistory(os.path.join(self.path, "peaks.json"))
+        self._ledger = os.path.join(self.path, "ledger.json")
+
+    def estimate_mb(self, key, limit):
+        """The memory to reserve for a run of key that may use up to limit (e.g. "8G")."""
+        cap = min(to_mb(limit) or self.memory_mb, self.memory_mb)
+        peak = self.peaks.peak(key)
+        if peak is None:
+            return min(cap, max(MIN_MEMORY_MB, self.default_mb))
+        return min(cap, max(MIN_MEMORY_MB, peak * HEADROOM))
+
+    @contextmanager
+    def reserve(self, key, limit, *, cancel=None):
+        """
+        Wait until a run of key fits in the pool, and hold its reservation while the block runs.
+        Yields a Slot, or None if the threading.Event cancel was set while waiting.
+        """
+        if not self.enabled:
+            yield Slot(self, key, to_mb(limit), limit, 0.0)
+            return
+        memory_mb = self.estimate_mb(key, limit)
+        entry_id = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        t0 = time.time()
+        with self._locked() as ledger:
+            ledger["next_ticket"] = ledger.get("next_ticket", 0) + 1
+            ledger["entries"][entry_id] = {"pid": os.getpid(), "ticket": ledger["next_ticket"], "key": key,
+                                           "memory_mb": round(memory_mb, 1), "cpus": 1, "state": "waiting",
+                                           "since": t0}
+        try:
+            while True:
+                with self._locked() as ledger:
+                    if self._fits(ledger, entry_id):
+                        ledger["entries"][entry_id].update(state="running", since=time.time())
+                        break
+                if cancel is not None and cancel.is_set():
+                    yield None
+                    return
+                if cancel is not None:
+                    cancel.wait(POLL_SEC)
+                else:
+                    time.sleep(POLL_SEC)
+            waited = time.time() - t0
+            metrics.SCHEDULER_WAIT_SECONDS.observe(waited)
+            yield Slot(self, key, memory_mb, limit, waited)
+        finally:
+            with self._locked() as ledger:
+                ledger["entries"].pop(entry_id, None)
+
+    def snapshot(self):
+        if not self.enabled:
+            return {"enabled": False}
+        with self._locked() as ledger:
+            entries = list(ledger["entries"].values())
+        running = [e for e in entries if e["state"] == "running"]
+        return {
+            "enabled": True,
+            "memory_mb": self.memory_mb,
+            "cpus": self.cpus,
+            "reserved_memory_mb": round(sum(e["memory_mb"] for e in running), 1),
+            "running": len(running),
+            "waiting": len(entries) - len(running),
+        }
+
+    def _fits(self, ledger, entry_id):
+        me = ledger["entries"][entry_id]
+        # Whatever runs, and whatever has waited longer, comes first
+        ahead = [e for e in ledger["entries"].values()
+                 if e is not me and (e["state"] == "running" or e["ticket"] < me["ticket"])]
+        if not ahead:
+            # Alone: let it in even if it asks for the whole pool, so the line always moves
+            return True
+        return (sum(e["memory_mb"] for e in ahead) + me["memory_mb"] <= self.memory_mb
+                and sum(e["cpus"] for e in ahead) + me["cpus"] <= self.cpus)
+
+    @contextmanager
+    def _locked(self):
+        """The ledger, read under its lock file and written back when the block ends."""
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._ledger + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self._ledger, encoding="utf-8") as g:
+                        ledger = json.load(g)
+                except (FileNotFoundError, ValueError):
+                    ledger = {}
+                ledger.setdefault("entries", {})
+                for entry_id, entry in list(ledger["entries"].items()):
+                    if not _alive(entry["pid"]):
+                        del ledger["entries"][entry_id]
+                yield ledger
+                fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as g:
+                    json.dump(ledger, g)
+                os.replace(tmp, self._ledger)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+SCHEDULER = Scheduler()
@@ -0,0 +1,502 @@
+"""
+Breadth-first search on a grounded task, for alignment checks.
+
+An alignment check asks whether the merged task from merge.py can reach (failed), i.e.
+whether some sequence of actions is applicable in one domain but not the other. The merged
+tasks for course-sized problems are small, so instead of handing them to Fast Downward
+they can be grounded here and searched exhaustively:
+
+- Facts are numbered by validator.Task and a state is an integer bitset.
+- Actions are grounded by enumerating typed parameter bindings, pruned by the static facts
+  (predicates no action changes) in the precondition as soon as their variables are bound.
+- Each grounded precondition is compiled to a disjunction of (positive_mask, negative_mask)
+  pairs; the fail_ actions have negated preconditions, so they are rarely a single pair.
+- Breadth-first search with duplicate detection, so a plan found is a shortest one.
+
+search() stops at a node or time limit and says so; the caller then falls back to the
+external planner. Tasks the grounder cannot handle raise validator.UnsupportedTask, and so do
+tasks too large to ground here: more than MAX_GROUND_ACTIONS ground actions, or grounding
+and the relaxed pass not done within the time limit.
+
+Usage:
+    res = search.search(merged_problem, node_limit=200000, time_limit=10)
+    res["status"]  # "plan" (res["plan"] is a shortest plan), "exhausted" or "limit"
+"""
+import time
+from collections import deque
+
+from tarski.fstrips import fstrips
+from tarski.syntax import formulas, terms
+from tarski.syntax.builtins import BuiltinPredicateSymbol, is_builtin_predicate
+
+from validator import GroundAction, Task, UnsupportedTask, holds
+
+# Largest DNF a single precondition may expand to before the task is left to the planner
+MAX_DISJUNCTS = 256
+# Most ground actions a task may have before it is left to the planner
+MAX_GROUND_ACTIONS = 50000
+
+
+class GroundTask:
+    def __init__(self, problem, *, max_actions=None, deadline=None):
+        self.task = Task(problem)
+        self.init = self.task.init
+        self.static = self._static_predicates(problem)
+        self._init_keys = {self.task.fact_keys[i] for i in range(len(self.task.fact_keys)) if self.task.init >> i & 1}
+
+        self.actions = []  # [(plan text, [(pos, neg, antis)], GroundAction)]
+        for schema in problem.actions.values():
+            for binding in self._action_bindings(schema):
+                if deadline is not None and time.time() > deadline:
+                    raise UnsupportedTask("grounding did not finish within the time limit")
+                pre = self.conditions(self.task.formula(schema.precondition, binding))
+                if not pre:
+                    continue
+                effects = []
+                for eff in schema.effects:
+                    self.task.effect(eff, binding, effects)
+                args = [binding[v.symbol] for v in schema.parameters.vars()]
+                text = "(" + " ".join([schema.name.lower()] + args) + ")"
+                self.actions.append((text, pre, GroundAction(text, None, effects)))
+                if max_actions is not None and len(self.actions) > max_actions:
+                    raise UnsupportedTask(f"more than {max_actions} ground actions")
+
+        self.goal = self.conditions(self.task.goal)
+
+        self._index()
+
+    def _index(self):
+        # Unconditional effects folded into one (add, del) pair per action
+        self._effects = []
+        for _, _, action in self.actions:
+            add = delete = 0
+            conditional = []
+            for cond, a, d in action.effects:
+                if cond is None:
+                    add |= a
+                    delete |= d
+                else:
+                    conditional.append((cond, a, d))
+            self._effects.append((add, ~delete, conditional))
+        self.applicable = _compile_generator(
+            _build_generator([(c, i, set(_bits(c[0]))) for i, (_, pre, _) in enumerate(self.actions) for c in pre]))
+
+    def restrict(self, indices):
+        """Keep only the ground actions with the given indices."""
+        self.actions = [self.actions[i] for i in sorted(indices)]
+        self._index()
+
+    # -----------------------
+    # Grounding
+    # -----------------------
+    @staticmethod
+    def _static_predicates(problem):
+        changed = set()
+
+        def visit(eff):
+            if isinstance(eff, fstrips.UniversalEffect):
+                for sub in eff.effects:
+                    visit(sub)
+            elif isinstance(eff, (fstrips.AddEffect, fstrips.DelEffect)):
+                changed.add(eff.atom.predicate.name.lower())
+
+        for schema in problem.actions.values():
+            for eff in schema.effects:
+                visit(eff)
+        return {p.name.lower() for p in problem.language.predicates
+                if not is_builtin_predicate(p) and p.name.lower() not in changed}
+
+    def _action_bindings(self, schema):
+        """Parameter bindings for schema that survive the static literals of its precondition."""
+        params = schema.parameters.vars()
+        # Each check is run right after the last of its variables is bound (ground ones first)
+        checks = [[] for _ in params] or [[]]
+        position = {v.symbol: i for i, v in enumerate(params)}
+        for lit in _conjuncts(schema.precondition):
+            check = self._static_check(lit)
+            if check is None:
+                continue
+            names = [t.symbol for t in check[1] if isinstance(t, terms.Variable)]
+            if any(n not in position for n in names):
+                continue
+            checks[max((position[n] for n in names), default=0)].append(check)
+        if not params:
+            if all(self._check(c, {}) for c in checks[0]):
+                yield {}
+            return
+
+        domains = [self.task.objects_of(v.sort) for v in params]
+        binding = {}
+
+        def extend(i):
+            for obj in domains[i]:
+                binding[params[i].symbol] = obj
+                if all(self._check(c, binding) for c in checks[i]):
+                    if i + 1 == len(params):
+                        yield dict(binding)
+                    else:
+                        yield from extend(i + 1)
+            binding.pop(params[i].symbol, None)
+
+        yield from extend(0)
+
+    def _static_check(self, lit):
+        positive = True
+        if isinstance(lit, formulas.CompoundFormula) and lit.connective == formulas.Connective.Not:
+            positive, lit = False, lit.subformulas[0]
+        if not isinstance(lit, formulas.Atom):
+            return None
+        if is_builtin_predicate(lit.predicate):
+            if lit.predicate.symbol == BuiltinPredicateSymbol.EQ:
+                return ("=", lit.subterms, positive)
+            if lit.predicate.symbol == BuiltinPredicateSymbol.NE:
+                return ("=", lit.subterms, not positive)
+            return None
+        if lit.predicate.name.lower() in self.static:
+            return (lit.predicate.name.lower(), lit.subterms, positive)
+        return None
+
+    def _check(self, check, binding):
+        name, args, positive = check
+        values = [binding[t.symbol] if isinstance(t, terms.Variable) else t.symbol.lower() for t in args]
+        if name == "=":
+            return (values[0] == values[1]) == positive
+        return ((name, tuple(values)) in self._init_keys) == positive
+
+    def conditions(self, f):
+        """
+        f (in validator's tuple form) as a list of alternatives (pos_mask, neg_mask, antis), where
+        antis is a tuple of (pos_mask, neg_mask) conjunctions that must not hold; [] if f is
+        unsatisfiable. A negated conjunction, which is what merge.py puts in every fail_
+        action, stays a single anti-conjunction instead of being expanded into a disjunction.
+        """
+        kind = f[0]
+        if kind == "not":
+            inner = self.conditions(f[1])
+            if not inner:
+                return [(0, 0, ())]
+            if len(inner) == 1 and not inner[0][2]:
+                pos, neg, _ = inner[0]
+                if not pos | neg:
+                    return []
+                if pos & (pos - 1) == 0 and neg & (neg - 1) == 0 and not (pos and neg):
+                    return [(neg, pos, ())]
+                return [(0, 0, ((pos, neg),))]
+            return [(pos, neg, ()) for pos, neg in self.dnf(f[1], False)]
+        if kind == "and":
+            result = [(0, 0, ())]
+            for sub in f[1]:
+                alternatives = self.conditions(sub)
+                result = [(p1 | p2, n1 | n2, a1 + a2) for p1, n1, a1 in result for p2, n2, a2 in alternatives
+                          if not (p1 | p2) & (n1 | n2)]
+                if not result:
+                    return []
+                if len(result) > MAX_DISJUNCTS:
+                    raise UnsupportedTask(f"precondition expands to more than {MAX_DISJUNCTS} alternatives")
+            return _dedupe(result)
+        if kind == "or":
+            result = []
+            for sub in f[1]:
+                result.extend(self.conditions(sub))
+                if len(result) > MAX_DISJUNCTS:
+                    raise UnsupportedTask(f"precondition expands to more than {MAX_DISJUNCTS} alternatives")
+            return _dedupe(result)
+        return [(pos, neg, ()) for pos, neg in self.dnf(f)]
+
+    def dnf(self, f, positive=True):
+        """f (in validator's tuple form) as a list of (pos_mask, neg_mask) alternatives; [] if unsatisfiable."""
+        kind = f[0]
+        if kind == "const":
+            return [(0, 0)] if f[1] == positive else []
+        if kind == "fact":
+            if self.task.fact_keys[f[1]][0] in self.static:
+                return [(0, 0)] if (self.init >> f[1] & 1 == 1) == positive else []
+            bit = 1 << f[1]
+            return [(bit, 0)] if positive else [(0, bit)]
+        if kind == "not":
+            return self.dnf(f[1], not positive)
+        if (kind == "and") == positive:
+            result = [(0, 0)]
+            for sub in f[1]:
+                alternatives = self.dnf(sub, positive)
+                result = [(p1 | p2, n1 | n2) for p1, n1 in result for p2, n2 in alternatives if not (p1 | p2) & (n1 | n2)]
+                if not result:
+                    return []
+                if len(result) > MAX_DISJUNCTS:
+                    raise UnsupportedTask(f"precondition expands to more than {MAX_DISJUNCTS} alternatives")
+            return _dedupe(result)
+        result = []
+        for sub in f[1]:
+            result.extend(self.dnf(sub, positive))
+            if len(result) > MAX_DISJUNCTS:
+                raise UnsupportedTask(f"precondition expands to more than {MAX_DISJUNCTS} alternatives")
+        return _dedupe(result)
+
+    # -----------------------
+    # Relaxed reachability
+    # -----------------------
+    def relaxed_reachability(self, deadline=None):
+        """
+        Which ground actions and goal become reachable when deletes are ignored. Negative
+        preconditions are handled by also tracking which facts can be made false: a fact can
+        be false if it is false initially or some reachable action deletes it. This
+        over-approximates the reachable states, so a goal that is unreachable here is
+        unreachable for real.
+
+        Returns {"actions": {index: layer}, "goal_layer": layer or None}, where layer is
+        the round of the fixpoint in which it was first reached (h^max for unit costs).
+        Raises UnsupportedTask if it is not done by the time.time() deadline.
+        """
+        true = self.init
+        false = ~self.init & ((1 << len(self.task.fact_keys)) - 1)
+        conditional = [[(self.conditions(cond), a, d) for cond, a, d in effs] for _, _, effs in self._effects]
+
+        reached = {}
+        goal_layer = 0 if _relaxed_satisfied(self.goal, true, false) else None
+        layer = 0
+        while goal_layer is None:
+            if deadline is not None and time.time() > deadline:
+                raise UnsupportedTask("relaxed reachability did not finish within the time limit")
+            layer += 1
+            new_true, new_false = true, false
+            for i, (_, pre, _) in enumerate(self.actions):
+                if i not in reached:
+                    if not _relaxed_satisfied(pre, true, false):
+                        continue
+                    reached[i] = layer
+                add, keep, _ = self._effects[i]
+                new_true |= add
+                new_false |= ~keep
+                for alternatives, a, d in conditional[i]:
+                    if _relaxed_satisfied(alternatives, true, false):
+                        new_true |= a
+                        new_false |= d
+            if (new_true, new_false) == (true, false):
+                break
+            true, false = new_true, new_false
+            if _relaxed_satisfied(self.goal, true, false):
+                goal_layer = layer
+        return {"actions": reached, "goal_layer": goal_layer}
+
+    # -----------------------
+    # Search
+    # -----------------------
+    def bfs(self, *, node_limit=200000, time_limit=10.0):
+        t0 = time.time()
+        stats = {"ground_actions": len(self.actions), "expanded": 0, "generated": 1}
+
+        def done(status, plan=None):
+            stats["duration_sec"] = time.time() - t0
+            return dict(stats, status=status, plan=plan)
+
+        if _satisfied(self.goal, self.init):
+            return done("plan", [])
+
+        parent = {self.init: None}
+        frontier = deque([self.init])
+        while frontier:
+            if stats["expanded"] % 256 == 0 and time.time() - t0 > time_limit:
+                return done("limit")
+            state = frontier.popleft()
+            stats["expanded"] += 1
+            for i in self.applicable(state):
+                succ = self.apply(i, state)
+                if succ in parent:
+                    continue
+                parent[succ] = (state, i)
+                stats["generated"] += 1
+                if _satisfied(self.goal, succ):
+                    return done("plan", self._extract(parent, succ))
+                if stats["generated"] > node_limit:
+                    return done("limit")
+                frontier.append(succ)
+        return done("exhausted")
+
+    def apply(self, i, state):
+        add, keep, conditional = self._effects[i]
+        succ = state & keep | add
+        if conditional:
+            adds = dels = 0
+            for cond, a, d in conditional:
+                if holds(cond, state):
+                    adds |= a
+                    dels |= d
+            succ = (succ & ~dels) | adds
+        return succ
+
+    def _extract(self, parent, state):
+        steps = []
+        while parent[state] is not None:
+            state, i = parent[state]
+            steps.append(self.actions[i][0])
+        return steps[::-1]
+
+
+# Successor generator: a decision tree over precondition facts, as in Fast Downward. An inner
+# node is (fact_bit, subtree requiring the fact, subtree not mentioning it); a leaf is
+# (0, [(condition, action index)], None) and is checked condition by condition. The tree is
+# turned into the source of a function of nested ifs, which is several times faster than
+# walking it at every state.
+LEAF_SIZE = 4
+MAX_DEPTH = 16  # Python allows at most 20 nested blocks
+
+
+def _build_generator(entries, split=frozenset(), depth=0):
+    """entries: [(condition, action index, ids of the facts the condition requires)]"""
+    if len(entries) <= LEAF_SIZE or depth == MAX_DEPTH:
+        return (0, entries, None)
+    counts = {}
+    for _, _, facts in entries:
+        for fact in facts:
+            if fact not in split:
+                counts[fact] = counts.get(fact, 0) + 1
+    if not counts:
+        return (0, entries, None)
+    best = max(counts, key=counts.get)
+    required = [e for e in entries if best in e[2]]
+    rest = [e for e in entries if best not in e[2]]
+    return (1 << best, _build_generator(required, split | {best}, depth + 1), _build_generator(rest, split, depth))
+
+
+def _compile_generator(tree):
+    """applicable(state) -> list of indices of the applicable actions (an index may repeat)."""
+    lines = ["def applicable(s):", "    out = []"]
+
+    def emit(node, indent):
+        bit, required, rest = node
+        pad = "    " * indent
+        if bit:
+            lines.append(f"{pad}if s & {bit}:")
+            emit(required, indent + 1)
+            emit(rest, indent)
+            return
+        for (pos, neg, antis), i, _ in required:
+            tests = []
+            if pos:
+                tests.append(f"s & {pos} == {pos}")
+            if neg:
+                tests.append(f"not s & {neg}")
+            for apos, aneg in antis:
+                if apos and aneg:
+                    tests.append(f"not (s & {apos} == {apos} and not s & {aneg})")
+                elif apos:
+                    tests.append(f"s & {apos} != {apos}")
+                else:
+                    tests.append(f"s & {aneg}")
+            if tests:
+                lines.append(f"{pad}if {' and '.join(tests)}:")
+                lines.append(f"{pad}    out.append({i})")
+            else:
+                lines.append(f"{pad}out.append({i})")
+        if not required:
+            lines.append(f"{pad}pass")
+
+    emit(tree, 1)
+    lines.append("    return out")
+    namespace = {}
+    exec(compile("\n".join(lines), "<successor generator>", "exec"), namespace)
+    return namespace["applicable"]
+
+
+def _bits(mask):
+    """Positions of the set bits of mask."""
+    return [i for i, c in enumerate(reversed(bin(mask)[2:])) if c == "1"]
+
+
+def _conjuncts(f):
+    if isinstance(f, formulas.CompoundFormula) and f.connective == formulas.Connective.And:
+        for sub in f.subformulas:
+            yield from _conjuncts(sub)
+    else:
+        yield f
+
+
+def _dedupe(alternatives):
+    return list(dict.fromkeys(alternatives))
+
+
+def _holds(condition, state):
+    pos, neg, antis = condition
+    if state & pos != pos or state & neg:
+        return False
+    for apos, aneg in antis:
+        if state & apos == apos and not state & aneg:
+            return False
+    return True
+
+
+def _relaxed_satisfied(alternatives, true, false):
+    for pos, neg, antis in alternatives:
+        if true & pos == pos and false & neg == neg and all(apos & false or aneg & true for apos, aneg in antis):
+            return True
+    return False
+
+
+def _action_name(text):
+    return text[1:-1].split(" ", 1)[0]
+
+
+def _satisfied(alternatives, state):
+    for condition in alternatives:
+        if _holds(condition, state):
+            return True
+    return False
+
+
+def format_plan(steps):
+    """A plan in the format Fast Downward writes to its plan file."""
+    return "".join(s + "\n" for s in steps) + f"; cost = {len(steps)} (unit cost)\n"
+
+
+# Most reachable fail actions listed in a report
+REPORT_FAIL_ACTIONS = 20
+
+
+def search(problem, *, node_limit=200000, time_limit=10.0, relaxed=True, bfs=True,
+           max_ground_actions=MAX_GROUND_ACTIONS):
+    """
+    Ground the tarski problem and search for a shortest plan. Returns a dict with keys:
+    status, plan (text, for status "plan"), ground_actions, expanded, generated,
+    duration_sec, relaxed. Raises UnsupportedTask.
+
+    With relaxed, a relaxed reachability pass runs first: if the goal is unreachable even
+    then, status is "unreachable" and no search is needed; otherwise the actions it found
+    unreachable are dropped before searching, and relaxed reports which fail_ actions are
+    still reachable. With bfs=False the search itself is skipped (status "skipped").
+    Otherwise status is "plan", "exhausted" or "limit".
+
+    time_limit covers grounding and the relaxed pass too: a task with more than
+    max_ground_actions ground actions, or not grounded and checked within time_limit, raises
+    UnsupportedTask rather than running into the caller's own timeout.
+    """
+    t0 = time.time()
+    task = GroundTask(problem, max_actions=max_ground_actions, deadline=t0 + time_limit)
+    res = {"status": "skipped", "plan": None, "ground_actions": len(task.actions), "expanded": 0, "generated": 0}
+
+    if relaxed:
+        reach = task.relaxed_reachability(deadline=t0 + time_limit)
+        fail = [i for i, (text, _, _) in enumerate(task.actions) if _action_name(text).startswith("fail_")]
+        reachable = [task.actions[i][0] for i in fail if i in reach["actions"]]
+        reachable_names = {_action_name(text) for text in reachable}
+        res["relaxed"] = {
+            "goal_reachable": reach["goal_layer"] is not None,
+            "hmax": reach["goal_layer"],
+            "fail_actions": len(fail),
+            "reachable_fail_actions": len(reachable),
+            "reachable_fail_examples": reachable[:REPORT_FAIL_ACTIONS],
+            "unreachable_fail_schemas": sorted(name for name in problem.actions
+                                               if name.lower().startswith("fail_") and name.lower() not in reachable_names),
+        }
+        if reach["goal_layer"] is None:
+            res["status"] = "unreachable"
+            res["duration_sec"] = time.time() - t0
+            return res
+        task.restrict(reach["actions"])
+
+    if bfs:
+        found = task.bfs(node_limit=node_limit, time_limit=max(0.0, time_limit - (time.time() - t0)))
+        res.update(found, ground_actions=res["ground_actions"], searched_actions=found["ground_actions"])
+        if res["plan"] is not None:
+            res["plan"] = format_plan(res["plan"])
+    res["duration_sec"] = time.time() - t0
+    return res
@@ -1,21 +1,32 @@
 
-import os, random, string, time
+import os, time
 
 from flask import Flask, request
 from flask_cors import CORS
 
+import merge_pool
+import workspace
+from admission import AdmissionController
+
 app = Flask(__name__)
 CORS(app)
 
 TIME_LIMIT = 30 # seconds
-IPS = {}
-CURRENT_IP = None
-COOL_IT = False
-COOLDOWN_TIME = 90 # seconds
+
+# Admission control: one alignment per core, each client may send CLIENT_BURST requests
+# back to back and then one more every CLIENT_REFILL_TIME seconds. Requests that find
+# every slot busy queue (fairly across clients) for up to QUEUE_WAIT_TIME seconds.
+CLIENT_BURST = 3
+CLIENT_REFILL_TIME = 30 # seconds
+QUEUE_WAIT_TIME = 30 # seconds
+ADMISSION = AdmissionController(os.cpu_count(), burst=CLIENT_BURST, refill_sec=CLIENT_REFILL_TIME, max_wait=QUEUE_WAIT_TIME)
 
 # Change to reflect the list of problems for testing
 REFERENCE_LOC = 'data/reference'
-TEMP_LOC = '/tmp'
+
+# Per-request scratch files live in workspace.py directories (tmpfs when available), removed
+# after each request; clear out the ones a previous run of the server left behind
+workspace.sweep()
 
 PROBLEMS = ['p01', 'p02', 'p03']
 
@@ -39,19 +50,14 @@ def align(prob):
     dstring = request.json['domain']
     pstring = request.json['problem']
     ipaddress = request.remote_addr
-    rn = rand_hash()
-    dfile = f'{TEMP_LOC}/domain.{rn}.pddl'
-    pfile = f'{TEMP_LOC}/problem.{rn}.pddl'
-    with open(dfile, 'w') as f:
-        f.write(dstring)
-    with open(pfile, 'w') as f:
-        f.write(pstring)
+    if not ADMISSION.acquire(ipaddress):
+        return ({"align": False, "status": "error", "error": "Too many requests. Please try again later."}, 200, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'})
     try:
-
-        if not start_solve(ipaddress):
-            return ({"align": False, "status": "error", "error": "Too many requests. Please try again later."}, 200, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'})
-        (align, plan, error) =  check_alignment(prob, dfile, pfile)
-        end_solve()
+        try:
+            with workspace.Workspace() as ws:
+                (align, plan, error) =  check_alignment(prob, dstring, pstring, ws)
+        finally:
+            ADMISSION.release()
 
         assert align or plan or error
         if plan:
@@ -79,7 +85,6 @@ def align(prob):
             message = "Everything looks good!"
         resp = {'align': align, 'result': message, 'status': 'success'}
     except Exception as e:
-        end_solve()
         resp = {'align': False, 'error': str(e), 'status': 'error'}
     return (resp, 200, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'})
 
@@ -90,42 +95,21 @@ def problems():
     return {'problems': PROBLEMS}
 
 
-def start_solve(ip):
-    global CURRENT_IP, COOL_IT
-    if ip in IPS and time.time() - IPS[ip] < COOLDOWN_TIME:
-        return False
-    elif CURRENT_IP:
-        COOL_IT = True
-        return False
-    else:
-        CURRENT_IP = ip
-        return True
-
-def end_solve():
-    global CURRENT_IP, COOL_IT, IPS
-    if CURRENT_IP and COOL_IT:
-        IPS[CURRENT_IP] = time.time()
-    CURRENT_IP = None
-    COOL_IT = False
-
-def rand_hash():
-    return ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(16))
-
-def check_alignment(prob, dfile, pfile):
-    rn = rand_hash()
-    mdfile = f'{TEMP_LOC}/domain.{rn}.merged.pddl'
-    mpfile = f'{TEMP_LOC}/problem.{rn}.merged.pddl'
-    planfile = f'{TEMP_LOC}/plan.{rn}.merged'
-    planoutput = f'{TEMP_LOC}/plan.{rn}.merged.log'
-    mergeoutput = f'{TEMP_LOC}/merge.{rn}.merged.log'
-    os.system(f'python3 merge.py {REFERENCE_LOC}/domain.pddl {REFERENCE_LOC}/{prob}.pddl {dfile} {pfile} {mdfile} {mpfile} > {mergeoutput} 2>&1')
-
-    # Check the merge file for an error message
-    with open(f'{mergeoutput}', 'r') as f:
-        mtext = f.read()
-        if 'Error' in mtext:
-            print(f'Warning: Merge failed')
-            return (False, None, mtext)
+def check_alignment(prob, domain, problem, ws):
+    # merge in a warm worker instead of starting a new python3 merge.py
+    res = merge_pool.run_merge(f'{REFERENCE_LOC}/domain.pddl', f'{REFERENCE_LOC}/{prob}.pddl', domain, problem, timeout=TIME_LIMIT)
+    mtext = res['log']
+
+    # The log only explains the failure: output that happens to say 'Error' does not fail the merge
+    if not res['ok']:
+        print(f'Warning: Merge failed')
+        return (False, None, mtext or f"Error: {res['error']}")
+
+    mdfile = ws.file(res['domain'], '.pddl')
+    mpfile = ws.file(res['problem'], '.pddl')
+    outdir = ws.mkdir('plan-')
+    planfile = f'{outdir}/plan.merged'
+    planoutput = f'{outdir}/plan.merged.log'
 
     t = time.time()
     os.system(f'./plan.sh {planfile} {mdfile} {mpfile} {TIME_LIMIT}s > {planoutput} 2>&1')
@@ -139,12 +123,10 @@ def check_alignment(prob, dfile, pfile):
     # check file for failure message
     error = None
     with open(f'{planoutput}', 'r') as f:
-        mtext = f.read()
-        align = 'Search stopped without finding a solution.' in mtext
+        align = 'Search stopped without finding a solution.' in f.read()
     if not (align or os.path.isfile(f'{planfile}')):
         print(f'Warning: Alignment failed')
-        with open(f'{mergeoutput}', 'r') as f:
-            error = f.read()
+        error = mtext
     plan = None
     if os.path.isfile(f'{planfile}'):
         with open(f'{planfile}', 'r') as f:
@@ -3,17 +3,79 @@ from __future__ import annotations
 import os
 import tempfile
 import shutil
+import threading
+import time
 import uuid
 from dataclasses import dataclass
+from pathlib import Path
 from typing import Any, Dict, Optional
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from werkzeug.exceptions import HTTPException
 
+import metrics
+import planner
+import portfolio
+import scheduler
+import workspace
+from assignments import ASSIGNMENTS
+from reference import REFERENCES
 from grader import Grader
+from jobs import JobQueue, QueueFull
+from resources import RESOURCE_STATS
+from result_cache import ResultCache
+from stages import Stage, run_stages
 
 
 REFERENCE_LOC = "data/reference"
+# Problems of a reference folder whose bundle is not loaded yet (see reference.py)
+DEFAULT_PROBLEM_IDS = ["1", "2", "3"]
+
+# Cache of run_grader results for byte-identical resubmissions
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", ".cache/results.sqlite")
+RESULT_CACHE = ResultCache(RESULT_CACHE_PATH)
+
+# Plan validation backend: "val" (validate.sh) or "native" (validator.py)
+VALIDATOR = os.environ.get("VALIDATOR", "val")
+
+# Built-in search for alignment checks before falling back to the planner (search.py)
+ALIGNMENT_SEARCH = os.environ.get("ALIGNMENT_SEARCH", "1") != "0"
+ALIGNMENT_PRECHECK = os.environ.get("ALIGNMENT_PRECHECK", "1") != "0"
+
+# Planner configurations raced against each other (portfolio.py); one or none = lama-first alone
+PLAN_PORTFOLIO = portfolio.parse_configs(os.environ.get("PLAN_PORTFOLIO", "lama-first"))
+ALIGNMENT_PORTFOLIO = portfolio.parse_configs(os.environ.get("ALIGNMENT_PORTFOLIO", "lama-first,hmax,blind"))
+
+# Plan on one merged task per this many fail actions instead of the whole one (decompose.py); 0 = off
+ALIGNMENT_DECOMPOSE = int(os.environ.get("ALIGNMENT_DECOMPOSE", "0"))
+ALIGNMENT_DECOMPOSE_CONFIG = portfolio.parse_configs(os.environ.get("ALIGNMENT_DECOMPOSE_CONFIG", "lama-first"))[0]
+
+# Turn away submissions merge cannot take before any planner/VAL run (preflight.py)
+PREFLIGHT = os.environ.get("PREFLIGHT", "1") != "0"
+
+# Where full planner/VAL output is kept (responses only carry a capped tail); unset = nowhere
+GRADER_LOG_DIR = os.environ.get("GRADER_LOG_DIR") or None
+
+# Everything besides the inputs and reference files that can change a grading result
+PLANNER_CONFIG = {
+    "plan_timeout": 30,
+    "validate_timeout": 60,
+    "alignment_timeout": 60,
+    "planner": planner.config(),
+    "validator": VALIDATOR,
+    "alignment_search": [ALIGNMENT_SEARCH, Grader.ALIGNMENT_NODE_LIMIT, Grader.ALIGNMENT_SEARCH_SEC],
+    "alignment_precheck": ALIGNMENT_PRECHECK,
+    "preflight": PREFLIGHT,
+    "portfolio": {"plan": PLAN_PORTFOLIO, "alignment": ALIGNMENT_PORTFOLIO},
+    "alignment_decompose": [ALIGNMENT_DECOMPOSE, ALIGNMENT_DECOMPOSE_CONFIG],
+    "scripts": {name: Path(name).read_text(encoding="utf-8") if Path(name).exists() else None
+                for name in ["validate.sh"]},
+}
+
+# Job mode (?async=1): grading workers draining a bounded queue
+GRADING_WORKERS = int(os.environ.get("GRADING_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+JOB_QUEUE_DEPTH = int(os.environ.get("JOB_QUEUE_DEPTH", "64"))
+JOB_MAX_WAIT_SEC = 30  # longest long-poll allowed on GET /jobs/<id>
 
 # --- Optional CORS (enable if frontend is separate) ---
 ENABLE_CORS = True
@@ -26,6 +88,10 @@ except Exception:
 # App factory
 # -----------------------
 def create_app() -> Flask:
+    # Scratch directories left behind by server processes that crashed or were killed
+    workspace.sweep()
+    # Parse and check the reference files in the background; /health says when they are ready
+    REFERENCES.start([REFERENCE_LOC])
     app = Flask(__name__)
     if ENABLE_CORS:
         try:
@@ -33,9 +99,32 @@ def create_app() -> Flask:
         except Exception:
             pass
 
+    @app.before_request
+    def start_timer():
+        g.started = time.perf_counter()
+
+    @app.after_request
+    def count_request(response):
+        # The route pattern, not the path, so /jobs/<job_id> is one series
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.REQUESTS.inc(endpoint=endpoint, method=request.method, status=str(response.status_code))
+        if "started" in g:
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.started, endpoint=endpoint)
+        return response
+
+    @app.get("/metrics")
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
     @app.get("/health")
     def health():
-        return jsonify({"status": "ok", "service": "pddl_online_grader"})
+        # 503 until the reference bundles are loaded and checked (or if one is broken)
+        status = REFERENCES.status([REFERENCE_LOC])
+        body = {"status": "ok" if status == "ready" else status, "service": "pddl_online_grader",
+                "references": REFERENCES.snapshot(), "assignments": ASSIGNMENTS.snapshot(),
+                "result_cache": RESULT_CACHE.snapshot(), "sas_cache": planner.SAS_CACHE.snapshot(), "resources": RESOURCE_STATS.snapshot(),
+                "scheduler": scheduler.SCHEDULER.snapshot()}
+        return jsonify(body), 200 if status == "ready" else 503
 
     @app.post("/grade")
     def grade():
@@ -46,6 +135,8 @@ def create_app() -> Flask:
           "problem": "<PDDL problem text>",    # required
           "problem_id": "1|2|3"                # required
         }
+        With ?async=1 the request is queued and 202 {"job_id": ...} is returned right away
+        (429 if the queue is full); poll GET /jobs/<job_id> for the result.
         """
         # 1) Parse & validate inputs
         try:
@@ -61,12 +152,15 @@ def create_app() -> Flask:
             return _bad_request("Missing required field: 'domain' (non-empty string).")
         if problem is None or not problem.strip():
             return _bad_request("Missing required field: 'problem' (non-empty string).")
-        if problem_id not in ["1", "2", "3"]:
-            return _bad_request("Field 'problem_id' must be '1', '2', or '3'.")
+        problem_ids = _problem_ids(REFERENCE_LOC)
+        if problem_id not in problem_ids:
+            return _bad_request(f"Field 'problem_id' must be {_one_of(problem_ids)}.")
 
         # 2) Run your grading / validation pipeline
+        if _wants_async():
+            return _submit_job(domain, problem, problem_id)
         try:
-            result = run_grader(domain=domain, problem=problem, problem_id=problem_id)
+            result = run_grader_cached(domain=domain, problem=problem, problem_id=problem_id)
         except StudentInputError as e:
             # errors caused by bad student input -> 400
             return _bad_request(str(e))
@@ -86,47 +180,40 @@ def create_app() -> Flask:
             files['domain']  : required
             files['problem'] : required
             form['problem_id']: required ('1', '2', or '3')
+        With ?async=1 the request is queued instead; see /grade.
         """
-        plan = None
-        domain = None
-        problem = None
-        problem_id = None
-
-        if request.is_json:
-            try:
-                payload = request.get_json(force=True, silent=False)
-            except Exception:
-                return _bad_request("Body must be valid JSON with domain/problem/problem_id.")
-            domain = payload.get("domain")
-            problem = payload.get("problem")
-            problem_id = payload.get("problem_id")
-        else:
-            # Multipart form-data path
-            domain_file = request.files.get("domain")
-            problem_file = request.files.get("problem")
-            problem_id = request.form.get("problem_id")
-
-            if domain_file:
-                domain = domain_file.read().decode("utf-8", errors="replace")
-            if problem_file:
-                problem = problem_file.read().decode("utf-8", errors="replace")
-
-        # Basic validations aligned with test client
-        if domain is None or not str(domain).strip():
-            return _bad_request("Missing required field: 'domain'.")
-        if problem is None or not str(problem).strip():
-            return _bad_request("Missing required field: 'problem'.")
-        if not problem_id or problem_id not in ["1", "2", "3"]:
-            return _bad_request("Field 'problem_id' must be '1', '2', or '3'.")
+        return _grade_upload(REFERENCE_LOC)
 
-        try:
-            result = run_grader(domain=domain, problem=problem, problem_id=problem_id)
-        except StudentInputError as e:
-            return _bad_request(str(e))
-        except Exception:
-            return _server_error("Internal error during grading.")
+    @app.get("/assignments")
+    def list_assignments():
+        """The assignments found under ASSIGNMENTS_ROOT (see assignments.py) and which are loaded."""
+        return jsonify(ASSIGNMENTS.snapshot()), 200
 
-        return jsonify(result), 200
+    @app.post("/assignments/<name>/grade")
+    def grade_assignment(name):
+        """
+        /grade-file against the reference of assignment <name> (data/<name>/reference), whose
+        problems it takes as problem_id. The reference is loaded on the first request.
+        """
+        if ASSIGNMENTS.folder(name) is None:
+            return jsonify({"error": "NotFound", "message": f"No such assignment: {name}"}), 404
+        bundle = ASSIGNMENTS.bundle(name)
+        return _grade_upload(bundle.folder)
+
+    @app.get("/jobs/<job_id>")
+    def job_status(job_id):
+        """
+        Status of a job submitted with ?async=1. Pass ?wait=<seconds> (max 30) to long-poll
+        until the job finishes.
+        """
+        try:
+            wait = min(float(request.args.get("wait", "0")), JOB_MAX_WAIT_SEC)
+        except ValueError:
+            return _bad_request("Query parameter 'wait' must be a number of seconds.")
+        job = JOBS.wait(job_id, timeout=wait)
+        if job is None:
+            return jsonify({"error": "NotFound", "message": f"No such job: {job_id}"}), 404
+        return jsonify(job.to_dict()), 200
 
     # Global error handler (nicer JSON errors)
     @app.errorhandler(Exception)
@@ -161,9 +248,11 @@ class StudentInputError(Exception):
     pass
 
 
-def run_grader(*, domain: Optional[str], problem: Optional[str], problem_id: str) -> Dict[str, Any]:
+def run_grader(*, domain: Optional[str], problem: Optional[str], problem_id: str,
+               reference_dir: Optional[str] = None) -> Dict[str, Any]:
     """
-    Core grading logic: validate a PDDL plan using the Grader class.
+    Core grading logic: validate a PDDL plan using the Grader class, against the reference
+    files in reference_dir (REFERENCE_LOC if None).
     """
     # --- Basic input checks ---
     if domain is None or not domain.strip():
@@ -171,37 +260,235 @@ def run_grader(*, domain: Optional[str], problem: Optional[str], problem_id: str
     if problem is None or not problem.strip():
         raise StudentInputError("Problem file is required.")
 
-    # --- Setup temporary directory for grading ---
-    reference_dir = REFERENCE_LOC
-    grader = Grader(reference_dir)
+    reference_dir = reference_dir or REFERENCE_LOC
+    grader = Grader(reference_dir, validator=VALIDATOR, alignment_search=ALIGNMENT_SEARCH,
+                    alignment_precheck=ALIGNMENT_PRECHECK, log_dir=GRADER_LOG_DIR,
+                    plan_portfolio=PLAN_PORTFOLIO, alignment_portfolio=ALIGNMENT_PORTFOLIO,
+                    alignment_decompose=ALIGNMENT_DECOMPOSE, decompose_config=ALIGNMENT_DECOMPOSE_CONFIG)
 
-    # 1) Generate a plan using submitted domain/problem
-    plan_gen = grader.generate_plan(domain, problem, timeout=30, optimal=False)
+    # --- Milliseconds in-process: a submission merge would reject never gets to the planner ---
+    check = _timed("preflight", lambda r: grader.preflight(domain, problem, problem_id))({}) if PREFLIGHT else None
+    if check is not None and not check["ok"]:
+        metrics.PREFLIGHT_REJECTIONS.inc(check=check["errors"][0]["check"])
+        return {
+            "ok": False,
+            "error": "Pre-flight check failed",
+            "preflight": check,
+        }
+
+    # --- One scratch directory for all stages: the submission is written to it once ---
+    with workspace.Workspace() as ws:
+        # Only the student-plan-on-reference validation needs the generated plan; the
+        # reference-plan-on-student validation and the alignment check start right away,
+        # and are stopped (cancel) if no plan can be generated or a stage fails. An alignment
+        # merge already in a merge_pool worker still runs to its end.
+        cancel = threading.Event()
+        stages = [
+            # 1) Generate a plan using submitted domain/problem
+            Stage("generate_plan",
+                  _timed("generate_plan", lambda r: grader.generate_plan(domain, problem, timeout=30, optimal=False, ws=ws))),
+            # 2) Validate both directions
+            Stage("student_plan_on_reference",
+                  _timed("student_plan_on_reference",
+                         lambda r: grader.validate_student_plan(r["generate_plan"].get("plan", ""), problem_id, ws=ws)),
+                  deps=["generate_plan"]),
+            Stage("reference_plan_on_student",
+                  _timed("reference_plan_on_student",
+                         lambda r: grader.validate_reference_plan(domain, problem, problem_id, ws=ws, cancel=cancel))),
+            # 3) Check alignment
+            Stage("alignment", _timed("alignment",
+                                      lambda r: grader.check_alignment(domain, problem, problem_id, ws=ws, cancel=cancel))),
+        ]
+        results = run_stages(stages, abort=lambda name, res: name == "generate_plan" and not res.get("ok"),
+                             cancel=cancel)
+    _record_stats(results)
+
+    plan_gen = results["generate_plan"]
     if not plan_gen.get("ok"):
         return {
             "ok": False,
             "error": "Plan generation failed",
             "planning": plan_gen,
         }
-    plan_text = plan_gen.get("plan", "")
-
-    # 2) Validate both directions
-    validation = grader.validate_submission(domain, problem, plan_text, problem_id)
 
-    # 3) Check alignment
-    alignment = grader.check_alignment(domain, problem, problem_id)
+    validation = {
+        "student_plan_on_reference": results["student_plan_on_reference"],
+        "reference_plan_on_student": results["reference_plan_on_student"],
+    }
+    alignment = results["alignment"]
 
     return {
         "ok": bool(validation.get("student_plan_on_reference", {}).get("ok") and validation.get("reference_plan_on_student", {}).get("ok")),
         "planning": plan_gen,
         "validation": validation,
         "alignment": alignment,
+        "preflight": check,
     }
 
 
+def run_grader_cached(*, domain: Optional[str], problem: Optional[str], problem_id: str,
+                      reference_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    run_grader behind RESULT_CACHE. Results are keyed on the submitted text, the problem id,
+    the reference files for that problem and PLANNER_CONFIG. Runs that hit a time or memory
+    limit are not stored since they may well finish next time.
+    """
+    if domain is None or not domain.strip() or problem is None or not problem.strip():
+        return run_grader(domain=domain, problem=problem, problem_id=problem_id, reference_dir=reference_dir)
+
+    reference_dir = reference_dir or REFERENCE_LOC
+    ref_fp = RESULT_CACHE.fingerprint(Grader(reference_dir).reference_files(problem_id))
+    scope = f"{os.path.abspath(reference_dir)}:{problem_id}"
+    key = RESULT_CACHE.make_key(domain, problem, problem_id, ref_fp, PLANNER_CONFIG)
+
+    cached = RESULT_CACHE.get(key, scope, ref_fp)
+    metrics.CACHE_REQUESTS.inc(cache="result", result="miss" if cached is None else "hit")
+    if cached is not None:
+        return cached
+
+    result = run_grader(domain=domain, problem=problem, problem_id=problem_id, reference_dir=reference_dir)
+    if _cacheable(result):
+        RESULT_CACHE.put(key, scope, ref_fp, result)
+    return result
+
+
+# Planner outcomes (planner.outcome) that may turn out differently on a retry
+_RESOURCE_LIMIT_OUTCOMES = {"out_of_time", "out_of_memory"}
+
+
+def _cacheable(result: Dict[str, Any]) -> bool:
+    if result.get("alignment", {}).get("timed_out"):
+        return False
+    if result.get("alignment", {}).get("planner_outcome") in _RESOURCE_LIMIT_OUTCOMES:
+        return False
+    return result.get("planning", {}).get("outcome") not in _RESOURCE_LIMIT_OUTCOMES
+
+
+def _timed(stage: str, func):
+    """func, observed into metrics.STAGE_SECONDS under stage."""
+    def run(results):
+        t0 = time.perf_counter()
+        try:
+            return func(results)
+        finally:
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - t0, stage=stage)
+    return run
+
+
+def _record_stats(results: Dict[str, Any]) -> None:
+    """
+    Add each stage's resource usage to RESOURCE_STATS (served on /health), and its timeouts,
+    cache use and sub-stage latencies to the /metrics counters.
+    """
+    plan_gen = results.get("generate_plan")
+    if plan_gen:
+        RESOURCE_STATS.record("generate_plan", plan_gen.get("resources"), plan_gen.get("outcome"))
+        metrics.CACHE_REQUESTS.inc(cache="sas", result="hit" if plan_gen.get("sas_cached") else "miss")
+        if plan_gen.get("outcome") == "out_of_time":
+            metrics.TIMEOUTS.inc(stage="generate_plan")
+    for name in ("student_plan_on_reference", "reference_plan_on_student"):
+        res = results.get(name)
+        if res:
+            RESOURCE_STATS.record(f"validate.{res.get('validator')}", res.get("resources"),
+                                  "executed" if res.get("ok") else "failed")
+            if res.get("timed_out"):
+                metrics.TIMEOUTS.inc(stage=name)
+    alignment = results.get("alignment")
+    if alignment:
+        usage = alignment.get("resources") or {}
+        RESOURCE_STATS.record("alignment.merge", usage.get("merge"), alignment.get("engine"))
+        RESOURCE_STATS.record("alignment.planner", usage.get("planner"), alignment.get("planner_outcome"))
+        for stage, key in (("merge", "merge"), ("alignment_planning", "planner")):
+            if usage.get(key):
+                metrics.STAGE_SECONDS.observe(usage[key]["wall_sec"], stage=stage)
+        if alignment.get("timed_out"):
+            metrics.TIMEOUTS.inc(stage="merge" if alignment.get("engine") is None else "alignment_planning")
+
+
+def _run_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    return run_grader_cached(**payload)
+
+
+JOBS = JobQueue(_run_job, workers=GRADING_WORKERS, max_depth=JOB_QUEUE_DEPTH)
+metrics.Gauge("grader_job_queue_depth", "Jobs waiting in the ?async=1 queue.", func=lambda: JOBS.depth())
+metrics.Gauge("grader_references_ready", "1 once the reference bundles are loaded and checked.",
+              func=lambda: int(REFERENCES.ready([REFERENCE_LOC])))
+
+
 # -----------------------
 # Helpers
 # -----------------------
+def _wants_async() -> bool:
+    return request.args.get("async", "").lower() in ("1", "true", "yes")
+
+
+def _submit_job(domain: str, problem: str, problem_id: str, reference_dir: Optional[str] = None):
+    try:
+        job = JOBS.submit({"domain": domain, "problem": problem, "problem_id": problem_id,
+                           "reference_dir": reference_dir})
+    except QueueFull as e:
+        return jsonify({"error": "TooManyRequests", "message": str(e)}), 429, {"Retry-After": "30"}
+    return jsonify({"job_id": job.id, "status": job.status, "poll": f"/jobs/{job.id}"}), 202
+
+
+
+def _grade_upload(reference_dir: str):
+    """The /grade-file request handling (JSON or multipart), grading against reference_dir."""
+    domain = None
+    problem = None
+    problem_id = None
+
+    if request.is_json:
+        try:
+            payload = request.get_json(force=True, silent=False)
+        except Exception:
+            return _bad_request("Body must be valid JSON with domain/problem/problem_id.")
+        domain = payload.get("domain")
+        problem = payload.get("problem")
+        problem_id = payload.get("problem_id")
+    else:
+        # Multipart form-data path
+        domain_file = request.files.get("domain")
+        problem_file = request.files.get("problem")
+        problem_id = request.form.get("problem_id")
+
+        if domain_file:
+            domain = domain_file.read().decode("utf-8", errors="replace")
+        if problem_file:
+            problem = problem_file.read().decode("utf-8", errors="replace")
+
+    # Basic validations aligned with test client
+    if domain is None or not str(domain).strip():
+        return _bad_request("Missing required field: 'domain'.")
+    if problem is None or not str(problem).strip():
+        return _bad_request("Missing required field: 'problem'.")
+    problem_ids = _problem_ids(reference_dir)
+    if not problem_id or problem_id not in problem_ids:
+        return _bad_request(f"Field 'problem_id' must be {_one_of(problem_ids)}.")
+
+    if _wants_async():
+        return _submit_job(domain, problem, problem_id, reference_dir)
+    try:
+        result = run_grader_cached(domain=domain, problem=problem, problem_id=problem_id, reference_dir=reference_dir)
+    except StudentInputError as e:
+        return _bad_request(str(e))
+    except Exception:
+        return _server_error("Internal error during grading.")
+
+    return jsonify(result), 200
+
+
+def _problem_ids(reference_dir: str):
+    """The problem ids of reference_dir's bundle once it is loaded, the course's default ones until then."""
+    bundle = REFERENCES.get(reference_dir)
+    return bundle.problem_ids if bundle is not None and bundle.problem_ids else DEFAULT_PROBLEM_IDS
+
+
+def _one_of(values) -> str:
+    quoted = [f"'{v}'" for v in values]
+    return quoted[0] if len(quoted) == 1 else ", ".join(quoted[:-1]) + ", or " + quoted[-1]
+
+
 def _expect_str(obj: Dict[str, Any], key: str, *, required: bool) -> Optional[str]:
     val = obj.get(key)
     if val is None:
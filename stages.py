@@ -0,0 +1,63 @@
+"""
+A small dependency-aware executor for grading stages.
+
+Each Stage names the stages it depends on; a stage starts as soon as all of its
+dependencies have finished, so independent stages (e.g. plan generation, the reference
+plan check and the alignment check) run side by side.
+
+Usage:
+    results = run_stages([
+        Stage("plan", lambda r: make_plan()),
+        Stage("check", lambda r: check(r["plan"]), deps=["plan"]),
+    ])
+"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Stage:
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func  # called with a dict of the results finished so far
+        self.deps = tuple(deps)
+
+
+def run_stages(stages, *, max_workers=None, abort=None, cancel=None):
+    """
+    Run the stages, respecting their dependencies, and return {name: result}.
+
+    abort(name, result) is called for every finished stage; if it returns True nothing
+    else is started and run_stages returns right away with the results collected so far.
+    An exception raised by a stage is re-raised here, also right away. Whenever stages are
+    still running at that point, the threading.Event cancel is set, so stages that pass it on
+    to their planner and validator runs stop them instead of finishing in the background.
+    """
+    by_name = {s.name: s for s in stages}
+    for s in stages:
+        for dep in s.deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage {s.name!r} depends on unknown stage {dep!r}")
+
+    results = {}
+    pending = list(stages)
+    running = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(stages))
+    try:
+        while pending or running:
+            for s in [s for s in pending if all(d in results for d in s.deps)]:
+                pending.remove(s)
+                running[executor.submit(s.func, dict(results))] = s.name
+
+            if not running:
+                raise ValueError(f"Stages cannot be scheduled (cycle?): {[s.name for s in pending]}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = running.pop(fut)
+                results[name] = fut.result()
+                if abort is not None and abort(name, results[name]):
+                    return results
+        return results
+    finally:
+        if cancel is not None and any(not fut.done() for fut in running):
+            cancel.set()
+        executor.shutdown(wait=False, cancel_futures=True)
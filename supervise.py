@@ -0,0 +1,227 @@
+"""
+Run planner/VAL subprocesses with streamed, size-capped output capture.
+
+subprocess.run(capture_output=True) keeps everything a child prints in memory, and its
+timeout only kills the direct child (not e.g. the planner Singularity starts). run() here
+instead:
+
+- starts the child in its own process group, so a timeout kills the whole tree;
+- reads stdout/stderr line by line into ring buffers that keep only the last
+  MAX_CAPTURE_BYTES of each stream (and optionally copies every line to a log file);
+- remembers which of the `watch` strings appeared anywhere in the output, however long it
+  was, so verdicts do not depend on what the ring buffer still holds;
+- kills the child as soon as a line contains one of the `stop_on` strings, or when the
+  `cancel` event is set (e.g. because another planner in a portfolio answered first);
+- reports the child's CPU time and peak RSS from wait4() (resources.py).
+
+The last one goes through a small launcher (_LAUNCHER, run in a fresh interpreter) that
+forks the command, waits for it and writes its rusage to a pipe. wait4() on a process forked
+straight from the server would report the server's own peak RSS for it, since a forked
+process keeps its parent's high-water mark across exec().
+
+Usage:
+    res = supervise.run(FAST_DOWNWARD + [...], timeout=60, log_path="plan.log",
+                        stop_on=["Search stopped without finding a solution"])
+    res["stdout"], res["seen"], res["stopped_on"], res["timed_out"], res["resources"]
+"""
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+import types
+from collections import deque
+
+import resources
+
+MAX_CAPTURE_BYTES = int(os.environ.get("SUBPROCESS_CAPTURE_BYTES", 64 * 1024))
+MAX_LINE_BYTES = 64 * 1024
+KILL_GRACE_SEC = 2
+CANCEL_POLL_SEC = 0.05
+
+# argv: write fd, command... Ignores SIGTERM itself so that it can still report the rusage of
+# a command terminated by killpg(); exits the way the command did.
+_LAUNCHER = """
+import os, signal, sys
+fd, cmd = int(sys.argv[1]), sys.argv[2:]
+signal.signal(signal.SIGTERM, signal.SIG_IGN)
+pid = os.fork()
+if pid == 0:
+    os.close(fd)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        os.execvp(cmd[0], cmd)
+    except OSError as e:
+        os.write(2, f"{cmd[0]}: {e}\\n".encode())
+    os._exit(127)
+_, status, ru = os.wait4(pid, 0)
+os.write(fd, f"{status} {ru.ru_utime} {ru.ru_stime} {ru.ru_maxrss}".encode())
+if os.WIFSIGNALED(status):
+    signal.signal(os.WTERMSIG(status), signal.SIG_DFL)
+    os.kill(os.getpid(), os.WTERMSIG(status))
+os._exit(os.waitstatus_to_exitcode(status))
+"""
+
+
+class RingBuffer:
+    """The last max_bytes worth of lines, plus a count of what was dropped."""
+
+    def __init__(self, max_bytes=MAX_CAPTURE_BYTES):
+        self.max_bytes = max_bytes
+        self.lines = deque()
+        self.size = 0
+        self.dropped = 0
+
+    def append(self, line):
+        self.lines.append(line)
+        self.size += len(line)
+        while self.size > self.max_bytes and len(self.lines) > 1:
+            old = self.lines.popleft()
+            self.size -= len(old)
+            self.dropped += len(old)
+
+    def text(self):
+        body = b"".join(self.lines).decode("utf-8", errors="replace")
+        if self.dropped:
+            return f"[... {self.dropped} bytes omitted ...]\n" + body
+        return body
+
+
+def cap_text(text, max_bytes=MAX_CAPTURE_BYTES):
+    """text cut down to its last max_bytes, the same way run() caps a stream."""
+    data = (text or "").encode("utf-8")
+    if len(data) <= max_bytes:
+        return text or ""
+    return f"[... {len(data) - max_bytes} bytes omitted ...]\n" + data[-max_bytes:].decode("utf-8", errors="replace")
+
+
+def run(cmd, *, timeout, watch=(), stop_on=(), log_path=None, max_bytes=MAX_CAPTURE_BYTES, cwd=None, cancel=None):
+    """
+    Run cmd and wait for it for at most timeout seconds, or until the threading.Event cancel
+    is set. Returns a dict with keys: returncode, stdout, stderr (capped text), seen (the
+    watch/stop_on strings that appeared), stopped_on (the stop_on string that ended the run,
+    or None), timed_out, cancelled, duration_sec, log_path, resources (a resources.py usage
+    dict; None if the child could not be reaped).
+    """
+    t0 = time.time()
+    patterns = list(dict.fromkeys(list(watch) + list(stop_on)))
+    seen = set()
+    state = {"stopped_on": None}
+    lock = threading.Lock()
+    finished = threading.Event()
+    exited = threading.Event()
+    reaped = {"status": None, "rusage": None}
+
+    # The launcher cannot raise it, so check up front as Popen would
+    exe = cmd[0] if cwd is None or os.sep not in cmd[0] else os.path.join(cwd, cmd[0])
+    if shutil.which(exe) is None:
+        raise FileNotFoundError(f"No such executable: {cmd[0]}")
+    log = open(log_path, "ab") if log_path else None
+    report_r, report_w = os.pipe()
+    try:
+        proc = subprocess.Popen([sys.executable, "-I", "-S", "-c", _LAUNCHER, str(report_w)] + list(cmd),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL,
+                                cwd=cwd, start_new_session=True, pass_fds=(report_w,))
+    except BaseException:
+        os.close(report_r)
+        if log is not None:
+            log.close()
+        raise
+    finally:
+        os.close(report_w)
+    buffers = {"stdout": RingBuffer(max_bytes), "stderr": RingBuffer(max_bytes)}
+
+    def reader(stream, buf):
+        for line in iter(lambda: stream.readline(MAX_LINE_BYTES), b""):
+            buf.append(line)
+            text = line.decode("utf-8", errors="replace")
+            with lock:
+                if log is not None:
+                    log.write(line)
+                for p in patterns:
+                    if p in text:
+                        seen.add(p)
+                        if p in stop_on and state["stopped_on"] is None:
+                            state["stopped_on"] = p
+                            finished.set()
+        stream.close()
+
+    threads = [threading.Thread(target=reader, args=(proc.stdout, buffers["stdout"]), daemon=True),
+               threading.Thread(target=reader, args=(proc.stderr, buffers["stderr"]), daemon=True)]
+    for t in threads:
+        t.start()
+
+    def waiter():
+        # Popen's own wait methods are never used, so this is the only place the launcher is
+        # reaped
+        try:
+            _, status, ru = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            reaped.update(status=status, rusage=ru, wall=time.time() - t0)
+        except ChildProcessError:
+            pass
+        with os.fdopen(report_r, "rb") as f:
+            reaped["report"] = f.read().split()
+        exited.set()
+        # Done once the child has exited; a background grandchild still holding the pipes
+        # open gets a short grace period, not the whole timeout
+        grace_end = time.time() + KILL_GRACE_SEC
+        for t in threads:
+            t.join(max(0, grace_end - time.time()))
+        finished.set()
+
+    threading.Thread(target=waiter, daemon=True).start()
+
+    if cancel is None:
+        timed_out = not finished.wait(timeout)
+    else:
+        deadline = t0 + timeout
+        while not (finished.is_set() or cancel.is_set()) and time.time() < deadline:
+            finished.wait(min(CANCEL_POLL_SEC, max(0, deadline - time.time())))
+        timed_out = not finished.is_set() and not cancel.is_set()
+    cancelled = not finished.is_set() and not timed_out
+    # Whatever is left of the process group goes: the command itself on a timeout or stop
+    # line, stray grandchildren otherwise
+    _kill_group(proc, exited)
+    for t in threads:
+        t.join(KILL_GRACE_SEC)
+    exited.wait(KILL_GRACE_SEC)
+    with lock:
+        if log is not None:
+            log.close()
+            log = None
+
+    usage = None
+    if reaped.get("report"):
+        status, utime, stime, maxrss = reaped["report"]
+        ru = types.SimpleNamespace(ru_utime=float(utime), ru_stime=float(stime), ru_maxrss=int(maxrss))
+        usage = resources.from_rusage(ru, reaped["wall"], int(status))
+    elif reaped["rusage"] is not None:
+        # The launcher was killed before the command: its own CPU time is all there is, and
+        # its peak RSS is the server's (see above)
+        usage = resources.from_rusage(reaped["rusage"], reaped["wall"], reaped["status"])
+        usage["max_rss_mb"] = None
+    return {
+        "returncode": proc.returncode,
+        "stdout": buffers["stdout"].text(),
+        "stderr": buffers["stderr"].text(),
+        "seen": sorted(seen),
+        "stopped_on": state["stopped_on"],
+        "timed_out": timed_out,
+        "cancelled": cancelled,
+        "duration_sec": time.time() - t0,
+        "log_path": log_path,
+        "resources": usage,
+    }
+
+
+def _kill_group(proc, exited):
+    try:
+        if not exited.is_set():
+            os.killpg(proc.pid, signal.SIGTERM)
+            exited.wait(KILL_GRACE_SEC)
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
@@ -0,0 +1,74 @@
+import threading
+import time
+
+from admission import AdmissionController
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_rate_limit_per_client():
+    ac = AdmissionController(10, burst=2, refill_sec=3600)
+    assert ac.acquire("a")
+    assert ac.acquire("a")
+    assert not ac.acquire("a")
+    assert ac.acquire("b")
+
+
+def test_waiting_requests_are_served_round_robin():
+    ac = AdmissionController(1, burst=10, max_wait=10)
+    assert ac.acquire("holder")
+    granted = []
+
+    def request(client):
+        if ac.acquire(client):
+            granted.append(client)
+
+    threads = []
+    # a queues two requests before b queues one: b still gets the second slot
+    for n, client in enumerate(["a", "a", "b"], 1):
+        t = threading.Thread(target=request, args=(client,))
+        t.start()
+        threads.append(t)
+        wait_for(lambda: ac.snapshot()["queued"] == n)
+
+    for n in range(1, 4):
+        ac.release()
+        wait_for(lambda: len(granted) == n)
+    for t in threads:
+        t.join()
+    assert granted == ["a", "b", "a"]
+    assert ac.snapshot() == {"active": 1, "queued": 0, "max_concurrent": 1, "clients": 3}
+
+
+def test_wait_times_out():
+    ac = AdmissionController(1, burst=10, max_wait=0.2)
+    assert ac.acquire("a")
+    t0 = time.time()
+    assert not ac.acquire("b")
+    assert 0.2 <= time.time() - t0 < 2
+    assert ac.snapshot()["queued"] == 0
+    # the slot taken before is still there to hand on
+    ac.release()
+    assert ac.acquire("b")
+
+
+def test_timed_out_request_keeps_its_token():
+    ac = AdmissionController(1, burst=1, refill_sec=3600, max_wait=0.1)
+    assert ac.acquire("a")
+    assert not ac.acquire("b")
+    ac.release()
+    assert ac.acquire("b")
+
+
+def test_full_queue_rejects_and_refunds():
+    ac = AdmissionController(1, burst=1, refill_sec=3600, max_queue=0)
+    assert ac.acquire("a")
+    assert not ac.acquire("b")
+    ac.release()
+    # b's token was given back when the queue turned it away
+    assert ac.acquire("b")
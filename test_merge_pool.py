@@ -0,0 +1,26 @@
+import threading
+import time
+
+import merge_pool
+
+
+def test_concurrent_broadcasts_do_not_deadlock():
+    pool = merge_pool.WorkerPool(2)
+    try:
+        results = []
+
+        def broadcast():
+            results.append(pool.broadcast(time.sleep, 0.2, timeout=30))
+
+        threads = [threading.Thread(target=broadcast, daemon=True) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(60)
+        assert not any(t.is_alive() for t in threads)
+        assert len(results) == 4
+        assert all(len(r) == 2 and all(ok for ok, _, _, _ in r) for r in results)
+        # and the pool still serves calls
+        assert pool.call(sum, [1, 2], timeout=30)[:2] == (True, 3)
+    finally:
+        pool.close()
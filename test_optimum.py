@@ -0,0 +1,106 @@
+import json
+import os
+import sys
+
+import pytest
+
+import grade
+import optimum
+import planner
+import scheduler
+
+DOMAIN = "(define (domain d) (:predicates (p)) (:action a :parameters () :precondition () :effect (p)))"
+PROBLEM = "(define (problem q) (:domain d) (:init) (:goal (p)))"
+
+# A stand-in for Fast Downward: translates to an empty task, "finds" a plan of cost 9 and records each search
+FAST_DOWNWARD = """
+import sys
+args = sys.argv[2:]
+if "--translate" in args:
+    open(args[args.index("--sas-file") + 1], "w").write("begin_version\\n")
+else:
+    open(sys.argv[1], "a").write(" ".join(args) + "\\n")
+    open(args[args.index("--plan-file") + 1], "w").write("(a)\\n; cost = 9 (general cost)\\n")
+"""
+
+# A stand-in for planoptimal.sh: records its arguments and writes a plan costing the bound (12 without one)
+PLANOPTIMAL = """#!/bin/bash
+echo "$@" >> searches
+printf '(a)\\n; cost = %s (general cost)\\n' "${5:-12}" > "$1"
+"""
+
+
+@pytest.fixture
+def fd(tmp_path, monkeypatch):
+    script = tmp_path / "fd.py"
+    script.write_text(FAST_DOWNWARD)
+    searches = tmp_path / "fd-searches"
+    searches.touch()
+    monkeypatch.setattr(planner, "FAST_DOWNWARD", [sys.executable, str(script), str(searches)])
+    monkeypatch.setattr(planner, "SAS_CACHE", planner.TranslationCache(str(tmp_path / "sas")))
+    monkeypatch.setattr(scheduler, "SCHEDULER", scheduler.Scheduler(str(tmp_path / "sched"), enabled=False))
+    return searches
+
+
+@pytest.fixture
+def asg(tmp_path):
+    asg = grade.Assignment(str(tmp_path / "reference"), str(tmp_path / "submissions"), str(tmp_path / "marking"))
+    for folder in [asg.reference, f"{asg.submissions}/1", f"{asg.marking}/1"]:
+        os.makedirs(folder)
+    for folder in [asg.reference, f"{asg.submissions}/1"]:
+        with open(f"{folder}/domain.pddl", "w") as f:
+            f.write(DOMAIN)
+        with open(f"{folder}/p04.pddl", "w") as f:
+            f.write(PROBLEM)
+    return asg
+
+
+def test_reference_cost_is_computed_once(fd, asg):
+    assert optimum.reference_cost(asg.reference, "p04.pddl") == 9
+    assert optimum.reference_cost(asg.reference, "p04.pddl") == 9
+    # the reference run itself is not bounded
+    searches = fd.read_text().splitlines()
+    assert len(searches) == 1
+    assert f"--alias {planner.ALIASES[True]}" in searches[0]
+    with open(os.path.join(asg.reference, optimum.CACHE_FILE)) as f:
+        entry = json.load(f)["p04.pddl"]
+    assert (entry["cost"], entry["outcome"]) == (9, "plan")
+
+
+def test_edited_reference_is_planned_on_again(fd, asg):
+    optimum.reference_cost(asg.reference, "p04.pddl")
+    with open(f"{asg.reference}/p04.pddl", "w") as f:
+        f.write(PROBLEM.replace("(problem q)", "(problem r)"))
+    optimum.reference_cost(asg.reference, "p04.pddl")
+    assert len(fd.read_text().splitlines()) == 2
+
+
+def test_missing_reference_problem(fd, asg):
+    assert optimum.reference_cost(asg.reference, "p05.pddl") is None
+    assert fd.read_text() == ""
+
+
+def test_deviation():
+    assert optimum.deviation(11, 9) == 2
+    assert optimum.deviation(None, 9) is None
+    assert optimum.deviation(11, None) is None
+
+
+def test_check_optimal_is_bounded(fd, asg, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "planoptimal.sh").write_text(PLANOPTIMAL)
+    (tmp_path / "planoptimal.sh").chmod(0o755)
+    res = grade.check_optimal(asg, "1", "p04.pddl")
+    assert res == {"solved": True, "cost": 9, "reference_cost": 9, "deviation": 0, "costlier": False}
+    assert (tmp_path / "searches").read_text().split()[-1] == "9"
+
+
+def test_check_optimal_without_reference_problem(fd, asg, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "planoptimal.sh").write_text(PLANOPTIMAL)
+    (tmp_path / "planoptimal.sh").chmod(0o755)
+    os.remove(f"{asg.reference}/p04.pddl")
+    res = grade.check_optimal(asg, "1", "p04.pddl")
+    assert res == {"solved": True, "cost": 12, "reference_cost": None, "deviation": None, "costlier": False}
+    # no bound: plan, domain, problem and time limit only
+    assert len((tmp_path / "searches").read_text().split()) == 4
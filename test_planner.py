@@ -0,0 +1,40 @@
+import pytest
+
+import planner
+
+
+@pytest.mark.parametrize("returncode, expected", [
+    (0, "plan"),
+    (1, "plan_at_limit"), (2, "plan_at_limit"), (3, "plan_at_limit"),
+    (10, "unsolvable"), (11, "unsolvable"),
+    (12, "exhausted"),
+    (20, "out_of_memory"), (22, "out_of_memory"), (24, "out_of_memory"),
+    (21, "out_of_time"), (23, "out_of_time"),
+    (30, "error"), (35, "error"), (-9, "error"), (None, "error"),
+])
+def test_outcome(returncode, expected):
+    assert planner.outcome(returncode) == expected
+
+
+def test_outcome_of_stopped_runs():
+    # killed at the unsolvability line or at the supervisor's deadline, before the driver set its exit code
+    assert planner.outcome(None, unsolvable=True) == "exhausted"
+    assert planner.outcome(-9, timed_out=True) == "out_of_time"
+    assert planner.outcome(None, timed_out=True, unsolvable=True) == "exhausted"
+    # the exit code wins when there is one
+    assert planner.outcome(22, timed_out=True) == "out_of_memory"
+
+
+def test_plan_cost():
+    assert planner.plan_cost("(a)\n(b)\n; cost = 7 (general cost)\n") == 7
+    assert planner.plan_cost("(a)\n(b)\n(c)\n") == 3
+    assert planner.plan_cost("") is None
+
+
+def test_solve_config_bound():
+    assert planner.solve_config() == (["--alias", planner.ALIASES[False]], [])
+    assert planner.solve_config(optimal=True) == (["--alias", planner.ALIASES[True]], [])
+    # the bound is exclusive: plans costing exactly max_cost are still found
+    driver_args, search_args = planner.solve_config(optimal=True, max_cost=9)
+    assert driver_args == []
+    assert search_args[0] == "--search" and search_args[1].endswith(",bound=10)")
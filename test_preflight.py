@@ -0,0 +1,65 @@
+import copy
+
+import preflight
+
+REFERENCE = {
+    "domain_name": "rover",
+    "problem_name": "roverprob1",
+    "constants": {"rover0": "rover", "waypoint0": "waypoint"},
+    "sorts": {"object": None, "rover": "object", "waypoint": "object"},
+    "predicates": {"at": 2},
+    "actions": {"navigate": [["?x", "rover"], ["?y", "waypoint"], ["?z", "waypoint"]],
+                "drop": [["?x", "rover"]]},
+}
+
+
+def submitted(**changes):
+    sig = copy.deepcopy(REFERENCE)
+    sig.update(changes)
+    return sig
+
+
+def test_same_signature_passes():
+    assert preflight.diff(REFERENCE, submitted()) == ([], [])
+
+
+def test_predicates_are_not_compared():
+    assert preflight.diff(REFERENCE, submitted(predicates={"at": 2, "visited": 1})) == ([], [])
+
+
+def test_names_must_match():
+    errors, _ = preflight.diff(REFERENCE, submitted(domain_name="Rover", problem_name="p1"))
+    assert [(e["check"], e["expected"], e["found"]) for e in errors] == [
+        ("domain_name", "rover", "Rover"), ("problem_name", "roverprob1", "p1")]
+
+
+def test_missing_and_extra_actions():
+    errors, _ = preflight.diff(REFERENCE, submitted(actions={"navigate": REFERENCE["actions"]["navigate"],
+                                                             "sample": [["?x", "rover"]]}))
+    assert len(errors) == 1
+    assert errors[0]["check"] == "actions"
+    assert errors[0]["missing"] == ["drop"]
+    assert errors[0]["extra"] == ["sample"]
+
+
+def test_missing_constant():
+    errors, _ = preflight.diff(REFERENCE, submitted(constants={"rover0": "rover"}))
+    assert [(e["check"], e["missing"], e["extra"]) for e in errors] == [("constants", ["waypoint0"], [])]
+
+
+def test_action_parameters_must_match():
+    actions = copy.deepcopy(REFERENCE["actions"])
+    actions["navigate"][2] = ["?w", "waypoint"]
+    errors, _ = preflight.diff(REFERENCE, submitted(actions=actions))
+    assert len(errors) == 1
+    assert errors[0]["check"] == "parameters"
+    assert errors[0]["action"] == "navigate"
+    assert errors[0]["found"][2] == ["?w", "waypoint"]
+
+
+def test_types_only_warn():
+    sig = submitted(constants={"rover0": "object", "waypoint0": "waypoint"},
+                    sorts={"object": None, "rover": "waypoint", "waypoint": "object"})
+    errors, warnings = preflight.diff(REFERENCE, sig)
+    assert errors == []
+    assert [w["check"] for w in warnings] == ["constant_types", "type_parents"]
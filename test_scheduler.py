@@ -0,0 +1,109 @@
+import sys
+
+import pytest
+
+import planner
+import scheduler
+
+
+@pytest.fixture
+def sched(tmp_path):
+    return scheduler.Scheduler(str(tmp_path), memory_mb=1000, cpus=2, default_mb=400, enabled=True)
+
+
+def entry(ticket, memory_mb, state="waiting", cpus=1):
+    return {"pid": 1, "ticket": ticket, "key": None, "memory_mb": memory_mb, "cpus": cpus, "state": state,
+            "since": 0.0}
+
+
+def test_to_mb():
+    assert scheduler.to_mb("8G") == 8192
+    assert scheduler.to_mb("2730M") == 2730
+    assert scheduler.to_mb("512K") == 0.5
+    assert scheduler.to_mb("lots") is None
+
+
+def test_fits_alone_even_if_too_large(sched):
+    ledger = {"entries": {"me": entry(1, 5000)}}
+    assert sched._fits(ledger, "me")
+
+
+def test_fits_next_to_running(sched):
+    ledger = {"entries": {"run": entry(1, 600, "running"), "me": entry(2, 400)}}
+    assert sched._fits(ledger, "me")
+    ledger["entries"]["me"]["memory_mb"] = 401
+    assert not sched._fits(ledger, "me")
+
+
+def test_earlier_waiting_runs_come_first(sched):
+    # the large run that has waited longer keeps its place: the small one does not jump ahead
+    ledger = {"entries": {"run": entry(1, 300, "running"), "big": entry(2, 600), "me": entry(3, 200)}}
+    assert not sched._fits(ledger, "me")
+    # but a run queued later does not hold it back
+    ledger = {"entries": {"run": entry(1, 300, "running"), "me": entry(2, 200), "later": entry(3, 600)}}
+    assert sched._fits(ledger, "me")
+
+
+def test_cpus_are_limited(sched):
+    ledger = {"entries": {"a": entry(1, 10, "running"), "b": entry(2, 10, "running"), "me": entry(3, 10)}}
+    assert not sched._fits(ledger, "me")
+
+
+def test_estimate_without_history(sched):
+    assert sched.estimate_mb("k", "8G") == 400
+    # never more than the caller's limit, never less than MIN_MEMORY_MB
+    assert sched.estimate_mb("k", "300M") == 300
+    low = scheduler.Scheduler(sched.path, memory_mb=1000, cpus=2, default_mb=1, enabled=True)
+    assert low.estimate_mb("k", "8G") == scheduler.MIN_MEMORY_MB
+
+
+def test_estimate_from_history(sched):
+    sched.peaks.record("k", 500)
+    assert sched.estimate_mb("k", "8G") == 500 * scheduler.HEADROOM
+    assert sched.estimate_mb("k", "600M") == 600
+    sched.peaks.record("small", 10)
+    assert sched.estimate_mb("small", "8G") == scheduler.MIN_MEMORY_MB
+    # capped by the pool
+    sched.peaks.record("huge", 5000)
+    assert sched.estimate_mb("huge", "8G") == 1000
+
+
+def test_runs_cut_short_only_raise_the_estimate(sched):
+    with sched.reserve("k", "8G") as slot:
+        slot.record({"max_rss_mb": 40}, complete=False)
+    assert sched.peaks.peak("k") is None
+    with sched.reserve("k", "8G") as slot:
+        slot.record({"max_rss_mb": 300})
+    with sched.reserve("k", "8G") as slot:
+        slot.record({"max_rss_mb": 40}, complete=False)
+    assert sched.peaks.peak("k") == 300
+    with sched.reserve("k", "8G") as slot:
+        slot.record({"max_rss_mb": 500}, complete=False)
+    assert sched.peaks.peak("k") == 500
+
+
+def test_reserve_holds_and_frees_its_entry(sched):
+    with sched.reserve("k", "8G") as slot:
+        # the reservation is the estimate, the planner still gets the limit asked for
+        assert slot.memory_mb == 400
+        assert slot.memory_limit == "8G"
+        assert sched.snapshot()["reserved_memory_mb"] == 400
+        assert sched.snapshot()["running"] == 1
+    assert sched.snapshot()["running"] == 0
+
+
+def test_planner_gets_the_full_limit(sched, tmp_path, monkeypatch):
+    # a stand-in for Fast Downward that records its arguments and runs out of memory
+    fd = tmp_path / "fd.py"
+    fd.write_text("import sys\nopen(sys.argv[1], 'w').write(' '.join(sys.argv[2:]))\nsys.exit(22)\n")
+    args = tmp_path / "args"
+    monkeypatch.setattr(planner, "FAST_DOWNWARD", [sys.executable, str(fd), str(args)])
+    monkeypatch.setattr(scheduler, "SCHEDULER", sched)
+    sas = tmp_path / "output.sas"
+    sas.write_text("begin_version\n")
+    proc = planner.search(sas, tmp_path / "plan", ([], ["--search", "astar(blind())"]), timeout=10)
+    assert planner.outcome(proc["returncode"]) == "out_of_memory"
+    assert proc["memory_limit"] == planner.MEMORY_LIMIT
+    assert args.read_text().startswith(f"--overall-memory-limit {planner.MEMORY_LIMIT} ")
+    # a run that ran out of memory does not set the estimate
+    assert sched.peaks._load() == {}
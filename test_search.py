@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+import merge
+import search
+from validator import UnsupportedTask
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXAMPLE = os.path.join(HERE, "data", "example_2")
+PROBLEMS = ["p01.pddl", "p02.pddl", "p03.pddl"]
+
+DOMAIN = """
+(define (domain chain)
+  (:predicates (p0) (p1) (p2) (never))
+  (:action a1 :parameters () :precondition (p0) :effect (and (p1) (not (p0))))
+  (:action a2 :parameters () :precondition (p1) :effect (p2))
+  (:action a3 :parameters () :precondition (never) :effect (p0)))
+"""
+
+
+def chain(goal):
+    return merge.parse_pddl_text(DOMAIN, f"(define (problem c) (:domain chain) (:init (p0)) (:goal {goal}))")
+
+
+def merged(student, prob):
+    sub = os.path.join(EXAMPLE, "submissions", student)
+    with open(os.path.join(sub, "domain.pddl")) as d, open(os.path.join(sub, prob)) as p:
+        problem, _, _ = merge.merge_reference_problem(os.path.join(EXAMPLE, "reference", "domain.pddl"),
+                                                      os.path.join(EXAMPLE, "reference", prob), d.read(), p.read())
+    return problem
+
+
+def misaligned(student, prob):
+    """Whether the recorded grading run (marking/) found a mis-alignment plan."""
+    return os.path.isfile(os.path.join(EXAMPLE, "marking", student, f"plan.{prob}.merged"))
+
+
+def test_relaxed_layers():
+    reach = search.GroundTask(chain("(p2)")).relaxed_reachability()
+    assert reach["goal_layer"] == 2
+    assert sorted(reach["actions"].values()) == [1, 2]
+
+
+def test_relaxed_unreachable():
+    assert search.GroundTask(chain("(never)")).relaxed_reachability()["goal_layer"] is None
+    assert search.search(chain("(never)"))["status"] == "unreachable"
+
+
+@pytest.mark.parametrize("student", ["1", "2", "3", "4"])
+@pytest.mark.parametrize("prob", PROBLEMS)
+def test_relaxed_verdicts_on_corpus(student, prob):
+    problem = merged(student, prob)
+    reach = search.GroundTask(problem).relaxed_reachability()
+    res = search.search(problem, node_limit=300000, time_limit=30)
+    # The fail actions have negated preconditions, so (failed) stays reachable when deletes are
+    # ignored, and the search after the relaxed pass agrees with the recorded grading run
+    assert reach["goal_layer"] is not None
+    assert res["relaxed"]["goal_reachable"]
+    assert res["status"] == ("plan" if misaligned(student, prob) else "exhausted")
+    if res["status"] == "plan":
+        assert len(res["plan"].splitlines()) - 1 >= reach["goal_layer"]
+
+
+def test_unreachable_fail_actions_are_pruned():
+    res = search.search(merged("1", "p01.pddl"), node_limit=300000, time_limit=30)
+    assert res["status"] == "exhausted"
+    assert res["relaxed"]["unreachable_fail_schemas"] == ["fail_communicate_image_data1",
+                                                          "fail_communicate_image_data2"]
+    assert res["searched_actions"] < res["ground_actions"]
+
+
+def test_grounding_limits():
+    problem = merged("1", "p01.pddl")
+    with pytest.raises(UnsupportedTask):
+        search.search(problem, max_ground_actions=10)
+    with pytest.raises(UnsupportedTask):
+        search.search(problem, time_limit=0)
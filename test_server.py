@@ -0,0 +1,39 @@
+import pytest
+
+import server
+import workspace
+
+
+def merged(ok, log):
+    return {"ok": ok, "domain": "(define (domain m))", "problem": "(define (problem m))", "log": log,
+            "error": None if ok else "bad merge", "timed_out": False, "resources": None}
+
+
+@pytest.fixture
+def planned(monkeypatch):
+    """Stands in for plan.sh: the search ends without a plan, so the submission aligns."""
+    commands = []
+
+    def system(cmd):
+        commands.append(cmd)
+        with open(cmd.split(" > ")[1].split()[0], "w") as f:
+            f.write("Search stopped without finding a solution.\n")
+        return 0
+
+    monkeypatch.setattr(server.os, "system", system)
+    return commands
+
+
+def test_failed_merge(monkeypatch, planned):
+    monkeypatch.setattr(server.merge_pool, "run_merge", lambda *a, **kw: merged(False, "Error: bad merge\n"))
+    with workspace.Workspace() as ws:
+        assert server.check_alignment("p01", "", "", ws) == (False, None, "Error: bad merge\n")
+    assert planned == []
+
+
+def test_merge_log_mentioning_error(monkeypatch, planned):
+    # merge output that happens to say Error: the merge still succeeded
+    monkeypatch.setattr(server.merge_pool, "run_merge", lambda *a, **kw: merged(True, "Error handling kept\n"))
+    with workspace.Workspace() as ws:
+        assert server.check_alignment("p01", "", "", ws) == (True, None, None)
+    assert len(planned) == 1
@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+from stages import Stage, run_stages
+
+
+def waiter(cancel, stopped):
+    def run(results):
+        stopped.append(cancel.wait(10))
+        return "stopped"
+    return run
+
+
+def test_dependencies_and_results():
+    order = []
+    stages = [
+        Stage("b", lambda r: order.append("b") or r["a"] + 1, deps=["a"]),
+        Stage("a", lambda r: order.append("a") or 1),
+    ]
+    assert run_stages(stages) == {"a": 1, "b": 2}
+    assert order == ["a", "b"]
+
+
+def test_abort_cancels_running_stages():
+    cancel, stopped = threading.Event(), []
+    stages = [Stage("plan", lambda r: {"ok": False}), Stage("align", waiter(cancel, stopped))]
+    results = run_stages(stages, abort=lambda name, res: name == "plan" and not res["ok"], cancel=cancel)
+    assert results == {"plan": {"ok": False}}
+    assert cancel.wait(5)
+
+
+def test_failing_stage_cancels_running_stages():
+    cancel, stopped = threading.Event(), []
+
+    def fail(results):
+        raise RuntimeError("planner crashed")
+
+    with pytest.raises(RuntimeError):
+        run_stages([Stage("plan", fail), Stage("align", waiter(cancel, stopped))], cancel=cancel)
+    assert cancel.is_set()
+
+
+def test_cancel_left_alone_when_all_finished():
+    cancel = threading.Event()
+    run_stages([Stage("a", lambda r: 1), Stage("b", lambda r: 2)], cancel=cancel)
+    assert not cancel.is_set()
+
+
+def test_unknown_dependency():
+    with pytest.raises(ValueError):
+        run_stages([Stage("a", lambda r: 1, deps=["nope"])])
@@ -0,0 +1,79 @@
+import os
+import subprocess
+
+import pytest
+
+import merge
+import validator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA = os.path.join(HERE, "data")
+VARIANTS = ["as is", "truncated", "step 1 dropped", "steps 1/2 swapped"]
+
+# (executed, valid, failed_step) of every plan under data/ and its broken variants (see
+# validator._variants), as VAL gives them (python3 validator.py --compare)
+EXPECTED = {
+    "example_2/marking/1/plan.p01.pddl": [(True, False, None), (True, False, None), (False, False, 1), (False, False, 1)],
+    "example_2/marking/1/plan.p02.pddl": [(True, False, None), (True, False, None), (False, False, 1), (False, False, 1)],
+    "example_2/marking/1/plan.p03.pddl": [(True, False, None), (True, False, None), (False, False, 1), (False, False, 1)],
+    "example_2/marking/2/plan.p01.pddl": [(True, False, None), (True, False, None), (False, False, 1), (False, False, 1)],
+    "example_2/marking/2/plan.p02.pddl": [(True, False, None), (True, False, None), (False, False, 1), (False, False, 1)],
+    "example_2/marking/2/plan.p03.pddl": [(True, False, None), (True, False, None), (False, False, 1), (False, False, 1)],
+    "example_2/marking/3/plan.p01.pddl": [(False, False, 4), (False, False, 4), (False, False, 3), (False, False, 2)],
+    "example_2/marking/3/plan.p02.pddl": [(True, False, None), (True, False, None), (False, False, 1), (False, False, 1)],
+    "example_2/marking/3/plan.p03.pddl": [(False, False, 3), (False, False, 3), (False, False, 2), (False, False, 3)],
+    "example_2/marking/4/plan.p01.pddl": [(False, False, 1), (False, False, 1), (False, False, 1), (False, False, 1)],
+    "example_2/marking/4/plan.p02.pddl": [(True, False, None), (True, False, None), (False, False, 1), (False, False, 1)],
+    "example_2/marking/4/plan.p03.pddl": [(True, False, None), (True, False, None), (False, False, 1), (False, False, 1)],
+    "example_2/reference/plan.p01.pddl": [(True, True, None), (True, False, None), (False, False, 1), (False, False, 1)],
+    "example_2/reference/plan.p02.pddl": [(True, True, None), (True, False, None), (False, False, 1), (False, False, 1)],
+    "example_2/reference/plan.p03.pddl": [(True, True, None), (True, False, None), (False, False, 1), (False, False, 1)],
+    "queens_example/reference/plan.p01.pddl": [(True, True, None), (True, False, None), (False, False, 1), (False, False, 1)],
+    "queens_example/reference/plan.p02.pddl": [(True, True, None), (True, False, None), (False, False, 1), (False, False, 1)],
+    "queens_example/reference/plan.p03.pddl": [(True, True, None), (True, False, None), (False, False, 3), (False, False, 2)],
+    "reference/plan.p01.pddl": [(True, True, None), (True, False, None), (False, False, 1), (False, False, 1)],
+    "reference/plan.p02.pddl": [(True, True, None), (True, False, None), (False, False, 1), (False, False, 1)],
+    "reference/plan.p03.pddl": [(True, True, None), (True, False, None), (False, False, 1), (False, False, 1)],
+}
+
+
+def cases():
+    return {os.path.relpath(plan, DATA): (domain, problem, plan) for domain, problem, plan in validator._cases(DATA)}
+
+
+def val_available():
+    try:
+        out = subprocess.run([os.path.join(HERE, "val", "bin", "Validate")], capture_output=True, text=True).stdout
+    except OSError:
+        return False
+    return "VAL" in out
+
+
+def test_corpus_is_covered():
+    assert sorted(cases()) == sorted(EXPECTED)
+
+
+@pytest.mark.parametrize("plan", sorted(EXPECTED))
+def test_verdicts(plan):
+    domain, problem, plan_path = cases()[plan]
+    variants = list(validator._variants(merge._read(plan_path)))
+    assert [label for label, _ in variants] == VARIANTS
+    found = []
+    for _, text in variants:
+        res = validator.validate(merge._read(domain), merge._read(problem), text)
+        assert res["ok"] == ("Plan executed successfully" in res["stdout"])
+        found.append((res["ok"], res["valid"], res["failed_step"]))
+    assert found == EXPECTED[plan]
+
+
+@pytest.mark.skipif(not val_available(), reason="VAL is not installed")
+@pytest.mark.parametrize("plan", sorted(EXPECTED))
+def test_verdicts_match_val(plan, tmp_path):
+    domain, problem, plan_path = cases()[plan]
+    for label, text in validator._variants(merge._read(plan_path)):
+        path = tmp_path / "plan"
+        path.write_text(text)
+        out = subprocess.run(["./validate.sh", domain, problem, str(path)], capture_output=True, text=True,
+                             cwd=HERE).stdout
+        res = validator.validate(merge._read(domain), merge._read(problem), text)
+        assert (res["ok"], res["valid"]) == ("Plan executed successfully" in out, "Plan valid" in out), label
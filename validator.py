@@ -0,0 +1,409 @@
+"""
+In-process plan validator for the PDDL subset used in the course.
+
+validate.sh runs VAL in a fresh process for every check. For the subset the assignments
+use (typing, negative preconditions, equality, quantifiers, conditional effects) the
+same verdict can be computed directly from tarski's parsed task: only the actions named
+in the plan are grounded, facts are numbered and a state is a bitset of fact ids, so each
+plan step is a couple of integer operations plus evaluating the grounded precondition.
+
+The result dict has the same keys as Grader._validate (ok, returncode, stdout, stderr), with
+ok meaning "the plan executed" just like the "Plan executed successfully" check on VAL's
+output; valid additionally requires the goal to hold. On failure failed_step (1-based) and
+reason say which step failed and why.
+
+Tasks outside the subset (numeric fluents, durative actions, ...) raise UnsupportedTask; the
+caller is expected to fall back to VAL.
+
+Usage:
+    python3 validator.py <domain> <problem> <plan>
+    python3 validator.py --compare [<data_folder>]    (check verdicts against VAL)
+"""
+import hashlib
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+from tarski.fstrips import fstrips
+from tarski.syntax import formulas, terms
+from tarski.syntax.builtins import BuiltinPredicateSymbol, is_builtin_function, is_builtin_predicate
+
+import merge
+
+USAGE = """
+Usage: python3 validator.py <domain> <problem> <plan>
+       python3 validator.py --compare [<data_folder>]
+"""
+
+
+class UnsupportedTask(Exception):
+    pass
+
+
+# -----------------------
+# Grounded formulas: ("fact", id, text) | ("not", f, text) | ("and", [f], text) | ("or", [f], text) | ("const", bool, text)
+# -----------------------
+def holds(f, state):
+    kind = f[0]
+    if kind == "fact":
+        return state >> f[1] & 1 == 1
+    if kind == "not":
+        return not holds(f[1], state)
+    if kind == "and":
+        return all(holds(g, state) for g in f[1])
+    if kind == "or":
+        return any(holds(g, state) for g in f[1])
+    return f[1]
+
+
+def first_unsatisfied(f, state):
+    """Text of the first conjunct of f that does not hold, or None."""
+    for g in (f[1] if f[0] == "and" else [f]):
+        if not holds(g, state):
+            return g[2]
+    return None
+
+
+class GroundAction:
+    def __init__(self, text, pre, effects):
+        self.text = text
+        self.pre = pre
+        self.effects = effects  # [(condition or None, add_mask, del_mask)]
+
+    def apply(self, state):
+        adds = dels = 0
+        for cond, add, delete in self.effects:
+            if cond is None or holds(cond, state):
+                adds |= add
+                dels |= delete
+        return (state & ~dels) | adds
+
+
+class Task:
+    """A parsed domain/problem with facts numbered and plan actions grounded on demand."""
+
+    def __init__(self, problem):
+        self.problem = problem
+        lang = problem.language
+
+        for fn in lang.functions:
+            if not is_builtin_function(fn) and fn.name != "total-cost":
+                raise UnsupportedTask(f"numeric fluent {fn.name} is not supported")
+
+        self.objects = {c.symbol.lower(): c for c in lang.constants()}
+        self._domains = {}  # sort name -> [object names]
+        self._facts = {}  # (predicate, args) -> id
+        self.fact_keys = []  # id -> (predicate, args)
+        self._ground = {}  # (action, args) -> GroundAction
+        self._lock = threading.Lock()
+        self.actions = {name.lower(): a for name, a in problem.actions.items()}
+
+        self.init = 0
+        for atom in problem.init.as_atoms():
+            if not isinstance(atom, formulas.Atom):
+                continue  # (= (total-cost) 0)
+            self.init |= 1 << self.fact(atom.predicate.name, [t.symbol for t in atom.subterms])
+        self.goal = self.formula(problem.goal, {})
+
+    def fact(self, predicate, args):
+        key = (predicate.lower(), tuple(a.lower() for a in args))
+        fid = self._facts.get(key)
+        if fid is None:
+            with self._lock:
+                fid = self._facts.setdefault(key, len(self._facts))
+                if fid == len(self.fact_keys):
+                    self.fact_keys.append(key)
+        return fid
+
+    def ground(self, name, args):
+        """GroundAction for the plan step (name args...); raises ValueError if the step is malformed."""
+        key = (name.lower(), tuple(a.lower() for a in args))
+        action = self._ground.get(key)
+        if action is None:
+            action = self._ground_action(*key)
+            self._ground[key] = action
+        return action
+
+    def _ground_action(self, name, args):
+        text = "(" + " ".join((name,) + args) + ")"
+        schema = self.actions.get(name)
+        if schema is None:
+            raise ValueError(f"unknown action {name}")
+        params = schema.parameters.vars()
+        if len(params) != len(args):
+            raise ValueError(f"{name} takes {len(params)} arguments, got {len(args)}")
+        binding = {}
+        for var, arg in zip(params, args):
+            if arg not in self.objects:
+                raise ValueError(f"unknown object {arg}")
+            if arg not in self.objects_of(var.sort):
+                raise ValueError(f"object {arg} is not of type {var.sort.name}")
+            binding[var.symbol] = arg
+
+        effects = []
+        for eff in schema.effects:
+            self.effect(eff, binding, effects)
+        return GroundAction(text, self.formula(schema.precondition, binding), effects)
+
+    def objects_of(self, sort):
+        """Names of the objects of the given sort (subtypes included)."""
+        names = self._domains.get(sort.name)
+        if names is None:
+            names = self._domains[sort.name] = [c.symbol.lower() for c in sort.domain()]
+        return names
+
+    def _term(self, t, binding):
+        if isinstance(t, terms.Variable):
+            if t.symbol not in binding:
+                raise UnsupportedTask(f"free variable {t.symbol}")
+            return binding[t.symbol]
+        if isinstance(t, terms.Constant):
+            return t.symbol.lower()
+        raise UnsupportedTask(f"term {t} is not supported")
+
+    def formula(self, f, binding):
+        """Ground the tarski formula f under binding {variable: object} into the tuple form used by holds()."""
+        if isinstance(f, formulas.Tautology):
+            return ("const", True, "(and)")
+        if isinstance(f, formulas.Contradiction):
+            return ("const", False, "(or)")
+        if isinstance(f, formulas.Atom):
+            args = [self._term(t, binding) for t in f.subterms]
+            if is_builtin_predicate(f.predicate):
+                if f.predicate.symbol == BuiltinPredicateSymbol.EQ:
+                    return ("const", args[0] == args[1], f"(= {args[0]} {args[1]})")
+                if f.predicate.symbol == BuiltinPredicateSymbol.NE:
+                    return ("const", args[0] != args[1], f"(not (= {args[0]} {args[1]}))")
+                raise UnsupportedTask(f"predicate {f.predicate.symbol} is not supported")
+            name = f.predicate.name
+            return ("fact", self.fact(name, args), "(" + " ".join([name] + args) + ")")
+        if isinstance(f, formulas.CompoundFormula):
+            subs = [self.formula(g, binding) for g in f.subformulas]
+            c = f.connective
+            if c == formulas.Connective.Not:
+                return ("not", subs[0], f"(not {subs[0][2]})")
+            if c == formulas.Connective.And:
+                return ("and", subs, "(and " + " ".join(s[2] for s in subs) + ")")
+            if c == formulas.Connective.Or:
+                return ("or", subs, "(or " + " ".join(s[2] for s in subs) + ")")
+            raise UnsupportedTask(f"connective {c} is not supported")
+        if isinstance(f, formulas.QuantifiedFormula):
+            subs = [self.formula(f.formula, b) for b in self.bindings(f.variables, binding)]
+            kind = "and" if f.quantifier == formulas.Quantifier.Forall else "or"
+            return (kind, subs, f"({f.quantifier} ({' '.join(v.symbol for v in f.variables)}) ...)")
+        raise UnsupportedTask(f"formula {f} is not supported")
+
+    def bindings(self, variables, binding):
+        """binding extended in every possible way to the given (typed) variables."""
+        bindings = [dict(binding)]
+        for var in variables:
+            bindings = [dict(b, **{var.symbol: obj}) for b in bindings for obj in self.objects_of(var.sort)]
+        return bindings
+
+    def effect(self, eff, binding, out):
+        """Ground the effect under binding and append it to out as (condition or None, add_mask, del_mask)."""
+        if isinstance(eff, fstrips.UniversalEffect):
+            for b in self.bindings(eff.variables, binding):
+                for sub in eff.effects:
+                    self.effect(sub, b, out)
+            return
+        if isinstance(eff, fstrips.IncreaseEffect) and eff.lhs.symbol.name == "total-cost":
+            return
+        if not isinstance(eff, (fstrips.AddEffect, fstrips.DelEffect)):
+            raise UnsupportedTask(f"effect {eff} is not supported")
+        cond = None
+        if not isinstance(eff.condition, formulas.Tautology):
+            cond = self.formula(eff.condition, binding)
+        atom = self.formula(eff.atom, binding)
+        mask = 1 << atom[1]
+        if isinstance(eff, fstrips.AddEffect):
+            out.append((cond, mask, 0))
+        else:
+            out.append((cond, 0, mask))
+
+    def run(self, steps):
+        """Execute the plan steps [(line, name, args)] from the initial state."""
+        state = self.init
+        for i, (line, name, args) in enumerate(steps, start=1):
+            try:
+                action = self.ground(name, args)
+            except ValueError as e:
+                return _failed(i, line, str(e))
+            missing = first_unsatisfied(action.pre, state)
+            if missing is not None:
+                return _failed(i, line, f"unsatisfied precondition {missing}")
+            state = action.apply(state)
+
+        missing = first_unsatisfied(self.goal, state)
+        return {
+            "executed": True,
+            "valid": missing is None,
+            "steps": len(steps),
+            "failed_step": None,
+            "reason": None if missing is None else f"goal not satisfied: {missing}",
+        }
+
+
+def _failed(i, line, reason):
+    return {"executed": False, "valid": False, "steps": i - 1, "failed_step": i, "failed_action": line, "reason": reason}
+
+
+# -----------------------
+# Plans
+# -----------------------
+_STEP = re.compile(r"^\s*(?:[\d.]+\s*:\s*)?\(\s*([^()]*?)\s*\)\s*(?:\[[\d.]+\])?\s*$")
+
+
+def parse_plan(plan_text):
+    """[(line, name, args)] for each action in a plan file; raises ValueError on a malformed line."""
+    steps = []
+    for line in (plan_text or "").splitlines():
+        line = line.split(";", 1)[0].strip()
+        if not line:
+            continue
+        m = _STEP.match(line)
+        if m is None or not m.group(1):
+            raise ValueError(f"bad plan line: {line}")
+        name, *args = m.group(1).split()
+        steps.append((line, name, tuple(args)))
+    return steps
+
+
+# -----------------------
+# Entry points
+# -----------------------
+class TaskCache:
+    """Small LRU of parsed tasks by content hash; the reference files are validated against over and over."""
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._tasks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, domain_text, problem_text):
+        key = hashlib.sha256(f"{domain_text}\0{problem_text}".encode("utf-8")).hexdigest()
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is not None:
+                self._tasks.move_to_end(key)
+                return task
+        task = load_task(domain_text, problem_text)
+        with self._lock:
+            self._tasks[key] = task
+            while len(self._tasks) > self.maxsize:
+                self._tasks.popitem(last=False)
+        return task
+
+
+TASK_CACHE = TaskCache()
+
+
+def load_task(domain_text, problem_text):
+    try:
+        problem = merge.parse_pddl_text(domain_text, problem_text)
+    except Exception as e:
+        raise UnsupportedTask(f"could not parse task: {e}") from e
+    return Task(problem)
+
+
+def validate(domain_text, problem_text, plan_text):
+    """
+    Validate plan_text on the domain/problem text. Returns a dict with keys: ok, valid,
+    returncode, stdout, stderr, failed_step, reason. Raises UnsupportedTask.
+    """
+    return validate_task(TASK_CACHE.get(domain_text, problem_text), plan_text)
+
+
+def validate_task(task, plan_text):
+    """validate() on an already loaded Task (see load_task), e.g. one kept by reference.py."""
+    try:
+        res = task.run(parse_plan(plan_text))
+    except ValueError as e:
+        res = _failed(1, "", str(e))
+
+    if res["executed"]:
+        lines = ["Plan executed successfully - checking goal", "Plan valid" if res["valid"] else "Plan invalid"]
+        if not res["valid"]:
+            lines.append(res["reason"])
+    else:
+        lines = [f"Step {res['failed_step']}: {res.get('failed_action', '')}", res["reason"], "Plan failed to execute"]
+    return {
+        "ok": res["executed"],
+        "valid": res["valid"],
+        "returncode": 0 if res["valid"] else 1,
+        "stdout": "\n".join(lines) + "\n",
+        "stderr": "",
+        "failed_step": res["failed_step"],
+        "reason": res["reason"],
+    }
+
+
+def validate_files(domain_path, problem_path, plan_path):
+    return validate(merge._read(domain_path), merge._read(problem_path), merge._read(plan_path))
+
+
+# -----------------------
+# Differential check against VAL
+# -----------------------
+def _cases(folder):
+    """(domain, problem, plan) triples under folder: every plan.<p> next to a domain.pddl and <p>."""
+    for root, _, files in sorted(os.walk(folder)):
+        if "domain.pddl" not in files:
+            continue
+        for name in sorted(files):
+            if name.startswith("plan.") and name[len("plan."):] in files:
+                yield os.path.join(root, "domain.pddl"), os.path.join(root, name[len("plan."):]), os.path.join(root, name)
+
+
+def _variants(plan_text):
+    """The plan itself plus broken versions of it: truncated, missing a step, steps swapped."""
+    lines = [l for l in plan_text.splitlines() if l.strip() and not l.strip().startswith(";")]
+    yield "as is", plan_text
+    if len(lines) > 1:
+        yield "truncated", "\n".join(lines[:-1])
+        yield "step 1 dropped", "\n".join(lines[1:])
+        yield "steps 1/2 swapped", "\n".join([lines[1], lines[0]] + lines[2:])
+
+
+def compare(folder="data"):
+    import subprocess
+    import tempfile
+
+    mismatches = total = 0
+    for domain, problem, plan in _cases(folder):
+        for label, text in _variants(merge._read(plan)):
+            with tempfile.NamedTemporaryFile("w", suffix=".plan", delete=False) as f:
+                f.write(text)
+            try:
+                out = subprocess.run(["./validate.sh", domain, problem, f.name], capture_output=True, text=True).stdout
+            finally:
+                os.remove(f.name)
+            val = ("Plan executed successfully" in out, "Plan valid" in out)
+            try:
+                res = validate(merge._read(domain), merge._read(problem), text)
+                native = (res["ok"], res["valid"])
+            except UnsupportedTask as e:
+                native = f"unsupported: {e}"
+            total += 1
+            if native != val:
+                mismatches += 1
+                print(f"MISMATCH {plan} ({label}): VAL {val}, native {native}")
+    print(f"{total} plans checked, {mismatches} mismatches")
+    return mismatches == 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "--compare":
+        sys.exit(0 if compare(*sys.argv[2:3]) else 1)
+    if len(sys.argv) != 4:
+        print(USAGE)
+        sys.exit(1)
+    try:
+        result = validate_files(*sys.argv[1:])
+    except UnsupportedTask as e:
+        print(f"Error: {e}")
+        sys.exit(2)
+    print(result["stdout"], end="")
+    sys.exit(result["returncode"])
@@ -0,0 +1,178 @@
+"""
+Per-request scratch space for planner/VAL input and output files.
+
+A grading request writes the submitted domain/problem (and the generated plan) once into a
+Workspace and every stage uses those paths; reference files are used where they are. Files
+are content-addressed (named by a hash of their text), so writing the same text twice, from
+any stage or thread, returns the path written the first time.
+
+Workspaces are directories under WORKSPACE_ROOT: $GRADER_WORKSPACE_DIR, else /dev/shm (tmpfs,
+so nothing hits the disk) when it is writable, else the system temp directory. They are
+removed when closed (use them as context managers) and at interpreter exit; a stage still
+inside use() when its request closes the workspace keeps it until it is done. A directory is
+named after the process that made it, so sweep(), run when a server starts, can remove the
+ones left behind by processes that crashed or were killed. A restarted server in a container
+often gets the pid of the one before it, so directories named after this very process are
+removed too unless one of its own Workspaces uses them.
+
+Usage:
+    with workspace.Workspace() as ws:
+        domain_path = ws.file(domain_text, ".pddl")
+        out_dir = ws.mkdir("plan-")
+"""
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from contextlib import contextmanager
+
+
+def _default_root():
+    if os.environ.get("GRADER_WORKSPACE_DIR"):
+        return os.environ["GRADER_WORKSPACE_DIR"]
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm/pddl-grader"
+    return os.path.join(tempfile.gettempdir(), "pddl-grader")
+
+
+WORKSPACE_ROOT = _default_root()
+# Workspaces older than this are swept even if their process still seems to exist (pid reuse)
+ORPHAN_MAX_AGE_SEC = 24 * 3600
+
+_LIVE = weakref.WeakSet()
+_LIVE_LOCK = threading.Lock()
+
+
+class Workspace:
+    def __init__(self, root=None):
+        self.root = root or WORKSPACE_ROOT
+        os.makedirs(self.root, exist_ok=True)
+        self.path = os.path.join(self.root, f"ws-{os.getpid()}-{uuid.uuid4().hex[:12]}")
+        os.mkdir(self.path)
+        self._lock = threading.Lock()
+        self._files = {}
+        self._users = 0
+        self.closed = False
+        with _LIVE_LOCK:
+            _LIVE.add(self)
+
+    def file(self, text, suffix=""):
+        """Path of a file in the workspace holding text, written on the first request only."""
+        data = (text or "").encode("utf-8")
+        name = hashlib.sha256(data).hexdigest()[:24] + suffix
+        with self._lock:
+            path = self._files.get(name)
+            if path is not None:
+                return path
+            path = os.path.join(self.path, name)
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self._files[name] = path
+            return path
+
+    def mkdir(self, prefix=""):
+        """A new, empty directory in the workspace (e.g. for one planner run's output)."""
+        return tempfile.mkdtemp(prefix=prefix, dir=self.path)
+
+    @contextmanager
+    def use(self):
+        """Keep the workspace from being removed while the block runs, even if it is closed meanwhile."""
+        with self._lock:
+            self._users += 1
+            if self.closed:
+                # Closed before this user got going: bring the directory back until it is done
+                os.makedirs(self.path, exist_ok=True)
+                self._files.clear()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._users -= 1
+                remove = self.closed and self._users == 0
+            if remove:
+                shutil.rmtree(self.path, ignore_errors=True)
+
+    def close(self):
+        with self._lock:
+            already = self.closed
+            self.closed = True
+            if already or self._users:
+                return
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+@contextmanager
+def scope(ws=None):
+    """ws itself if given (left open for its owner, but kept while in use), else a fresh Workspace closed on exit."""
+    if ws is not None:
+        with ws.use():
+            yield ws
+        return
+    with Workspace() as fresh:
+        yield fresh
+
+
+def sweep(root=None, *, max_age_sec=ORPHAN_MAX_AGE_SEC):
+    """
+    Remove workspaces whose process is gone, that an earlier process with this one's pid left
+    behind, or that are older than max_age_sec. Returns how many.
+    """
+    root = root or WORKSPACE_ROOT
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return 0
+    with _LIVE_LOCK:
+        mine = {os.path.normpath(ws.path) for ws in _LIVE}
+    removed = 0
+    now = time.time()
+    for name in names:
+        parts = name.split("-")
+        if len(parts) != 3 or parts[0] != "ws" or not parts[1].isdigit():
+            continue
+        path = os.path.join(root, name)
+        pid = int(parts[1])
+        try:
+            age = now - os.stat(path).st_mtime
+        except FileNotFoundError:
+            continue
+        if pid == os.getpid():
+            if os.path.normpath(path) in mine:
+                continue
+        elif _alive(pid) and age < max_age_sec:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    return removed
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@atexit.register
+def _close_all():
+    with _LIVE_LOCK:
+        live = list(_LIVE)
+    for ws in live:
+        ws.close()